@@ -6,7 +6,8 @@ import sys
 # iCE experiment API
 #
 
-from .tasks import Callable, Runner, ParallelRunner, Task, ParallelTask
+from .tasks import Callable, Runner, ParallelRunner, AsyncRunner, Task, \
+    ParallelTask, RetryPolicy, retry
 
 #
 # iCE Version
@@ -0,0 +1,169 @@
+"""Incremental reducers of task results."""
+import heapq
+import itertools
+import math
+
+
+class Reducer(object):
+    """Reduces the results of a task one host at a time, as hosts complete,
+    so that the results need not be kept.
+
+    :type key: callable
+    """
+
+    def __init__(self, key=None):
+        """
+        :param callable key: If set, it is called with the result of each
+            host and the value it returns is reduced instead.
+        """
+        self.key = key
+
+    def add(self, host_string, result):
+        """Adds the result of a host.
+
+        :param str host_string: The host string.
+        :param object result: The value the task returned on the host.
+        """
+        if self.key is not None:
+            result = self.key(result)
+        self._add(host_string, result)
+
+    def get_result(self):
+        """
+        :rtype: object
+        :return: The reduction of the results added so far.
+        """
+        raise NotImplementedError()
+
+    def _add(self, host_string, value):
+        raise NotImplementedError()
+
+
+class Count(Reducer):
+    """Counts the hosts."""
+
+    def __init__(self, key=None):
+        super(Count, self).__init__(key)
+        self.count = 0
+
+    def get_result(self):
+        return self.count
+
+    def _add(self, host_string, value):
+        self.count += 1
+
+
+class Sum(Reducer):
+    """Sums the results."""
+
+    def __init__(self, key=None):
+        super(Sum, self).__init__(key)
+        self.total = 0
+
+    def get_result(self):
+        return self.total
+
+    def _add(self, host_string, value):
+        self.total += value
+
+
+class Mean(Reducer):
+    """Averages the results."""
+
+    def __init__(self, key=None):
+        super(Mean, self).__init__(key)
+        self.count = 0
+        self.total = 0
+
+    def get_result(self):
+        """
+        :rtype: float
+        :return: The mean or `None` if there are no results.
+        """
+        if self.count == 0:
+            return None
+        return float(self.total) / self.count
+
+    def _add(self, host_string, value):
+        self.count += 1
+        self.total += value
+
+
+class Histogram(Reducer):
+    """Counts the hosts per result or, for numbers, per range of results."""
+
+    def __init__(self, key=None, bin_width=None):
+        """
+        :param callable key: See `Reducer`.
+        :param float bin_width: If set, results are counted in bins of this
+            width, each named after its lower bound.
+        """
+        super(Histogram, self).__init__(key)
+        self.bin_width = bin_width
+        self.counts = {}
+
+    def get_result(self):
+        """
+        :rtype: dict
+        :return: The number of hosts per result or bin.
+        """
+        return dict(self.counts)
+
+    def _add(self, host_string, value):
+        if self.bin_width is not None:
+            value = math.floor(value / float(self.bin_width)) * self.bin_width
+        self.counts[value] = self.counts.get(value, 0) + 1
+
+
+class TopK(Reducer):
+    """Keeps the hosts with the largest results."""
+
+    def __init__(self, k, key=None):
+        """
+        :param int k: The number of hosts to keep.
+        :param callable key: See `Reducer`.
+        """
+        super(TopK, self).__init__(key)
+        self.k = k
+        self._heap = []  # (value, order, host string), smallest first
+        self._order = itertools.count()
+
+    def get_result(self):
+        """
+        :rtype: list
+        :return: Tuples with the host string and the result of the hosts,
+            largest first.
+        """
+        return [
+            (host_string, value)
+            for value, _, host_string in sorted(self._heap, reverse=True)
+        ]
+
+    def _add(self, host_string, value):
+        # Earlier hosts win ties
+        item = (value, -next(self._order), host_string)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, item)
+        elif item > self._heap[0]:
+            heapq.heapreplace(self._heap, item)
+
+
+class Reduce(Reducer):
+    """Reduces the results with a function, like the `reduce` built-in."""
+
+    def __init__(self, func, initial, key=None):
+        """
+        :param callable func: It is called with the reduction so far and the
+            result of a host and returns the new reduction.
+        :param object initial: The reduction of no results.
+        :param callable key: See `Reducer`.
+        """
+        super(Reduce, self).__init__(key)
+        self.func = func
+        self.value = initial
+
+    def get_result(self):
+        return self.value
+
+    def _add(self, host_string, value):
+        self.value = self.func(self.value, value)
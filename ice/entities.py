@@ -1,4 +1,9 @@
 """iCE entities."""
+import bisect
+import copy
+import gc
+import socket
+import struct
 
 
 #
@@ -14,7 +19,60 @@ class Entity(object):
     :type etag: str
     """
 
+    __slots__ = ('id', 'created', 'updated', 'etag')
+
+    # Attributes stored in the registry, i.e. the ones `to_dict` returns
+    FIELDS = ()
+
     def __init__(self, **kwargs):
+        self._load(kwargs)
+
+    def __getstate__(self):
+        # Classes with `__slots__` have no `__dict__` to pickle, except with
+        # pickle protocol 2
+        state = {}
+        for cls in type(self).__mro__:
+            for key in getattr(cls, '__slots__', ()):
+                if hasattr(self, key):
+                    state[key] = getattr(self, key)
+        return state
+
+    def __setstate__(self, state):
+        for key, value in state.items():
+            setattr(self, key, value)
+
+    @classmethod
+    def from_dicts(cls, items):
+        """Creates entities out of a list of dictionaries, e.g.: the items of
+        a registry listing.
+
+        It is faster than calling the constructor for each dictionary.
+
+        :param list items: List of dictionaries.
+        :rtype: list
+        :return: List of entities.
+        """
+        new = cls.__new__
+        entities = []
+        # Entities hold no reference cycles, so garbage collection passes
+        # triggered by the allocations are wasted.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for item in items:
+                entity = new(cls)
+                entity._load(item)
+                entities.append(entity)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        return entities
+
+    def _load(self, kwargs):
+        """Sets the attributes of the entity.
+
+        :param dict kwargs: The attributes, as stored in the registry.
+        """
         # MongoDB stuff
         self.id = kwargs.get('_id', None)
         self.created = kwargs.get('_created', None)
@@ -29,14 +87,10 @@ class Entity(object):
         :return: A Python dictionary with the attributes of the entity.
         """
         _dict = {}
-        for key, value in self.__dict__.items():
-            if value is None:
-                continue
-            if key.startswith('_'):
-                continue
-            if key in ['id', 'created', 'updated', 'etag']:  # TODO
-                continue
-            _dict[key] = value
+        for key in self.FIELDS:
+            value = getattr(self, key)
+            if value is not None:
+                _dict[key] = value
         return _dict
 
 
@@ -50,8 +104,12 @@ class Session(Entity):
     :type client_ip_addr: str
     """
 
-    def __init__(self, **kwargs):
-        super(Session, self).__init__(**kwargs)
+    __slots__ = ('client_ip_addr',)
+
+    FIELDS = ('client_ip_addr',)
+
+    def _load(self, kwargs):
+        super(Session, self)._load(kwargs)
 
         # Attributes
         self.client_ip_addr = kwargs['client_ip_addr']
@@ -72,28 +130,45 @@ class Instance(Entity):
     :type ssh_port: int
     :type ssh_authorized_fingerprint: str
     :type tags: dict
+    :type last_seen: datetime.datetime
     """
 
+    __slots__ = (
+        'session_id', 'networks', 'public_ip_addr', 'public_reverse_dns',
+        'ssh_port', 'ssh_username', 'ssh_authorized_fingerprint', 'tags',
+        'last_seen'
+    )
+
+    FIELDS = (
+        'session_id', 'networks', 'public_ip_addr', 'public_reverse_dns',
+        'ssh_port', 'ssh_username', 'ssh_authorized_fingerprint', 'tags'
+    )
+
+    NETWORK_KEYS = frozenset(['addr', 'iface', 'bcast_addr'])
+
     #
     # Constructor
     #
 
-    def __init__(self, **kwargs):
-        super(Instance, self).__init__(**kwargs)
+    def _load(self, kwargs):
+        super(Instance, self)._load(kwargs)
 
         # Session
         self.session_id = kwargs['session_id']
 
         # Networking
         self.networks = []
-        for net in kwargs.get('networks', []):
-            my_net = {
-                'addr': net['addr']
-            }
-            if 'iface' in net:
-                my_net['iface'] = net['iface']
-            if 'bcast_addr' in net:
-                my_net['bcast_addr'] = net['bcast_addr']
+        for net in kwargs.get('networks', ()):
+            if self.NETWORK_KEYS.issuperset(net) and 'addr' in net:
+                my_net = dict(net)
+            else:
+                my_net = {
+                    'addr': net['addr']
+                }
+                if 'iface' in net:
+                    my_net['iface'] = net['iface']
+                if 'bcast_addr' in net:
+                    my_net['bcast_addr'] = net['bcast_addr']
             self.networks.append(my_net)
 
         # Public network
@@ -108,7 +183,28 @@ class Instance(Entity):
         )
 
         # Tags
-        self.tags = kwargs.get('tags', {})
+        self.tags = copy.copy(kwargs.get('tags', {}))
+
+        # Heartbeats
+        self.last_seen = kwargs.get('last_seen', None)
+
+    @classmethod
+    def from_partial(cls, **kwargs):
+        """Creates an instance out of a partially-populated record, e.g.: a
+        listing with a projection.
+
+        :rtype: Instance
+        :return: The instance. Missing attributes are set to `None`, rather
+            than to their default values, so that they are not mistaken for
+            the ones of the instance, e.g.: its SSH port.
+        """
+        kwargs.setdefault('session_id', None)
+        kwargs.setdefault('public_ip_addr', None)
+        inst = cls(**kwargs)
+        for key in cls.FIELDS:
+            if key not in kwargs:
+                setattr(inst, key, None)
+        return inst
 
     #
     # Setters
@@ -130,3 +226,266 @@ class Instance(Entity):
         if bcast_addr is not None:
             my_net['bcast_addr'] = bcast_addr
         self.networks.append(my_net)
+
+
+#
+# IPv4 addresses
+#
+
+def parse_ipv4_addr(addr):
+    """Parses an IPv4 address, optionally followed by a mask (e.g.:
+    `192.168.1.12/24`).
+
+    :param str addr: The address.
+    :rtype: int
+    :return: The address as a number or `None` if it is not valid.
+    """
+    if addr is None:
+        return None
+    addr = addr.split('/', 1)[0]
+    try:
+        return struct.unpack('!I', socket.inet_aton(addr))[0]
+    except (socket.error, struct.error):
+        return None
+
+
+def parse_ipv4_network(cidr):
+    """Parses an IPv4 network in CIDR notation (e.g.: `192.168.1.0/24`). A
+    plain address is a network of one address.
+
+    :param str cidr: The network.
+    :rtype: tuple
+    :return: The first address of the network, as a number, in the first
+        element and the last one in the second.
+    :raises ValueError: If the network is not valid.
+    """
+    if '/' in cidr:
+        addr, prefix_len = cidr.split('/', 1)
+    else:
+        addr, prefix_len = cidr, '32'
+    addr_num = parse_ipv4_addr(addr)
+    if addr_num is None or not prefix_len.isdigit() or int(prefix_len) > 32:
+        raise ValueError('Invalid network `%s`' % cidr)
+    host_bits = 32 - int(prefix_len)
+    first = (addr_num >> host_bits) << host_bits
+    return first, first + (1 << host_bits) - 1
+
+
+#
+# Instance set class
+#
+
+class InstanceSet(object):
+    """An immutable set of instances, indexed for fast selections.
+
+    The attributes used in selections are stored column-wise and indexed
+    once, when the set is created. Instance sets iterate, index and count
+    like lists of `Instance` objects in their original order, so they can
+    be passed wherever a list of instances is expected.
+    """
+
+    def __init__(self, insts=()):
+        """Creates an instance set.
+
+        :param list insts: The instances. Instances with the same id are
+            only kept once.
+        """
+        self._insts = []
+        seen_keys = set()
+        for inst in insts:
+            key = self._get_key(inst)
+            if key in seen_keys:
+                continue
+            seen_keys.add(key)
+            self._insts.append(inst)
+
+        # Columns
+        self._session_ids = [inst.session_id for inst in self._insts]
+        self._public_ip_addrs = [inst.public_ip_addr for inst in self._insts]
+        # Instances listed with a projection may lack tags and networks
+        self._tags = [inst.tags or {} for inst in self._insts]
+
+        # Indexes
+        self._session_index = self._build_index(self._session_ids)
+        self._public_ip_index = self._build_index(self._public_ip_addrs)
+        self._tag_index = {}
+        for pos, tags in enumerate(self._tags):
+            for key, value in tags.items():
+                key_index = self._tag_index.setdefault(key, {})
+                key_index.setdefault(value, set()).add(pos)
+        self._addr_index = []  # sorted (address, position) tuples
+        for pos, inst in enumerate(self._insts):
+            addrs = [inst.public_ip_addr] + [
+                net['addr'] for net in inst.networks or ()
+            ]
+            for addr in addrs:
+                addr_num = parse_ipv4_addr(addr)
+                if addr_num is not None:
+                    self._addr_index.append((addr_num, pos))
+        self._addr_index.sort()
+
+    #
+    # List behaviour
+    #
+
+    def __iter__(self):
+        return iter(self._insts)
+
+    def __len__(self):
+        return len(self._insts)
+
+    def __getitem__(self, ind):
+        if isinstance(ind, slice):
+            return InstanceSet(self._insts[ind])
+        return self._insts[ind]
+
+    def __contains__(self, inst):
+        return self._get_key(inst) in self._get_keys()
+
+    def __repr__(self):
+        return 'InstanceSet(%r)' % self._insts
+
+    #
+    # Selections
+    #
+
+    def filter(self, tag=None, cidr=None, session_id=None,
+               public_ip_addr=None):
+        """Selects the instances that match all the given criteria.
+
+        :param str|dict tag: A tag key (e.g.: `role`), a tag key and value
+            (e.g.: `role=worker`) or a dictionary of tag keys and values.
+        :param str cidr: A network (e.g.: `192.168.1.0/24`) the public or a
+            private address of the instances belongs to.
+        :param str session_id: The session id.
+        :param str public_ip_addr: The public IP address.
+        :rtype: InstanceSet
+        :return: The matching instances.
+        """
+        positions = None
+        if tag is not None:
+            if isinstance(tag, dict):
+                tags = tag.items()
+            elif '=' in tag:
+                tags = [tag.split('=', 1)]
+            else:
+                tags = [(tag, None)]
+            for key, value in tags:
+                positions = self._intersect(
+                    positions, self._select_tag(key, value)
+                )
+        if cidr is not None:
+            positions = self._intersect(positions, self._select_cidr(cidr))
+        if session_id is not None:
+            positions = self._intersect(
+                positions, self._session_index.get(session_id, set())
+            )
+        if public_ip_addr is not None:
+            positions = self._intersect(
+                positions, self._public_ip_index.get(public_ip_addr, set())
+            )
+
+        if positions is None:
+            return self
+        return InstanceSet(self._insts[pos] for pos in sorted(positions))
+
+    def group_by(self, tag_key):
+        """Groups the instances by the value of a tag.
+
+        :param str tag_key: The tag key.
+        :rtype: dict
+        :return: A dictionary mapping each tag value to the `InstanceSet` of
+            the instances with that value. Instances without the tag are
+            left out.
+        """
+        groups = {}
+        for value, positions in self._tag_index.get(tag_key, {}).items():
+            groups[value] = InstanceSet(
+                self._insts[pos] for pos in sorted(positions)
+            )
+        return groups
+
+    #
+    # Set operations
+    #
+
+    def union(self, other):
+        """
+        :rtype: InstanceSet
+        :return: The instances of this or the other set.
+        """
+        return InstanceSet(self._insts + list(other))
+
+    def intersection(self, other):
+        """
+        :rtype: InstanceSet
+        :return: The instances of this set that are also in the other set.
+        """
+        other_keys = set(self._get_key(inst) for inst in other)
+        return InstanceSet(
+            inst for inst in self._insts
+            if self._get_key(inst) in other_keys
+        )
+
+    def difference(self, other):
+        """
+        :rtype: InstanceSet
+        :return: The instances of this set that are not in the other set.
+        """
+        other_keys = set(self._get_key(inst) for inst in other)
+        return InstanceSet(
+            inst for inst in self._insts
+            if self._get_key(inst) not in other_keys
+        )
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+    #
+    # Helpers
+    #
+
+    def _get_key(self, inst):
+        """Gets the identity of an instance in the set; its id or, for
+        instances not stored in the registry, the object itself.
+        """
+        if inst.id is None:
+            return id(inst)
+        return inst.id
+
+    def _get_keys(self):
+        keys = getattr(self, '_keys', None)
+        if keys is None:
+            keys = self._keys = set(self._get_key(inst) for inst in self)
+        return keys
+
+    def _build_index(self, column):
+        index = {}
+        for pos, value in enumerate(column):
+            index.setdefault(value, set()).add(pos)
+        return index
+
+    def _intersect(self, positions, new_positions):
+        if positions is None:
+            return set(new_positions)
+        return positions & new_positions
+
+    def _select_tag(self, key, value):
+        key_index = self._tag_index.get(key, {})
+        if value is not None:
+            return key_index.get(value, set())
+        positions = set()
+        for value_positions in key_index.values():
+            positions |= value_positions
+        return positions
+
+    def _select_cidr(self, cidr):
+        first, last = parse_ipv4_network(cidr)
+        start = bisect.bisect_left(self._addr_index, (first, -1))
+        positions = set()
+        for addr_num, pos in self._addr_index[start:]:
+            if addr_num > last:
+                break
+            positions.add(pos)
+        return positions
@@ -0,0 +1,1040 @@
+"""Bounded execution of experiment tasks over many hosts."""
+import atexit
+import bisect
+import collections
+import multiprocessing
+import os
+import select
+import signal
+import socket
+import time
+import zlib
+from multiprocessing.pool import ThreadPool
+from fabric import api as fabric_api
+from fabric import network as fabric_network
+from fabric import state as fabric_state
+
+
+class HostError(Exception):
+    """A task failed on a host with an error that could not be sent back from
+    the worker as is, e.g.: a Fabric abort."""
+    pass
+
+
+class HostTimeoutError(Exception):
+    pass
+
+
+class HostUnreachableError(Exception):
+    pass
+
+
+class HostResult(object):
+    """The outcome of a task on a host.
+
+    :type instance: ice.entities.Instance
+    :type host_string: str
+    :type status: str
+    :type result: object
+    :type error: Exception
+    :type start_time: float
+    :type end_time: float
+    :type attempts: int
+    """
+
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    TIMED_OUT = 'timed_out'
+    SKIPPED = 'skipped'
+    UNREACHABLE = 'unreachable'
+
+    def __init__(self, instance, host_string, status, result=None,
+                 error=None, start_time=None, end_time=None, attempts=0):
+        self.instance = instance
+        self.host_string = host_string
+        self.status = status
+        self.result = result
+        self.error = error
+        self.start_time = start_time
+        self.end_time = end_time
+        # The number of times the task ran on the host, with retries
+        self.attempts = attempts
+
+    @property
+    def succeeded(self):
+        return self.status == HostResult.SUCCEEDED
+
+    @property
+    def failed(self):
+        return self.status in (HostResult.FAILED, HostResult.TIMED_OUT)
+
+    def as_tuple(self):
+        """
+        :rtype: tuple
+        :return: The instance, the result, the duration and the error.
+        """
+        return self.instance, self.result, self.duration(), self.error
+
+    def duration(self):
+        """
+        :rtype: float
+        :return: The number of seconds the task ran for or `None` if it did
+            not run.
+        """
+        if self.start_time is None or self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    def __repr__(self):
+        return 'HostResult(%s, %s)' % (self.host_string, self.status)
+
+
+class RunResults(dict):
+    """The results of a task, mapping each host string to the value the task
+    returned or, for hosts it failed on, to the error. This is what
+    `fabric.api.execute` returns with `skip_bad_hosts` set.
+
+    :type host_results: list
+    :type aggregates: dict
+    :type aggregate_errors: dict
+    """
+
+    def __init__(self, host_results, aggregates=None, aggregate_errors=None):
+        """
+        :param list host_results: The `HostResult` objects, in the order of
+            the hosts.
+        :param dict aggregates: The reductions of the results, by name.
+        :param dict aggregate_errors: The errors the results of some hosts
+            could not be reduced with, as dictionaries from the host string
+            to the error, by the name of the reduction.
+        """
+        super(RunResults, self).__init__(
+            (res.host_string, res.result if res.succeeded else res.error)
+            for res in host_results
+        )
+        self.host_results = host_results
+        self.aggregates = aggregates or {}
+        self.aggregate_errors = aggregate_errors or {}
+
+    def get_succeeded(self):
+        return [res for res in self.host_results if res.succeeded]
+
+    def get_failed(self):
+        return [res for res in self.host_results if res.failed]
+
+    def get_skipped(self):
+        return [
+            res for res in self.host_results
+            if res.status == HostResult.SKIPPED
+        ]
+
+    def get_unreachable(self):
+        return [
+            res for res in self.host_results
+            if res.status == HostResult.UNREACHABLE
+        ]
+
+    @classmethod
+    def merge(cls, results_list, host_strings=None):
+        """Merges the results of the shards of a run, e.g.: the ones each
+        cooperating client host ran.
+
+        :param list results_list: The `RunResults` objects.
+        :param list host_strings: If set, the host results are ordered as
+            the hosts are in this list, as if a single client ran them all.
+        :rtype: RunResults
+        """
+        host_results = [
+            res for results in results_list for res in results.host_results
+        ]
+        if host_strings is not None:
+            order = dict(
+                (host_string, pos)
+                for pos, host_string in enumerate(host_strings)
+            )
+            host_results.sort(
+                key=lambda res: order.get(res.host_string, len(order))
+            )
+        return cls(host_results)
+
+
+class ExecutionEngine(object):
+    """Runs the tasks of an experiment module on a bounded pool of worker
+    processes.
+
+    Workers are forked from the current process, so they see the module as
+    it is when they start, and are kept across runs. Each runs a task on one
+    host at a time.
+
+    :type logger: logging.Logger
+    :type module: module
+    :type max_workers: int
+    :type max_idle: float
+    """
+
+    def __init__(self, logger, module, max_workers=10, max_idle=300):
+        """Creates an execution engine. Workers are started on demand.
+
+        :param logging.Logger logger: The logger object.
+        :param module module: The experiment module.
+        :param int max_workers: The maximum number of worker processes.
+        :param float max_idle: The number of seconds workers keep unused SSH
+            connections open for.
+        """
+        self.logger = logger
+        self.module = module
+        self.max_workers = max_workers
+        self.max_idle = max_idle
+        self._workers = []
+        self._ssh_conns = None  # of the tasks run in the current process
+
+    def run(self, func_name, targets, args, settings, pool_size=None,
+            timeout=None, batch_size=None, max_failures=None, callback=None,
+            probe_timeout=None, defer_unreachable=False, keep_results=True,
+            in_process=False):
+        """Runs a task once per host.
+
+        :param str func_name: The name of the task in the module.
+        :param list targets: Tuples with an `ice.entities.Instance` instance
+            in the first element and its host string in the second.
+        :param list args: The arguments to pass to the task.
+        :param dict settings: Fabric settings to run the task with.
+        :param int pool_size: The number of hosts to run the task on
+            concurrently. It is capped by `max_workers`.
+        :param float timeout: The maximum number of seconds the task may run
+            for on a host. Workers exceeding it are killed.
+        :param int batch_size: If set, hosts are run in consecutive batches
+            of this size; a batch starts once the previous one completes.
+        :param int max_failures: If set, no more hosts are started once the
+            task has failed on more hosts than this.
+        :param callable callback: If set, it is called with the `HostResult`
+            of each host as it completes.
+        :param float probe_timeout: If set, the SSH port of every host is
+            probed first, waiting this many seconds per host, and the task
+            does not run on the hosts that are unreachable.
+        :param bool defer_unreachable: If set, unreachable hosts are probed
+            again once the task completes on the rest and the task runs on
+            the ones that have become reachable, e.g.: booted.
+        :param bool keep_results: If not set, the values the task returns are
+            dropped once `callback` is called, e.g.: once reduced.
+        :param bool in_process: If set, the task runs on one host at a time
+            in the current process, so that it can change the state of the
+            module or prompt on the terminal, rather than on the workers.
+            `pool_size` and `timeout` do not apply then.
+        :rtype: RunResults
+        """
+        host_results = [None] * len(targets)
+        settings = _get_run_settings(settings, targets)
+        for pos, host_result in self._iter_probed_run(
+            func_name, targets, args, settings, pool_size, timeout,
+            batch_size, max_failures, probe_timeout, defer_unreachable,
+            in_process
+        ):
+            host_results[pos] = host_result
+            if callback is not None:
+                callback(host_result)
+            if not keep_results:
+                host_result.result = None
+        return RunResults(host_results)
+
+    def iter_run(self, func_name, targets, args, settings, pool_size=None,
+                 timeout=None, batch_size=None, max_failures=None,
+                 probe_timeout=None, defer_unreachable=False,
+                 in_process=False):
+        """Runs a task once per host, reporting each host as it completes.
+
+        The parameters are the same as the ones of `run`. Closing the
+        generator early kills the workers of the hosts still running.
+
+        :rtype: generator
+        :return: Generator of `HostResult` objects, in the order the hosts
+            complete.
+        """
+        settings = _get_run_settings(settings, targets)
+        for _, host_result in self._iter_probed_run(
+            func_name, targets, args, settings, pool_size, timeout,
+            batch_size, max_failures, probe_timeout, defer_unreachable,
+            in_process
+        ):
+            yield host_result
+
+    def close(self):
+        """Stops the worker processes."""
+        for worker in self._workers:
+            worker.stop()
+        self._workers = []
+        if self._ssh_conns is not None:
+            self._ssh_conns.close()
+            self._ssh_conns = None
+
+    def _iter_probed_run(self, func_name, targets, args, settings, pool_size,
+                         timeout, batch_size, max_failures, probe_timeout,
+                         defer_unreachable, in_process):
+        """Runs a task once per reachable host.
+
+        :rtype: generator
+        :return: Generator of tuples with the position of the host in
+            `targets` in the first element and its `HostResult` in the
+            second, in the order the hosts complete.
+        """
+        if probe_timeout is None:
+            for pos, host_result in self._iter_run(
+                func_name, targets, args, settings, pool_size, timeout,
+                batch_size, max_failures, in_process
+            ):
+                yield pos, host_result
+            return
+
+        positions = range(len(targets))
+        for attempt in range(2 if defer_unreachable else 1):
+            reachable_flags = probe_hosts(
+                [get_address(targets[pos][1]) for pos in positions],
+                probe_timeout
+            )
+            reachable = []
+            unreachable = []
+            for pos, is_reachable in zip(positions, reachable_flags):
+                (reachable if is_reachable else unreachable).append(pos)
+            if len(unreachable) > 0:
+                self.logger.warning(
+                    '%d host(s) are unreachable: %s' % (
+                        len(unreachable),
+                        ', '.join(targets[pos][1] for pos in unreachable)
+                    )
+                )
+
+            for ind, host_result in self._iter_run(
+                func_name, [targets[pos] for pos in reachable], args,
+                settings, pool_size, timeout, batch_size, max_failures,
+                in_process
+            ):
+                yield reachable[ind], host_result
+            positions = unreachable
+
+        for pos in positions:
+            yield pos, HostResult(
+                targets[pos][0], targets[pos][1], HostResult.UNREACHABLE,
+                error=HostUnreachableError(
+                    'SSH port is not reachable in %s seconds' % probe_timeout
+                )
+            )
+
+    def _iter_run(self, func_name, targets, args, settings, pool_size,
+                  timeout, batch_size, max_failures, in_process):
+        """Runs a task once per host.
+
+        Each host is queued on the worker its host string hashes to, so that
+        consecutive runs reuse the SSH connection that worker keeps. Idle
+        workers take hosts from the longest queue when theirs is empty.
+
+        :rtype: generator
+        :return: Generator of tuples with the position of the host in
+            `targets` in the first element and its `HostResult` in the
+            second, in the order the hosts complete.
+        """
+        if len(targets) == 0:
+            return
+        if in_process:
+            for pos, host_result in self._iter_local_run(
+                func_name, targets, args, settings, max_failures
+            ):
+                yield pos, host_result
+            return
+        if pool_size is None or pool_size > self.max_workers:
+            pool_size = self.max_workers
+        pool_size = max(1, pool_size)
+        if batch_size is None:
+            batch_size = len(targets)
+        run_msg = ('run', func_name, args, settings)
+        workers = self._get_workers(pool_size)
+        for worker in workers:
+            worker.send(run_msg)
+
+        failures = 0
+        for batch_start in range(0, len(targets), batch_size):
+            positions = range(
+                batch_start, min(batch_start + batch_size, len(targets))
+            )
+            if max_failures is not None and failures > max_failures:
+                for pos in positions:
+                    yield pos, HostResult(
+                        targets[pos][0], targets[pos][1], HostResult.SKIPPED
+                    )
+                continue
+
+            queues = [collections.deque() for _ in workers]
+            for pos in positions:
+                ind = self._get_worker_index(targets[pos][1], len(workers))
+                queues[ind].append(pos)
+            running = {}  # worker index -> (position, start time)
+            try:
+                while True:
+                    if max_failures is None or failures <= max_failures:
+                        self._start_hosts(workers, queues, running, targets)
+                    if len(running) == 0:
+                        break
+                    for pos, host_result in self._wait_hosts(
+                        func_name, workers, running, targets, timeout,
+                        run_msg
+                    ):
+                        if host_result.failed:
+                            failures += 1
+                        yield pos, host_result
+            finally:
+                # The generator is closed or failed early
+                for ind in running:
+                    self._replace_worker(workers, ind, run_msg)
+
+            # Hosts left over when failures exceeded the limit
+            for queue in queues:
+                for pos in sorted(queue):
+                    yield pos, HostResult(
+                        targets[pos][0], targets[pos][1], HostResult.SKIPPED
+                    )
+
+    def _iter_local_run(self, func_name, targets, args, settings,
+                        max_failures):
+        """Runs a task once per host, one host at a time, in the current
+        process.
+
+        :rtype: generator
+        :return: Generator of tuples with the position of the host in
+            `targets` in the first element and its `HostResult` in the
+            second.
+        """
+        func = getattr(self.module, func_name)
+        if self._ssh_conns is None:
+            self._ssh_conns = ConnectionCache(self.max_idle)
+        failures = 0
+        for pos, (inst, host_string) in enumerate(targets):
+            if max_failures is not None and failures > max_failures:
+                yield pos, HostResult(inst, host_string, HostResult.SKIPPED)
+                continue
+            self._ssh_conns.evict_idle()
+            start_time = time.time()
+            succeeded, value, attempts = _run_host(
+                func, args, settings, host_string, self._ssh_conns
+            )
+            host_result = _get_host_result(
+                inst, host_string, succeeded, value, start_time, time.time(),
+                attempts
+            )
+            if host_result.failed:
+                failures += 1
+            yield pos, host_result
+
+    def _start_hosts(self, workers, queues, running, targets):
+        """Starts hosts on the idle workers, from their own queues first and
+        then from the longest ones."""
+        idle = [ind for ind in range(len(workers)) if ind not in running]
+        for ind in idle:
+            if len(queues[ind]) > 0:
+                pos = queues[ind].popleft()
+                workers[ind].send(('host', targets[pos][1]))
+                running[ind] = (pos, time.time())
+        for ind in idle:
+            queue = max(queues, key=len)
+            if ind in running or len(queue) == 0:
+                continue
+            pos = queue.pop()
+            workers[ind].send(('host', targets[pos][1]))
+            running[ind] = (pos, time.time())
+
+    def _wait_hosts(self, func_name, workers, running, targets, timeout,
+                    run_msg):
+        """Waits for running hosts to complete or time out.
+
+        :rtype: list
+        :return: Tuples with the position and the `HostResult` of the hosts
+            that completed, which are removed from `running`.
+        """
+        wait_secs = None
+        if timeout is not None:
+            first_start = min(start for _, start in running.values())
+            wait_secs = max(0, first_start + timeout - time.time())
+        ready, _, _ = select.select(
+            [workers[ind].conn for ind in running], [], [], wait_secs
+        )
+
+        completed = []
+        now = time.time()
+        for ind in running.keys():
+            worker = workers[ind]
+            pos, start_time = running[ind]
+            inst, host_string = targets[pos]
+            attempts = 1
+            if worker.conn in ready:
+                try:
+                    succeeded, value, attempts = worker.conn.recv()
+                except EOFError:
+                    succeeded, value = False, HostError(
+                        'Worker process exited'
+                    )
+                    self._replace_worker(workers, ind, run_msg)
+                except Exception as err:  # e.g.: unknown result class
+                    succeeded, value = False, HostError(
+                        'Result could not be received: %s' % err
+                    )
+            elif timeout is not None and now - start_time >= timeout:
+                succeeded, value = False, HostTimeoutError(
+                    'Timed out after %s seconds' % timeout
+                )
+                self.logger.warning(
+                    'Task `%s` timed out on `%s`' % (func_name, host_string)
+                )
+                self._replace_worker(workers, ind, run_msg)
+            else:
+                continue
+
+            del running[ind]
+            completed.append((pos, _get_host_result(
+                inst, host_string, succeeded, value, start_time, now, attempts
+            )))
+        return completed
+
+    def _get_worker_index(self, host_string, count):
+        return _hash(host_string) % count
+
+    def _get_workers(self, count):
+        while len(self._workers) < count:
+            self._workers.append(_Worker(self.module, self.max_idle))
+        return self._workers[:count]
+
+    def _replace_worker(self, workers, ind, run_msg):
+        workers[ind].kill()
+        workers[ind] = self._workers[ind] = _Worker(
+            self.module, self.max_idle
+        )
+        workers[ind].send(run_msg)
+
+
+class ShardedExecutionEngine(ExecutionEngine):
+    """Runs the tasks of an experiment module on several driver processes,
+    each with an `ExecutionEngine` of its own.
+
+    Hosts are assigned to drivers by consistent hashing on the id of their
+    instance, so a host is run by the same driver, and reuses its SSH
+    connections, across runs and few hosts move when the number of shards
+    changes. The results are merged as the hosts complete and are the same
+    as the ones of an `ExecutionEngine`. The `pool_size`, `batch_size` and
+    `max_failures` options apply to each shard.
+
+    :type shard_count: int
+    """
+
+    def __init__(self, logger, module, shard_count, max_workers=10,
+                 max_idle=300):
+        """Creates a sharded execution engine. Drivers are started on
+        demand.
+
+        :param logging.Logger logger: The logger object.
+        :param module module: The experiment module.
+        :param int shard_count: The number of driver processes.
+        :param int max_workers: The maximum number of worker processes of
+            each driver.
+        :param float max_idle: The number of seconds workers keep unused SSH
+            connections open for.
+        """
+        super(ShardedExecutionEngine, self).__init__(
+            logger, module, max_workers, max_idle
+        )
+        self.shard_count = shard_count
+        self.ring = HashRing(shard_count)
+        self._drivers = []
+
+    def close(self):
+        """Stops the driver processes and their workers."""
+        for driver in self._drivers:
+            driver.stop()
+        self._drivers = []
+
+    def _iter_probed_run(self, func_name, targets, args, settings, pool_size,
+                         timeout, batch_size, max_failures, probe_timeout,
+                         defer_unreachable, in_process):
+        """Runs a task once per host, on the drivers of the shards.
+
+        :rtype: generator
+        :return: Generator of tuples with the position of the host in
+            `targets` in the first element and its `HostResult` in the
+            second, in the order the hosts complete.
+        """
+        if len(targets) == 0:
+            return
+        shards = [[] for _ in range(self.shard_count)]
+        for pos, (inst, host_string) in enumerate(targets):
+            shard = self.ring.get_shard(get_shard_key(inst, host_string))
+            shards[shard].append(pos)
+        options = (
+            pool_size, timeout, batch_size, max_failures, probe_timeout,
+            defer_unreachable, in_process
+        )
+
+        drivers = self._get_drivers()
+        running = {}  # driver index -> positions of the hosts not reported
+        for ind, positions in enumerate(shards):
+            if len(positions) == 0:
+                continue
+            drivers[ind].send((
+                'run', func_name, [targets[pos] for pos in positions], args,
+                settings, options, self.max_workers
+            ))
+            running[ind] = dict(enumerate(positions))
+
+        try:
+            while len(running) > 0:
+                ready, _, _ = select.select(
+                    [drivers[ind].conn for ind in running], [], []
+                )
+                for ind in running.keys():
+                    if drivers[ind].conn not in ready:
+                        continue
+                    try:
+                        msg = drivers[ind].conn.recv()
+                    except EOFError:
+                        self._replace_driver(ind)
+                        for pos in sorted(running.pop(ind).values()):
+                            yield pos, HostResult(
+                                targets[pos][0], targets[pos][1],
+                                HostResult.FAILED,
+                                error=HostError('Driver process exited')
+                            )
+                        continue
+                    if msg is None:  # the shard is complete
+                        del running[ind]
+                        continue
+                    shard_pos, host_result = msg
+                    pos = running[ind].pop(shard_pos)
+                    # The instance as passed in, not a copy
+                    host_result.instance = targets[pos][0]
+                    yield pos, host_result
+        finally:
+            # The generator is closed or failed early
+            for ind in running:
+                self._replace_driver(ind)
+
+    def _get_drivers(self):
+        while len(self._drivers) < self.shard_count:
+            self._drivers.append(self._make_driver())
+        return self._drivers
+
+    def _replace_driver(self, ind):
+        self._drivers[ind].kill()
+        self._drivers[ind] = self._make_driver()
+
+    def _make_driver(self):
+        return _Driver(
+            self.logger, self.module, self.max_workers, self.max_idle
+        )
+
+
+class HashRing(object):
+    """Consistent hashing of keys, e.g.: instance ids, over shards.
+
+    Each shard is placed at several points of a ring of 32-bit hashes and a
+    key belongs to the shard of the first point after its hash. Adding or
+    removing a shard only moves the keys of the points it takes or leaves.
+
+    :type shard_count: int
+    """
+
+    def __init__(self, shard_count, replicas=64):
+        """
+        :param int shard_count: The number of shards.
+        :param int replicas: The number of points of each shard on the ring.
+        """
+        if shard_count < 1:
+            raise ValueError('The number of shards must be positive')
+        self.shard_count = shard_count
+        ring = sorted(
+            (_hash('%d-%d' % (shard, replica)), shard)
+            for shard in range(shard_count) for replica in range(replicas)
+        )
+        self._points = [point for point, _ in ring]
+        self._shards = [shard for _, shard in ring]
+
+    def get_shard(self, key):
+        """
+        :param str key: The key.
+        :rtype: int
+        :return: The index of the shard the key belongs to.
+        """
+        ind = bisect.bisect(self._points, _hash(str(key)))
+        return self._shards[ind % len(self._shards)]
+
+
+def get_shard_key(instance, host_string):
+    """
+    :param ice.entities.Instance instance: The instance.
+    :param str host_string: The host string of the instance.
+    :rtype: str
+    :return: The key instances are sharded by; their id or, for instances
+        not stored in the registry, their host string.
+    """
+    inst_id = getattr(instance, 'id', None)
+    if inst_id is None:
+        return host_string
+    return inst_id
+
+
+def _hash(key):
+    return zlib.crc32(key) & 0xffffffff
+
+
+def get_address(host_string):
+    """
+    :param str host_string: A Fabric host string, e.g.: `ice@host:2222`.
+    :rtype: tuple
+    :return: The host in the first element and the SSH port in the second.
+    """
+    user, host, port = fabric_network.normalize(host_string)
+    return host, int(port)
+
+
+def probe_hosts(addrs, timeout=2.0, pool_size=64):
+    """Checks concurrently which hosts accept TCP connections.
+
+    :param list addrs: Tuples with the host name or address in the first
+        element and the port in the second.
+    :param float timeout: The number of seconds to wait for each host to
+        resolve and to accept the connection.
+    :param int pool_size: The number of hosts to probe concurrently.
+    :rtype: list
+    :return: A `bool` per host; `True` if the host is reachable.
+    """
+    if len(addrs) == 0:
+        return []
+
+    def probe(addr):
+        try:
+            sock = socket.create_connection(addr, timeout)
+            sock.close()
+            return True
+        except (socket.error, ValueError):
+            return False
+
+    pool = ThreadPool(min(pool_size, len(addrs)))
+    try:
+        return pool.map(probe, addrs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class ConnectionCache(object):
+    """The SSH connections of a worker process, kept across runs.
+
+    Fabric keeps one connection per host string, whatever the key it was
+    opened with. Connections are instead cached per host string and key file
+    and handed to Fabric only while a task runs on their host. Connections
+    that are unused for too long or no longer respond are closed.
+
+    :type max_idle: float
+    """
+
+    def __init__(self, max_idle=300):
+        """
+        :param float max_idle: The number of seconds to keep unused
+            connections open for.
+        """
+        self.max_idle = max_idle
+        self._conns = {}  # (host string, key file) -> (client, last use)
+
+    def __len__(self):
+        return len(self._conns)
+
+    def activate(self, host_string, key_filename):
+        """Hands the cached connection to a host to Fabric, if it is still
+        healthy. Otherwise Fabric connects when the task first needs to.
+
+        :param str host_string: The host string.
+        :param str key_filename: The private SSH key file.
+        :rtype: bool
+        :return: `True` if a connection is reused and `False` otherwise.
+        """
+        fabric_key = fabric_network.normalize_to_string(host_string)
+        self._close(dict.pop(fabric_state.connections, fabric_key, None))
+
+        entry = self._conns.pop((host_string, key_filename), None)
+        if entry is None:
+            return False
+        client = entry[0]
+        if not self._is_healthy(client):
+            self._close(client)
+            return False
+        fabric_state.connections[fabric_key] = client
+        return True
+
+    def release(self, host_string, key_filename):
+        """Takes back the connection Fabric used for a host.
+
+        :param str host_string: The host string.
+        :param str key_filename: The private SSH key file.
+        """
+        fabric_key = fabric_network.normalize_to_string(host_string)
+        client = dict.pop(fabric_state.connections, fabric_key, None)
+        if client is not None:
+            self._conns[(host_string, key_filename)] = (client, time.time())
+
+    def evict_idle(self):
+        """Closes the connections that have been unused for too long."""
+        deadline = time.time() - self.max_idle
+        for key, (client, last_use) in self._conns.items():
+            if last_use < deadline:
+                del self._conns[key]
+                self._close(client)
+
+    def close(self):
+        """Closes all the connections."""
+        for client, _ in self._conns.values():
+            self._close(client)
+        self._conns = {}
+
+    def _is_healthy(self, client):
+        transport = client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+        except Exception:
+            return False
+        return True
+
+    def _close(self, client):
+        if client is None:
+            return
+        try:
+            client.close()
+        except Exception:
+            pass
+
+
+class _Worker(object):
+    """A worker process with a pipe to send it hosts and receive results.
+
+    :type conn: multiprocessing.connection.Connection
+    :type process: multiprocessing.Process
+    """
+
+    def __init__(self, module, max_idle):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_work, args=(module, child_conn, max_idle)
+        )
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+
+    def send(self, msg):
+        self.conn.send(msg)
+
+    def stop(self):
+        try:
+            self.conn.send(('stop',))
+        except IOError:
+            pass  # already exited
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+
+class _Driver(_Worker):
+    """A driver process of a shard, with a pipe to send it runs and receive
+    host results.
+
+    Drivers start worker processes of their own, so they cannot be daemonic.
+    The ones that are still running when the interpreter exits are stopped,
+    as `multiprocessing` would otherwise wait for them forever.
+    """
+
+    def __init__(self, logger, module, max_workers, max_idle):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_drive,
+            args=(logger, module, child_conn, max_workers, max_idle)
+        )
+        self.process.start()
+        child_conn.close()
+        _running_drivers.add(self)
+
+    def stop(self):
+        _running_drivers.discard(self)
+        super(_Driver, self).stop()
+
+    def kill(self):
+        _running_drivers.discard(self)
+        super(_Driver, self).kill()
+
+
+_running_drivers = set()  # in the current process
+
+
+@atexit.register
+def _stop_drivers():
+    # Registered after the exit handler of `multiprocessing`, which joins
+    # the child processes, so it runs before it
+    for driver in list(_running_drivers):
+        driver.stop()
+
+
+def _drive(logger, module, conn, max_workers, max_idle):
+    """The main loop of the driver processes.
+
+    :param logging.Logger logger: The logger object.
+    :param module module: The experiment module.
+    :param multiprocessing.connection.Connection conn: The pipe to the
+        sharded engine.
+    :param int max_workers: The maximum number of worker processes.
+    :param float max_idle: The number of seconds to keep unused SSH
+        connections open for.
+    """
+    engine = ExecutionEngine(logger, module, max_workers, max_idle)
+
+    def kill(signum, frame):
+        # Drivers are terminated when a run is closed early; their workers,
+        # which may be running tasks, are killed with them.
+        for worker in engine._workers:
+            worker.process.terminate()
+        os._exit(1)
+
+    signal.signal(signal.SIGTERM, kill)
+    try:
+        while True:
+            try:
+                msg = conn.recv()
+            except EOFError:
+                break
+            if msg[0] == 'stop':
+                break
+
+            _, func_name, targets, args, settings, options, max_workers = msg
+            engine.max_workers = max_workers
+            for pos, host_result in engine._iter_probed_run(
+                func_name, targets, args, settings, *options
+            ):
+                conn.send((pos, host_result))
+            conn.send(None)
+    finally:
+        engine.close()
+
+
+def _work(module, conn, max_idle):
+    """The main loop of the worker processes.
+
+    :param module module: The experiment module.
+    :param multiprocessing.connection.Connection conn: The pipe to the
+        engine.
+    :param float max_idle: The number of seconds to keep unused SSH
+        connections open for.
+    """
+    # Workers of drivers inherit their handler, but are to stop at once
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # Connections inherited from the parent process are not usable
+    fabric_state.connections.clear()
+    ssh_conns = ConnectionCache(max_idle)
+
+    func = None
+    args = None
+    settings = None
+    try:
+        while True:
+            if not conn.poll(max_idle):
+                ssh_conns.evict_idle()
+                continue
+            try:
+                msg = conn.recv()
+            except EOFError:
+                break
+            if msg[0] == 'stop':
+                break
+            elif msg[0] == 'run':
+                _, func_name, args, settings = msg
+                func = getattr(module, func_name)
+                continue
+
+            _, host_string = msg
+            ssh_conns.evict_idle()
+            reply = _run_host(func, args, settings, host_string, ssh_conns)
+            try:
+                conn.send(reply)
+            except Exception:  # the result or error cannot be pickled
+                conn.send((False, HostError(
+                    'Result could not be sent back: %s' % repr(reply[1])
+                ), reply[2]))
+    finally:
+        ssh_conns.close()
+        fabric_network.disconnect_all()
+
+
+def _get_host_result(inst, host_string, succeeded, value, start_time,
+                     end_time, attempts):
+    """
+    :rtype: HostResult
+    :return: The result of a host, out of what `_run_host` returns.
+    """
+    if succeeded:
+        return HostResult(
+            inst, host_string, HostResult.SUCCEEDED, result=value,
+            start_time=start_time, end_time=end_time, attempts=attempts
+        )
+    status = HostResult.FAILED
+    if isinstance(value, HostTimeoutError):
+        status = HostResult.TIMED_OUT
+    return HostResult(
+        inst, host_string, status, error=value, start_time=start_time,
+        end_time=end_time, attempts=attempts
+    )
+
+
+def _get_run_settings(settings, targets):
+    """Adds the hosts of a run to its Fabric settings, as
+    `fabric.api.execute` does.
+
+    :rtype: dict
+    """
+    host_strings = [host_string for _, host_string in targets]
+    run_settings = {'hosts': host_strings, 'all_hosts': host_strings}
+    run_settings.update(settings)
+    return run_settings
+
+
+def _run_host(func, args, settings, host_string, ssh_conns):
+    """Runs a task on a host, retrying it as its retry policy sets.
+
+    :rtype: tuple
+    :return: Whether the task succeeded in the first element, the value it
+        returned or the error it failed with in the second and the number
+        of attempts in the third.
+    """
+    policy = getattr(func, 'retry_policy', None)
+    key_filename = settings.get('key_filename', None)
+    # Like `fabric.api.execute`, the host is split into its parts
+    host_settings = fabric_network.to_dict(host_string)
+    host_settings.update(settings)
+    attempt = 1
+    while True:
+        # Unhealthy connections are dropped, so retries reconnect
+        ssh_conns.activate(host_string, key_filename)
+        try:
+            # Failed connections raise `NetworkError` rather than aborting,
+            # so that retry policies can tell them apart
+            with fabric_api.settings(abort_exception=HostError,
+                                     use_exceptions_for={'network': True},
+                                     **host_settings):
+                return True, func(*args), attempt
+        except Exception as err:
+            error = err
+        except SystemExit as err:
+            error = HostError(str(err.code))
+        finally:
+            ssh_conns.release(host_string, key_filename)
+
+        if policy is None or not policy.should_retry(error, attempt):
+            return False, error, attempt
+        time.sleep(policy.get_delay(attempt))
+        attempt += 1
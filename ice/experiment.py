@@ -1,9 +1,15 @@
 """Experiment class module."""
+import collections
+import hashlib
 import os
 import sys
+import time
 import types
 from fabric import api as fabric_api
 import ice
+from . import execution
+from . import remote
+from . import experiment_timing
 
 
 class CfgSSH(object):
@@ -26,19 +32,35 @@ class Experiment(object):
     :type module: module
     :type mod_name: str
     :type mod_file_path : str
+    :type pool_size: int
+    :type ssh_max_idle: float
+    :type timings: collections.deque
     """
 
     class LoadError(Exception):
         pass
 
-    def __init__(self, logger, file_path):
+    def __init__(self, logger, file_path, pool_size=10, ssh_max_idle=300,
+                 max_timings=20):
         """Constructs a new experiment.
 
         :param logging.Logger logger: The logger object.
         :param str file_path: File path to the experiment file.
+        :param int pool_size: The maximum number of hosts to run parallel
+            tasks on concurrently. Optional, default: 10.
+        :param float ssh_max_idle: The number of seconds SSH connections are
+            kept open for between tasks. Optional, default: 300.
+        :param int max_timings: The number of invocations to keep the
+            timings of; older ones are dropped. Optional, default: 20.
         :raises ice.experiment.Experiment.LoadError: If module fails to load.
         """
         self.logger = logger
+        self.pool_size = pool_size
+        self.ssh_max_idle = ssh_max_idle
+        self.engine = None
+        self.sharded_engines = {}  # number of shards -> engine
+        self.timings = collections.deque(maxlen=max_timings)
+        self._last_task_run = None
 
         # Open experiment file
         if not os.path.isfile(file_path):
@@ -58,13 +80,51 @@ class Experiment(object):
 
         # Load module
         self.module = None
+        self._file_signature = None
+        self._file_digest = None
+        self._contents = None
         self.load()
 
-    def load(self):
+    def close(self):
+        """Stops the worker processes that run the tasks and closes their SSH
+        connections."""
+        if self.engine is not None:
+            self.engine.close()
+            self.engine = None
+        for engine in self.sharded_engines.values():
+            engine.close()
+        self.sharded_engines = {}
+
+    def load(self, force=False):
         """Loads the module.
 
+        The module is not reloaded if the file has not changed since it was
+        last loaded; i.e.: if its modification time and size or its contents
+        are the same.
+
+        :param bool force: Reload the module even if the file has not
+            changed, e.g.: to pick up changes in modules it imports.
         :raises ice.experiment.Experiment.LoadError: If module fails to load.
         """
+        try:
+            stat = os.stat(self.mod_file_path)
+            signature = (stat.st_mtime, stat.st_size)
+            if self.module is not None and not force:
+                if signature == self._file_signature:
+                    return
+                digest = self._get_file_digest()
+                if digest == self._file_digest:
+                    self._file_signature = signature
+                    return
+            else:
+                digest = self._get_file_digest()
+        except (IOError, OSError) as err:
+            raise Experiment.LoadError(
+                'File {0:s} cannot be read: {1:s}'.format(
+                    self.mod_file_path, str(err)
+                )
+            )
+
         # Setup Python path
         sys_path_changed = False
         parent_dir_path = os.path.abspath(os.path.dirname(self.mod_file_path))
@@ -98,6 +158,13 @@ class Experiment(object):
         if sys_path_changed:
             del sys.path[len(sys.path) - 1]  # Hack!
 
+        self._file_signature = signature
+        self._file_digest = digest
+        self._contents = None
+
+        # Workers have forked with the previous version of the module
+        self.close()
+
     def get_contents(self):
         """Lists the contents of the experiment module.
 
@@ -105,6 +172,12 @@ class Experiment(object):
         :return: A tuple of lists. Tasks in the first element and runners in
             the second.
         """
+        if self._contents is None:
+            self._contents = self._list_contents()
+        tasks, runners = self._contents
+        return list(tasks), list(runners)
+
+    def _list_contents(self):
         # Get strings (lines)
         runners = []
         tasks = []
@@ -145,18 +218,287 @@ class Experiment(object):
         tasks, runners = self.get_contents()
         return runners
 
-    def run(self, instances, ssh_cfg, func_name='run', args=None):
+    def run(self, instances, ssh_cfg, func_name='run', args=None,
+            pool_size=None, timeout=None, batch_size=None, max_failures=None,
+            callback=None, probe_timeout=None, defer_unreachable=False,
+            shards=None, shard=None, reducers=None, keep_results=None):
         """Runs a task of runner of the experiment.
 
+        Plain tasks run on one host at a time in the current process, like
+        runners, and parallel tasks on up to `pool_size` hosts at a time on
+        worker processes. Async runners run up to `pool_size`, by default
+        100, remote commands at a time. The timings of the invocation are
+        appended to `timings`; per host for tasks.
+
         :param list instances: A list of instances to run the task/runner
             against.
         :param ice.experiment.CfgSSH ssh_cfg: SSH client configuration.
         :param str func_name: The name of the function (task or runner) to run.
         :param list args: List of arguments to pass
+        :param int pool_size: The number of hosts to run a parallel task on
+            concurrently. Optional, default: the pool size of the experiment.
+            If larger, the worker processes are grown to it and kept.
+        :param float timeout: The maximum number of seconds a parallel task
+            may run for on a host or the remote commands of an async runner
+            may wait for output. Optional, default: no limit.
+        :param int batch_size: If set, tasks run on consecutive batches of
+            hosts of this size.
+        :param int max_failures: If set, tasks stop being started on more
+            hosts once they have failed on more than this many.
+        :param callable callback: If set, it is called for tasks as each host
+            completes, with the arguments `iter_run` yields.
+        :param float probe_timeout: If set, the SSH port of every instance is
+            probed first, waiting this many seconds per instance, and
+            unreachable instances are left out. Tasks report them with an
+            `ice.execution.HostUnreachableError`.
+        :param bool defer_unreachable: If set, tasks probe the unreachable
+            instances again once the rest have completed and run on the ones
+            that have become reachable.
+        :param int shards: If set, tasks are run by this many driver
+            processes, each on the instances its shard has and with up to
+            `pool_size` hosts at a time. The results are the same as the
+            ones of a single driver.
+        :param tuple shard: The index of a shard in the first element and
+            the number of shards in the second. If set, the task or runner
+            only runs on the instances of this shard; e.g.: to split a run
+            across cooperating client hosts and merge their results with
+            `ice.execution.RunResults.merge`.
+        :param dict reducers: `ice.aggregation.Reducer` objects, by name. The
+            results of tasks are added to them as hosts complete and their
+            reductions are set in the `aggregates` of the results. Results
+            a reducer fails on are left out and their errors are set in the
+            `aggregate_errors` of the results.
+        :param bool keep_results: Whether to keep the values tasks return.
+            Optional, default: only if there are no reducers.
         :rtype: mixed
-        :return: The result of the task or runner or `False` if function is not
-            found.
+        :return: The result of the runner, an
+            `ice.execution.RunResults` for tasks or `False` if function is
+            not found.
+        """
+        func = self._get_callable(func_name)
+        if func is None:
+            return False
+        args = self._get_args(instances, args)
+        timing = self._start_timing(func_name)
+
+        try:
+            if isinstance(func, ice.Task):
+                if reducers is None:
+                    reducers = {}
+                if keep_results is None:
+                    keep_results = len(reducers) == 0
+                options = {
+                    'pool_size': self._get_pool_size(func, pool_size),
+                    'timeout': timeout,
+                    'batch_size': batch_size,
+                    'max_failures': max_failures,
+                    'probe_timeout': probe_timeout,
+                    'defer_unreachable': defer_unreachable,
+                    'in_process': not isinstance(func, ice.ParallelTask)
+                }
+                results = self._run_task(
+                    func_name, self._get_targets(instances, ssh_cfg, shard),
+                    args, ssh_cfg, timing, shards, options, callback,
+                    reducers, keep_results
+                )
+                self._last_task_run = (
+                    func_name, args, ssh_cfg, shards, options, callback,
+                    reducers, keep_results, results
+                )
+                return results
+
+            if shard is not None:
+                instances = self.select_shard(instances, ssh_cfg, *shard)
+            if probe_timeout is not None:
+                instances, _ = self.probe(instances, ssh_cfg, probe_timeout)
+            if shard is not None or probe_timeout is not None:
+                args[0] = instances
+            if isinstance(func, ice.AsyncRunner):
+                return self._run_async(func, args, ssh_cfg, pool_size,
+                                       timeout)
+            host_strings = [
+                self._get_host_string(ssh_cfg, inst) for inst in instances
+            ]
+            with fabric_api.settings(hosts=host_strings,
+                                     key_filename=ssh_cfg.key_path):
+                if isinstance(func, ice.ParallelRunner):
+                    with fabric_api.settings(parallel=True):
+                        return func(*args)
+                elif isinstance(func, ice.Runner):
+                    return func(*args)
+        finally:
+            timing.overall.end(time.time())
+
+    def rerun_failed(self):
+        """Runs the latest task invoked with `run` again, only on the hosts
+        it did not succeed on, with the same arguments and options.
+
+        The results of these hosts are added to the reducers of the latest
+        run, which already hold the ones of the hosts it succeeded on.
+
+        :rtype: ice.execution.RunResults
+        :return: The results of all the hosts of the latest run, with the
+            ones of the hosts it ran on again replaced, or `False` if no
+            task has run or it is no longer found.
+        """
+        if self._last_task_run is None:
+            self.logger.error('No task has run yet!')
+            return False
+        func_name, args, ssh_cfg, shards, options, callback, reducers, \
+            keep_results, last_results = self._last_task_run
+        func = self._get_callable(func_name)
+        if func is None:
+            return False
+
+        succeeded = last_results.get_succeeded()
+        targets = [
+            (res.instance, res.host_string)
+            for res in last_results.host_results if not res.succeeded
+        ]
+        timing = self._start_timing(func_name)
+        try:
+            results = self._run_task(
+                func_name, targets, args, ssh_cfg, timing, shards, options,
+                callback, reducers, keep_results
+            )
+        finally:
+            timing.overall.end(time.time())
+
+        aggregates = results.aggregates
+        aggregate_errors = dict(
+            (name, dict(host_errors))
+            for name, host_errors in last_results.aggregate_errors.items()
+        )
+        for name, host_errors in results.aggregate_errors.items():
+            aggregate_errors.setdefault(name, {}).update(host_errors)
+        results = execution.RunResults.merge(
+            [execution.RunResults(succeeded), results],
+            [res.host_string for res in last_results.host_results]
+        )
+        results.aggregates = aggregates
+        results.aggregate_errors = aggregate_errors
+        self._last_task_run = self._last_task_run[:-1] + (results,)
+        return results
+
+    def iter_run(self, instances, ssh_cfg, func_name='run', args=None,
+                 pool_size=None, timeout=None, batch_size=None,
+                 max_failures=None, probe_timeout=None,
+                 defer_unreachable=False, shards=None, shard=None):
+        """Runs a task of the experiment, reporting each host as it completes.
+
+        The parameters are the same as the ones of `run`. Runners drive the
+        hosts themselves, so they cannot be run this way.
+
+        :rtype: generator
+        :return: Generator of tuples with the instance, the result of the
+            task, the number of seconds it ran for and the error it failed
+            with, if any. Hosts skipped because of `max_failures` have no
+            result, duration or error and unreachable hosts have no result
+            or duration.
         """
+        func = self._get_callable(func_name)
+        if func is None:
+            return
+        if not isinstance(func, ice.Task):
+            self.logger.error(
+                'Callable `%s.%s` is not a task!' % (self.mod_name, func_name)
+            )
+            return
+
+        timing = self._start_timing(func_name)
+        try:
+            pool_size = self._get_pool_size(func, pool_size)
+            for host_result in self._get_engine(shards, pool_size).iter_run(
+                func_name, self._get_targets(instances, ssh_cfg, shard),
+                self._get_args(instances, args),
+                {'key_filename': ssh_cfg.key_path}, pool_size=pool_size,
+                timeout=timeout, batch_size=batch_size,
+                max_failures=max_failures, probe_timeout=probe_timeout,
+                defer_unreachable=defer_unreachable,
+                in_process=not isinstance(func, ice.ParallelTask)
+            ):
+                self._time_host(timing, host_result)
+                yield host_result.as_tuple()
+        finally:
+            timing.overall.end(time.time())
+
+    def probe(self, instances, ssh_cfg, timeout=2.0):
+        """Checks which instances accept connections on their SSH port.
+
+        :param list instances: The instances to probe.
+        :param ice.experiment.CfgSSH ssh_cfg: SSH client configuration.
+        :param float timeout: The number of seconds to wait for each
+            instance.
+        :rtype: tuple
+        :return: A list of the reachable instances in the first element and
+            one of the unreachable instances in the second.
+        """
+        flags = execution.probe_hosts(
+            [execution.get_address(host_string) for _, host_string
+             in self._get_targets(instances, ssh_cfg)],
+            timeout
+        )
+        reachable = []
+        unreachable = []
+        for inst, is_reachable in zip(instances, flags):
+            (reachable if is_reachable else unreachable).append(inst)
+        if len(unreachable) > 0:
+            self.logger.warning(
+                '%d instance(s) are unreachable: %s' % (
+                    len(unreachable),
+                    ', '.join(inst.public_reverse_dns for inst in unreachable)
+                )
+            )
+        return reachable, unreachable
+
+    def select_shard(self, instances, ssh_cfg, index, count):
+        """Selects the instances of a shard. Instances are sharded by
+        consistent hashing on their id, as the drivers of a sharded run
+        shard them.
+
+        :param list instances: The instances.
+        :param ice.experiment.CfgSSH ssh_cfg: SSH client configuration.
+        :param int index: The index of the shard.
+        :param int count: The number of shards.
+        :rtype: list
+        :return: The instances of the shard, in their original order.
+        """
+        ring = execution.HashRing(count)
+        return [
+            inst for inst, host_string in self._get_targets(instances, ssh_cfg)
+            if ring.get_shard(
+                execution.get_shard_key(inst, host_string)
+            ) == index
+        ]
+
+    def get_last_timing(self):
+        """Gets the timings of the latest task or runner invocation.
+
+        :rtype: ice.experiment_timing.RunTiming
+        :return: The timings or `None` if nothing has run yet.
+        """
+        if len(self.timings) == 0:
+            return None
+        return self.timings[-1]
+
+    def _get_file_digest(self):
+        with open(self.mod_file_path, 'rb') as file_obj:
+            return hashlib.sha1(file_obj.read()).hexdigest()
+
+    def _start_timing(self, func_name):
+        timing = experiment_timing.RunTiming(func_name)
+        timing.overall.start(time.time())
+        self.timings.append(timing)
+        return timing
+
+    def _time_host(self, timing, host_result):
+        if host_result.duration() is not None:  # it has run
+            timing.add_host(
+                host_result.host_string, host_result.start_time,
+                host_result.end_time
+            )
+
+    def _get_callable(self, func_name):
         try:
             func = getattr(self.module, func_name)
             if not isinstance(func, ice.Callable):
@@ -164,32 +506,126 @@ class Experiment(object):
                     'Attribute `%s.%s` is not a callable!'
                     % (self.mod_name, func_name)
                 )
-                return False
+                return None
         except AttributeError:
             self.logger.error(
                 'Callable `%s.%s` is not found!' % (self.mod_name, func_name)
             )
-            return False
+            return None
+        return func
+
+    def _run_task(self, func_name, targets, args, ssh_cfg, timing, shards,
+                  options, callback, reducers, keep_results):
+        errors = {}  # reducer name -> host string -> error
+
+        def host_callback(host_result):
+            self._time_host(timing, host_result)
+            if callback is not None:
+                callback(*host_result.as_tuple())
+            if host_result.succeeded:
+                for name, reducer in reducers.items():
+                    self._reduce(
+                        name, reducer, host_result, errors.setdefault(name, {})
+                    )
 
+        engine = self._get_engine(shards, options['pool_size'])
+        results = engine.run(
+            func_name, targets, args, {'key_filename': ssh_cfg.key_path},
+            callback=host_callback, keep_results=keep_results, **options
+        )
+        results.aggregates = dict(
+            (name, reducer.get_result()) for name, reducer in reducers.items()
+        )
+        results.aggregate_errors = dict(
+            (name, host_errors) for name, host_errors in errors.items()
+            if len(host_errors) > 0
+        )
+        return results
+
+    def _reduce(self, name, reducer, host_result, host_errors):
+        """Adds the result of a host to a reduction. A result that cannot be
+        reduced is left out of it, so that the run goes on."""
+        try:
+            reducer.add(host_result.host_string, host_result.result)
+        except Exception as err:
+            self.logger.error(
+                'Cannot reduce `%s` with the result of %s: %s'
+                % (name, host_result.host_string, err)
+            )
+            host_errors[host_result.host_string] = err
+
+    def _run_async(self, func, args, ssh_cfg, pool_size, timeout):
+        kwargs = {'timeout': timeout}
+        if pool_size is not None:
+            kwargs['max_concurrency'] = pool_size
+        commands = remote.RemoteCommands(
+            self._get_targets(args[0], ssh_cfg), ssh_cfg.key_path, **kwargs
+        )
+        try:
+            return func(args[0], commands, *args[1:])
+        finally:
+            commands.close()
+
+    def _get_args(self, instances, args):
         if args is None:
             args = []
         elif not isinstance(args, types.ListType):
             args = [args]
-        args = [instances] + args
-        host_strings = [
-            self._get_host_string(ssh_cfg, inst) for inst in instances
+        return [instances] + args
+
+    def _get_targets(self, instances, ssh_cfg, shard=None):
+        if shard is not None:
+            instances = self.select_shard(instances, ssh_cfg, *shard)
+        return [
+            (inst, self._get_host_string(ssh_cfg, inst)) for inst in instances
         ]
-        with fabric_api.settings(hosts=host_strings,
-                                 key_filename=ssh_cfg.key_path):
-            if isinstance(func, ice.ParallelRunner):
-                with fabric_api.settings(parallel=True):
-                    return func(*args)
-            elif isinstance(func, ice.Runner):
-                return func(*args)
-            elif isinstance(func, ice.Task):
-                return fabric_api.execute(func, *args)
+
+    def _get_pool_size(self, func, pool_size):
+        if not isinstance(func, ice.ParallelTask):
+            return 1
+        if pool_size is None:
+            return self.pool_size
+        return pool_size
+
+    def _get_engine(self, shards=None, pool_size=None):
+        """Gets the engine to run tasks with, growing its workers up to
+        `pool_size`."""
+        engine = self._get_base_engine(shards)
+        if pool_size is not None and pool_size > engine.max_workers:
+            self.logger.debug(
+                'Growing the workers from %d to %d.'
+                % (engine.max_workers, pool_size)
+            )
+            engine.max_workers = pool_size
+        return engine
+
+    def _get_base_engine(self, shards):
+        if shards is not None and shards > 1:
+            engine = self.sharded_engines.get(shards)
+            if engine is None:
+                engine = execution.ShardedExecutionEngine(
+                    self.logger, self.module, shards,
+                    max_workers=self.pool_size, max_idle=self.ssh_max_idle
+                )
+                self.sharded_engines[shards] = engine
+            return engine
+        if self.engine is None:
+            self.engine = execution.ExecutionEngine(
+                self.logger, self.module, max_workers=self.pool_size,
+                max_idle=self.ssh_max_idle
+            )
+        return self.engine
 
     def _get_host_string(self, ssh_cfg, inst):
+        missing = [
+            key for key in ['public_reverse_dns', 'ssh_port', 'ssh_username']
+            if getattr(inst, key) is None
+        ]
+        if len(missing) > 0:
+            raise ValueError(
+                'Instance %s lacks %s, e.g.: it was listed with a projection!'
+                % (inst.id, ', '.join(missing))
+            )
         username = ssh_cfg.username
         if inst.ssh_username != '':
             username = inst.ssh_username
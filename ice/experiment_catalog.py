@@ -0,0 +1,217 @@
+"""Catalog of the experiments of a directory."""
+import ast
+import os
+from .experiment import Experiment
+
+# Names of the iCE callable classes, by kind
+TASK_CLASSES = frozenset(['Task', 'ParallelTask'])
+RUNNER_CLASSES = frozenset(['Runner', 'ParallelRunner', 'AsyncRunner'])
+
+
+class ExperimentCatalog(object):
+    """Lists the experiments of a directory without importing them.
+
+    Tasks and runners are found by parsing the experiment files; an
+    experiment module is only imported when one of its callables is run.
+
+    :type logger: logging.Logger
+    :type dir_path: str
+    :type experiment_kwargs: dict
+    """
+
+    def __init__(self, logger, dir_path, **experiment_kwargs):
+        """Creates a catalog and scans the directory.
+
+        :param logging.Logger logger: The logger object.
+        :param str dir_path: The directory with the experiment files.
+        :param dict experiment_kwargs: Arguments to create the
+            `ice.experiment.Experiment` objects with, e.g.: `pool_size`.
+        """
+        self.logger = logger
+        self.dir_path = dir_path
+        self.experiment_kwargs = experiment_kwargs
+
+        self._entries = {}  # experiment name -> _CatalogEntry
+        self._experiments = {}  # experiment name -> Experiment
+        self.scan()
+
+    def scan(self):
+        """Scans the directory for added, changed or removed experiment
+        files. Only the changed files are parsed again.
+        """
+        entries = {}
+        for file_name in sorted(os.listdir(self.dir_path)):
+            if not file_name.endswith('.py') or file_name.startswith('_'):
+                continue
+            file_path = os.path.join(self.dir_path, file_name)
+            if not os.path.isfile(file_path):
+                continue
+            name = file_name[:-len('.py')]
+            stat = os.stat(file_path)
+            signature = (stat.st_mtime, stat.st_size)
+
+            entry = self._entries.get(name)
+            if entry is None or entry.signature != signature:
+                entry = _CatalogEntry(file_path, signature)
+                if entry.error is not None:
+                    self.logger.debug(
+                        'Failed to parse `%s`: %s' % (file_path, entry.error)
+                    )
+            entries[name] = entry
+
+        for name in set(self._experiments) - set(entries):
+            self._experiments.pop(name).close()
+        self._entries = entries
+
+    def get_names(self):
+        """
+        :rtype: list
+        :return: The names of the experiments, in alphabetical order.
+        """
+        return sorted(self._entries.keys())
+
+    def get_contents(self, name):
+        """Lists the contents of an experiment, in the format of
+        `ice.experiment.Experiment.get_contents`.
+
+        :param str name: The name of the experiment.
+        :rtype: tuple
+        :return: A tuple of lists. Tasks in the first element and runners in
+            the second. Both are empty if the experiment is not found or
+            cannot be parsed.
+        """
+        entry = self._entries.get(name)
+        if entry is None:
+            return [], []
+        return (
+            [self._get_line(*task) for task in entry.tasks],
+            [self._get_line(*runner) for runner in entry.runners]
+        )
+
+    def get_tasks(self, name):
+        tasks, runners = self.get_contents(name)
+        return tasks
+
+    def get_runners(self, name):
+        tasks, runners = self.get_contents(name)
+        return runners
+
+    def get_experiment(self, name):
+        """Gets an experiment, importing its module on first use and
+        reloading it if the file has changed since.
+
+        :param str name: The name of the experiment.
+        :rtype: ice.experiment.Experiment
+        :raises ice.experiment.Experiment.LoadError: If the experiment is not
+            found or its module fails to load.
+        """
+        entry = self._entries.get(name)
+        if entry is None:
+            raise Experiment.LoadError(
+                'Experiment `{0:s}` is not found in {1:s}!'.format(
+                    name, self.dir_path
+                )
+            )
+
+        exp = self._experiments.get(name)
+        if exp is None:
+            exp = Experiment(
+                self.logger, entry.file_path, **self.experiment_kwargs
+            )
+            self._experiments[name] = exp
+        else:
+            exp.load()
+        return exp
+
+    def run(self, name, instances, ssh_cfg, func_name='run', args=None,
+            **kwargs):
+        """Runs a task or runner of an experiment. See
+        `ice.experiment.Experiment.run`.
+
+        :param str name: The name of the experiment.
+        :rtype: mixed
+        :return: The result of the task or runner or `False` if the
+            experiment or the function is not found or fails to load.
+        """
+        try:
+            exp = self.get_experiment(name)
+        except Experiment.LoadError as err:
+            self.logger.error(str(err))
+            return False
+        return exp.run(instances, ssh_cfg, func_name, args, **kwargs)
+
+    def close(self):
+        """Stops the worker processes of the imported experiments."""
+        for exp in self._experiments.values():
+            exp.close()
+
+    def _get_line(self, func_name, help_msg):
+        if help_msg is not None:
+            return '* %s: %s' % (func_name, help_msg)
+        return '* %s' % func_name
+
+
+class _CatalogEntry(object):
+    """The tasks and runners an experiment file defines, found by parsing
+    it.
+
+    :type file_path: str
+    :type signature: tuple
+    :type tasks: list
+    :type runners: list
+    :type error: str
+    """
+
+    def __init__(self, file_path, signature):
+        self.file_path = file_path
+        self.signature = signature
+        self.tasks = []
+        self.runners = []
+        self.error = None
+
+        try:
+            with open(file_path, 'r') as file_obj:
+                tree = ast.parse(file_obj.read(), file_path)
+        except (IOError, SyntaxError, TypeError) as err:
+            self.error = str(err)
+            return
+
+        docs = dict(
+            (node.name, ast.get_docstring(node, clean=False))
+            for node in tree.body if isinstance(node, ast.FunctionDef)
+        )
+        for node in tree.body:
+            if isinstance(node, ast.FunctionDef):
+                # @ice.Task
+                # def a_task(instances):
+                for decorator in node.decorator_list:
+                    self._add(
+                        node.name, self._get_class_name(decorator),
+                        ast.get_docstring(node, clean=False)
+                    )
+            elif isinstance(node, ast.Assign) and \
+                    isinstance(node.value, ast.Call):
+                # a_task = ice.Task(a_func)
+                class_name = self._get_class_name(node.value.func)
+                help_msg = None
+                if len(node.value.args) == 1 and \
+                        isinstance(node.value.args[0], ast.Name):
+                    help_msg = docs.get(node.value.args[0].id)
+                for target in node.targets:
+                    if isinstance(target, ast.Name):
+                        self._add(target.id, class_name, help_msg)
+
+    def _add(self, func_name, class_name, help_msg):
+        if class_name in TASK_CLASSES:
+            self.tasks.append((func_name, help_msg))
+        elif class_name in RUNNER_CLASSES:
+            self.runners.append((func_name, help_msg))
+
+    def _get_class_name(self, node):
+        """Gets the name of the class a decorator or call refers to, e.g.:
+        `Task` for `ice.Task`, `tasks.Task` or `Task`."""
+        if isinstance(node, ast.Name):
+            return node.id
+        elif isinstance(node, ast.Attribute):
+            return node.attr
+        return None
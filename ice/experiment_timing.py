@@ -1,4 +1,5 @@
 import json
+import math
 
 
 class ExperimentTiming(object):
@@ -34,3 +35,101 @@ class ExperimentTiming(object):
             'start_time': self.start_time,
             'end_time': self.end_time,
         })
+
+
+class RunTiming(object):
+    """Timings of a task or runner invocation, overall and per host.
+
+    :type func_name: str
+    :type overall: ExperimentTiming
+    :type hosts: dict
+    """
+
+    def __init__(self, func_name):
+        self.func_name = func_name
+        self.overall = ExperimentTiming()
+        self.hosts = {}
+
+    def add_host(self, host_string, start_time, end_time):
+        timing = ExperimentTiming()
+        timing.start(start_time)
+        timing.end(end_time)
+        self.hosts[host_string] = timing
+
+    def get_durations(self):
+        """
+        :rtype: list
+        :return: The durations of the hosts, in ascending order.
+        """
+        return sorted(timing.duration() for timing in self.hosts.values())
+
+    def get_percentile(self, percent):
+        """Gets a percentile of the host durations, using the nearest-rank
+        method.
+
+        :param float percent: The percentile, between 0 and 100.
+        :rtype: float
+        :return: The duration or `None` if no host has been timed.
+        """
+        durations = self.get_durations()
+        if len(durations) == 0:
+            return None
+        rank = int(math.ceil(percent / 100.0 * len(durations)))
+        return durations[max(rank, 1) - 1]
+
+    def get_slowest(self, count=5):
+        """
+        :param int count: The number of hosts.
+        :rtype: list
+        :return: Tuples with the host string and the duration of the slowest
+            hosts, the slowest first.
+        """
+        hosts = sorted(
+            self.hosts.items(), key=lambda item: item[1].duration(),
+            reverse=True
+        )
+        return [
+            (host_string, timing.duration())
+            for host_string, timing in hosts[:count]
+        ]
+
+    def get_summary(self, slowest_count=5):
+        """
+        :param int slowest_count: The number of slowest hosts to list.
+        :rtype: dict
+        """
+        overall_duration = None
+        if self.overall.end_time is not None:
+            overall_duration = self.overall.duration()
+        return {
+            'func_name': self.func_name,
+            'duration': overall_duration,
+            'hosts': len(self.hosts),
+            'p50': self.get_percentile(50),
+            'p95': self.get_percentile(95),
+            'p99': self.get_percentile(99),
+            'slowest': self.get_slowest(slowest_count)
+        }
+
+    @classmethod
+    def from_json(cls, json_str):
+        object = cls(None)
+        d = json.loads(json_str)
+        object.func_name = d['func_name']
+        object.overall.start_time = d['start_time']
+        object.overall.end_time = d['end_time']
+        for host_string, times in d['hosts'].items():
+            object.add_host(host_string, times[0], times[1])
+        return object
+
+    def to_json(self):
+        return json.dumps({
+            'func_name': self.func_name,
+            'start_time': self.overall.start_time,
+            'end_time': self.overall.end_time,
+            'hosts': dict(
+                (host_string, [timing.start_time, timing.end_time])
+                for host_string, timing in self.hosts.items()
+            ),
+            'summary': self.get_summary()
+        })
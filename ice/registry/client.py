@@ -1,5 +1,11 @@
+import collections
 import json
+import threading
+import time
+from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
 import requests
+from requests import adapters
 from requests import exceptions
 import redo
 import ice
@@ -11,18 +17,48 @@ ICE_AGENT_URL = 'http://dl.bintray.com/glestaris/iCE/v2.1.0/ice-agent'
 class CfgRegistryClient(object):
     """Registry client configuration"""
 
-    def __init__(self, host, port):
+    def __init__(self, host, port, pool_connections=10, pool_maxsize=10,
+                 pool_block=False, keep_alive=True, cache_listings=True,
+                 cache_ttl=0, cache_size=16):
         """Creates a registry client configuration.
 
         :param str host: The address of the registry server.
         :param int port: The port of the registry server.
+        :param int pool_connections: The number of per-host connection pools
+            to cache. Optional, default: 10.
+        :param int pool_maxsize: The maximum number of connections to keep
+            open per host. Optional, default: 10.
+        :param bool pool_block: If set, calls will block when all
+            `pool_maxsize` connections to a host are in use instead of
+            opening extra, throw-away connections. Optional, default: False.
+        :param bool keep_alive: If set, connections are kept open and reused
+            between calls. Optional, default: True.
+        :param bool cache_listings: If set, instance listings are cached and
+            revalidated with conditional requests. Optional, default: True.
+        :param float cache_ttl: The number of seconds a cached listing is
+            used without being revalidated. Optional, default: 0.
+        :param int cache_size: The maximum number of listing pages to cache;
+            the least recently used ones are dropped first. Optional,
+            default: 16.
         """
         self.host = host
         self.port = port
 
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.keep_alive = keep_alive
+
+        self.cache_listings = cache_listings
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+
 
 class RegistryClient:
     VERSION = 'v2'
+    HTTP_METHODS = ['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
+    # Format of the timestamps the registry stores and is queried with
+    DATE_FORMAT = '%a, %d %b %Y %H:%M:%S GMT'
 
     class APIException(Exception):
         def __init__(self, **kwargs):
@@ -34,12 +70,28 @@ class RegistryClient:
         def __str__(self):
             if self.http_code == 422:  # validation error
                 iss_msgs = []
-                for key, issue in self.response.json()['_issues'].items():
-                    iss_msgs.append('`{:s}`: {:s}'.format(key, issue))
+                for issues in self.get_issues():
+                    for key, issue in issues.items():
+                        iss_msgs.append('`{:s}`: {:s}'.format(key, issue))
                 return 'Validation error: ' + ', '.join(iss_msgs)
             else:
                 return self._get_generic_str()
 
+        def get_issues(self):
+            """Gets the validation issues of the request.
+
+            :rtype: list of [dict]
+            :return: The issues of every submitted document, in order. The
+                list has a single element for non-bulk requests. Documents
+                without issues map to empty dictionaries.
+            """
+            if self.response is None:
+                return []
+            _dict = self.response.json()
+            if '_items' not in _dict:
+                return [_dict.get('_issues', {})]
+            return [item.get('_issues', {}) for item in _dict['_items']]
+
         def _get_generic_str(self):
             err_parts = []
             if self.http_code is not None:
@@ -58,6 +110,21 @@ class RegistryClient:
 
     def __init__(self, cfg):
         self.cfg = cfg
+        self._session = None
+        self._cache = collections.OrderedDict()  # least recently used first
+        # The client is shared by threads, e.g.: of `AsyncRegistryClient`
+        self._cache_lock = threading.Lock()
+
+    def close(self):
+        """Closes the pooled connections of the client."""
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def invalidate_cache(self):
+        """Drops the cached instance listings."""
+        with self._cache_lock:
+            self._cache = collections.OrderedDict()
 
     #
     # Getting IP address
@@ -112,19 +179,23 @@ class RegistryClient:
         session.id = resp['_id']
         return session.id
 
-    def delete_session(self, session):
-        """Deletes a specific session.
+    def delete_session(self, session, pool_size=10):
+        """Deletes a specific session and its instances.
+
+        The session is only deleted if all of its instances are deleted. Use
+        `delete_session_instances` to find out which instances failed.
 
         :param ice.entities.Session session: The session.
+        :param int pool_size: The number of concurrent instance deletions,
+            if the registry does not support deleting them at once.
         :rtype: bool
         :return: `True` on success and `False` otherwise.
         """
         if session is None:
             return False
 
-        instances = self.get_instances_list(session)
-        for inst in instances:
-            self.delete_instance(inst)
+        if len(self.delete_session_instances(session, pool_size)) > 0:
+            return False
 
         try:
             resp = self._call('sessions/%s' % session.id, 'DELETE')
@@ -134,19 +205,47 @@ class RegistryClient:
         except RegistryClient.APIException:
             return False
 
+    def delete_session_instances(self, session, pool_size=10):
+        """Deletes all the instances of a session.
+
+        The instances are deleted at once by the registry. Registries that do
+        not support it are handled by deleting the instances one by one,
+        using a pool of `pool_size` concurrent requests.
+
+        :param ice.entities.Session session: The session.
+        :param int pool_size: The number of concurrent instance deletions.
+        :rtype: list of [entities.Instance]
+        :return: The instances that could not be deleted.
+        """
+        try:
+            self._call('sessions/%s/instances' % session.id, 'DELETE')
+            self.invalidate_cache()
+            return []
+        except RegistryClient.APIException:
+            pass  # e.g.: older registry, fallback to one by one deletion
+
+        instances = self.get_instances_list(session)
+        if len(instances) == 0:
+            return []
+        pool = ThreadPool(min(pool_size, len(instances)))
+        try:
+            results = pool.map(self.delete_instance, instances)
+        finally:
+            pool.close()
+            pool.join()
+
+        return [
+            inst for inst, deleted in zip(instances, results) if not deleted
+        ]
+
     def get_sessions_list(self):
         """Gets list of active sessions.
 
         :rtype: list of [entities.Session]
         :return: List of session objects.
         """
-        ret_val = []
-
         resp = self._call('sessions', 'GET')
-        for entry in resp['_items']:
-            ret_val.append(entities.Session(**entry))
-
-        return ret_val
+        return entities.Session.from_dicts(resp['_items'])
 
     def get_session(self, session_id):
         """Gets a session given its id.
@@ -176,9 +275,49 @@ class RegistryClient:
         :return: The instance id on success and `None` on failure.
         """
         resp = self._call('instances', 'POST', data=inst.to_dict())
+        self.invalidate_cache()
         inst.id = resp['_id']
         return inst.id
 
+    def submit_instances(self, insts, batch_size=100):
+        """
+        Submits many instances using bulk requests.
+
+        Each batch of instances is sent in a single request. The registry
+        rejects a whole batch if any of its instances is invalid, so in that
+        case the valid instances of the batch are submitted again on their
+        own.
+
+        :param list insts: List of `entities.Instance` instances.
+        :param int batch_size: The maximum number of instances per request.
+            Optional, default: 100.
+        :rtype: tuple
+        :return: A tuple with the list of instance ids, in the order of
+            `insts` and `None` for the rejected ones, in the first element
+            and a dictionary mapping the index of every rejected instance to
+            its validation issues in the second.
+        :raises RegistryClient.APIException: In case of non-validation error.
+        """
+        ids = [None] * len(insts)
+        errors = {}
+        for start in range(0, len(insts), batch_size):
+            indices = range(start, min(start + batch_size, len(insts)))
+            try:
+                self._submit_instances_batch(insts, indices, ids)
+            except RegistryClient.APIException as err:
+                if err.http_code != 422:
+                    raise
+                valid_indices = []
+                for ind, issues in zip(indices, err.get_issues()):
+                    if issues:
+                        errors[ind] = issues
+                    else:
+                        valid_indices.append(ind)
+                if len(valid_indices) > 0:
+                    self._submit_instances_batch(insts, valid_indices, ids)
+
+        return ids, errors
+
     def delete_instance(self, inst):
         """
         Deletes an instance from the backend.
@@ -189,32 +328,159 @@ class RegistryClient:
         """
         try:
             resp = self._call('instances/%s' % inst.id, 'DELETE')
+            self.invalidate_cache()
             if resp is None:
                 return False
             return True
         except RegistryClient.APIException:
             return False
 
-    def get_instances_list(self, session=None):
+    def heartbeat(self, inst):
+        """
+        Reports that an instance is still alive.
+
+        Registries that expire instances remove the ones that have not sent
+        a heartbeat for a while.
+
+        :param entities.Instance inst: The instance
+        :rtype: bool
+        :return: `True` on success and `False` otherwise, e.g.: if the
+            instance has already expired.
+        """
+        try:
+            resp = self._call('instances/%s/heartbeat' % inst.id, 'PATCH')
+            if resp is None:
+                return False
+            return True
+        except RegistryClient.APIException:
+            return False
+
+    def get_instances_list(self, session=None, fields=None, tags=None,
+                           cidr=None, updated_since=None):
         """
         Returns a list of instances.
 
+        The filters are applied by the registry, so only the matching
+        instances are transferred.
+
         :param ice.entities.Session session: The session.
+        :param list fields: The names of the fields to fetch. If set, the
+            instances are only partially populated; the other fields are
+            `None` and experiments cannot run on them.
+        :param dict tags: Tag keys and the values the instances should have.
+        :param str cidr: A network (e.g.: `10.0.0.0/16`) the public or a
+            private address of the instances belongs to.
+        :param datetime.datetime updated_since: The UTC time after which the
+            instances have been updated.
         :rtype: list of [entities.Instance]
         :return: List of `entities.Instance` instances.
         """
-        params = None
-        if session is not None:
-            params = {
-                'where': '{"session_id": "%s"}' % session.id
-            }
+        return list(self.iter_instances(
+            session, fields=fields, tags=tags, cidr=cidr,
+            updated_since=updated_since
+        ))
+
+    def iter_instances(self, session=None, page_size=100, prefetch=False,
+                       fields=None, tags=None, cidr=None, updated_since=None):
+        """
+        Iterates over the instances, fetching them page by page.
+
+        Pages are only fetched as the iteration reaches them, so callers can
+        start working on the first instances before the listing completes.
+
+        :param ice.entities.Session session: The session.
+        :param int page_size: The number of instances per page. The registry
+            may cap it.
+        :param bool prefetch: If set, the next page is fetched on a
+            background thread while the current one is being consumed.
+        :param list fields: The names of the fields to fetch. If set, the
+            instances are only partially populated; the other fields are
+            `None` and experiments cannot run on them.
+        :param dict tags: Tag keys and the values the instances should have.
+        :param str cidr: A network (e.g.: `10.0.0.0/16`) the public or a
+            private address of the instances belongs to.
+        :param datetime.datetime updated_since: The UTC time after which the
+            instances have been updated.
+        :rtype: generator
+        :return: Generator of `entities.Instance` instances.
+        :raises RegistryClient.APIException: In case of error.
+        :raises ValueError: If the network is not valid.
+        """
+        params = {}
+        where = self._get_instances_where(session, tags, cidr, updated_since)
+        if where:
+            params['where'] = json.dumps(where, sort_keys=True)
+        if fields is not None:
+            params['projection'] = json.dumps(
+                dict((field, 1) for field in fields)
+            )
+
+        pool = None
+        if prefetch:
+            pool = ThreadPool(1)
+        try:
+            page = 1
+            resp = self._get_instances_page(params, page, page_size)
+            while True:
+                has_next_page = self._has_next_page(resp)
+                if has_next_page:
+                    page += 1
+                    if pool is not None:
+                        next_resp = pool.apply_async(
+                            self._get_instances_page,
+                            (params, page, page_size)
+                        )
+
+                if fields is None:
+                    insts = entities.Instance.from_dicts(resp['_items'])
+                else:
+                    insts = [
+                        entities.Instance.from_partial(**entry)
+                        for entry in resp['_items']
+                    ]
+                for inst in insts:
+                    yield inst
+
+                if not has_next_page:
+                    break
+                if pool is not None:
+                    resp = next_resp.get()
+                else:
+                    resp = self._get_instances_page(params, page, page_size)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def watch_instances(self, session, timeout=30):
+        """
+        Watches instances joining and leaving a session.
 
-        resp = self._call('instances', 'GET', params=params)
-        ret_val = []
-        for entry in resp['_items']:
-            ret_val.append(entities.Instance(**entry))
+        The registry holds each request until an event arrives (long
+        polling), so events are reported as soon as they happen without
+        re-listing the instances. Watching starts when the generator is first
+        advanced.
 
-        return ret_val
+        :param ice.entities.Session session: The session.
+        :param float timeout: The number of seconds the registry holds a
+            request for, if no event arrives.
+        :rtype: generator
+        :return: Generator of tuples with the event type, `join` or `leave`,
+            in the first element and the `entities.Instance` instance in the
+            second.
+        :raises RegistryClient.APIException: In case of error. An HTTP 410
+            error means that events were lost and the instances have to be
+            listed again.
+        """
+        url_suffix = 'sessions/%s/instances/watch' % session.id
+        resp = self._call(url_suffix, 'GET')
+        while True:
+            resp = self._call(url_suffix, 'GET', params={
+                'since': resp['_seq'],
+                'timeout': timeout
+            })
+            for event in resp['_events']:
+                yield event['type'], entities.Instance(**event['instance'])
 
     def get_instance(self, inst_id):
         """
@@ -232,6 +498,89 @@ class RegistryClient:
         except RegistryClient.APIException:
             return None
 
+    def _get_instances_where(self, session, tags, cidr, updated_since):
+        """Translates instance filters to a registry query.
+
+        Networks are matched against the addresses the registry stores as
+        numbers, in `ip_addrs`.
+
+        :rtype: dict
+        """
+        where = {}
+        if session is not None:
+            where['session_id'] = session.id
+        for key, value in (tags or {}).items():
+            where['tags.%s' % key] = value
+        if cidr is not None:
+            first, last = entities.parse_ipv4_network(cidr)
+            where['ip_addrs'] = {
+                '$elemMatch': {'$gte': first, '$lte': last}
+            }
+        if updated_since is not None:
+            where['_updated'] = {
+                '$gt': updated_since.strftime(self.DATE_FORMAT)
+            }
+        return where
+
+    def _submit_instances_batch(self, insts, indices, ids):
+        """
+        Submits a batch of instances in a single request.
+
+        :param list insts: List of `entities.Instance` instances.
+        :param list indices: The indices of `insts` to submit.
+        :param list ids: The list to store the created ids at.
+        :raises RegistryClient.APIException: In case of error.
+        """
+        resp = self._call(
+            'instances', 'POST', data=[insts[ind].to_dict() for ind in indices]
+        )
+        self.invalidate_cache()
+        if len(indices) == 1:
+            items = [resp]
+        else:
+            items = resp['_items']
+        for ind, item in zip(indices, items):
+            insts[ind].id = item['_id']
+            ids[ind] = item['_id']
+
+    def _get_instances_page(self, params, page, page_size, cached=True):
+        """
+        Fetches a page of the instances list.
+
+        :param dict params: URL parameters of the listing.
+        :param int page: The page number, starting from 1.
+        :param int page_size: The number of instances per page.
+        :param bool cached: If unset, the page will not be cached even if
+            listings caching is enabled.
+        :rtype: dict
+        :return: The response dictionary.
+        :raises RegistryClient.APIException: In case of error.
+        """
+        page_params = dict(params)
+        # Pages are skips over the listing, so it has to be in a stable
+        # order for instances not to be repeated or missed across pages
+        page_params.setdefault('sort', '_id')
+        page_params['page'] = page
+        page_params['max_results'] = page_size
+        return self._call(
+            'instances', 'GET', params=page_params,
+            cached=cached and self.cfg.cache_listings
+        )
+
+    def _has_next_page(self, resp):
+        """
+        Checks if a listing response is followed by more pages.
+
+        :param dict resp: The response dictionary.
+        :rtype: bool
+        """
+        if '_links' in resp:
+            return 'next' in resp['_links']
+        if '_meta' not in resp:  # pagination is disabled
+            return False
+        meta = resp['_meta']
+        return meta['page'] * meta['max_results'] < meta['total']
+
     #
     # User data for ice-agent
     #
@@ -282,45 +631,92 @@ chmod +x ./ice-agent
         url += '/%s/%s' % (self.VERSION, suffix)
         return url
 
+    def _get_session(self):
+        """
+        Gets the pooled HTTP session, creating it on first use.
+
+        :rtype: requests.Session
+        :return: The HTTP session shared by all calls of the client.
+        """
+        if self._session is None:
+            adapter = adapters.HTTPAdapter(
+                pool_connections=self.cfg.pool_connections,
+                pool_maxsize=self.cfg.pool_maxsize,
+                pool_block=self.cfg.pool_block
+            )
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['User-Agent'] = 'iCE Client/%s' % ice.__version__
+            if not self.cfg.keep_alive:
+                session.headers['Connection'] = 'close'
+            self._session = session
+
+        return self._session
+
     def _call(self, url_suffix, method='GET', params=None, data=None,
-              return_raw=False):
+              return_raw=False, cached=False):
         """
         Performs a request to the API.
 
         :param str url_suffix: The URL suffix (without leading /).
         :param str method: An HTTP verb.
         :param dict params: URL parameters.
-        :param dict data: The data dictionary.
+        :param dict|list data: The data dictionary or, for bulk requests, a
+            list of data dictionaries.
         :param bool return_raw: If set, response will be a string.
+        :param bool cached: If set, the response of a GET request is cached
+            and revalidated with `If-None-Match`/`If-Modified-Since`.
         :rtype: dict|str
         :return: The response dictionary or the response string if `return_raw`
             is set.
         :raises RegistryClient.APIException: In case of error.
         """
-        # Find the method
-        try:
-            method = getattr(requests, method.lower())
-        except AttributeError:
+        # Check the method
+        method = method.upper()
+        if method not in self.HTTP_METHODS:
             # Unknown HTTP verb
             return None
 
         # Build the keyword arguments of the method
-        args = {
-            'headers': {
-                'User-Agent': 'iCE Client/%s' % ice.__version__
-            }
-        }
+        args = {}
         if data is not None:
-            args['headers']['Content-Type'] = 'application/json'
+            args['headers'] = {
+                'Content-Type': 'application/json'
+            }
             args['data'] = json.dumps(data)
         if params is not None:
             args['params'] = params
 
+        # Cache look-up
+        cache_key = None
+        cache_entry = None
+        if cached and method == 'GET' and not return_raw:
+            cache_key = self._get_cache_key(url_suffix, params)
+            with self._cache_lock:
+                cache_entry = self._cache.pop(cache_key, None)
+                if cache_entry is not None:
+                    self._cache[cache_key] = cache_entry  # most recently used
+        if cache_entry is not None:
+            if time.time() - cache_entry['time'] < self.cfg.cache_ttl:
+                return cache_entry['data']
+            args['headers'] = {}
+            if cache_entry['etag'] is not None:
+                args['headers']['If-None-Match'] = cache_entry['etag']
+            else:
+                args['headers']['If-Modified-Since'] = \
+                    cache_entry['last_modified']
+
         # Run the method
         try:
-            resp = method(self._get_url(url_suffix), **args)
+            resp = self._get_session().request(
+                method, self._get_url(url_suffix), **args
+            )
         except exceptions.RequestException as err:
             raise RegistryClient.APIException(parent=err)
+        if resp.status_code == 304 and cache_entry is not None:
+            cache_entry['time'] = time.time()
+            return cache_entry['data']
         if resp.status_code / 100 != 2:
             raise RegistryClient.APIException(
                 http_code=resp.status_code,
@@ -333,6 +729,222 @@ chmod +x ./ice-agent
         if resp.text == '':
             return ''
         try:
-            return resp.json()
+            resp_data = resp.json()
         except ValueError as err:
             raise RegistryClient.APIException(parent=err)
+
+        # Cache store
+        if cache_key is not None:
+            etag = resp.headers.get('ETag')
+            last_modified = resp.headers.get('Last-Modified')
+            if etag is not None or last_modified is not None:
+                with self._cache_lock:
+                    self._cache.pop(cache_key, None)
+                    self._cache[cache_key] = {
+                        'data': resp_data,
+                        'etag': etag,
+                        'last_modified': last_modified,
+                        'time': time.time()
+                    }
+                    while len(self._cache) > self.cfg.cache_size:
+                        self._cache.popitem(last=False)
+
+        return resp_data
+
+    def _get_cache_key(self, url_suffix, params):
+        """
+        Compiles the cache key of a request.
+
+        :param str url_suffix: The URL suffix (without leading /).
+        :param dict params: URL parameters.
+        :rtype: tuple
+        """
+        if params is None:
+            return url_suffix, ()
+        return url_suffix, tuple(sorted(params.items()))
+
+
+class InstancesMirror(object):
+    """Local mirror of the instances of a session.
+
+    The first `sync` lists all the instances. Later ones only fetch the
+    instances that were updated or deleted since, so their cost depends on
+    the churn of the pool rather than on its size. A mirror that has not
+    synced for longer than the tombstone retention of the registry lists all
+    the instances again, as the deletions it missed may have been purged.
+
+    :type client: RegistryClient
+    :type session: ice.entities.Session
+    :type instances: dict
+    """
+
+    DATE_FORMAT = RegistryClient.DATE_FORMAT
+    # The registry stores timestamps in seconds and a write may land after
+    # a later one has been read. Changes are re-read for this many seconds.
+    SYNC_OVERLAP_SECS = 5
+
+    def __init__(self, client, session, page_size=100,
+                 tombstone_retention=86400):
+        """Creates a mirror.
+
+        :param RegistryClient client: The registry client.
+        :param ice.entities.Session session: The session to mirror.
+        :param int page_size: The number of instances per page.
+        :param int tombstone_retention: The number of seconds the registry
+            keeps the tombstones of deleted instances for. It should not
+            exceed the retention of the registry server.
+        """
+        self.client = client
+        self.session = session
+        self.page_size = page_size
+        self.tombstone_retention = tombstone_retention
+
+        self.instances = {}
+        self._last_updated = None
+        self._last_sync_time = None
+
+    def sync(self):
+        """Brings the mirror up to date with the registry.
+
+        :rtype: tuple
+        :return: A tuple with the list of added `entities.Instance` instances
+            in the first element and the list of removed ones in the second.
+        :raises RegistryClient.APIException: In case of error.
+        """
+        now = time.time()
+        full_sync = self._last_updated is None or \
+            now - self._last_sync_time >= self.tombstone_retention
+        where = {'session_id': self.session.id}
+        params = {'sort': '_updated'}
+        if not full_sync:
+            since = self._last_updated - timedelta(
+                seconds=self.SYNC_OVERLAP_SECS
+            )
+            where['_updated'] = {'$gte': since.strftime(self.DATE_FORMAT)}
+            params['show_deleted'] = 1
+        params['where'] = json.dumps(where)
+
+        added = []
+        removed = []
+        seen_ids = set()
+        last_updated = self._last_updated
+        page = 1
+        while True:
+            resp = self.client._get_instances_page(
+                params, page, self.page_size, cached=False
+            )
+            for entry in resp['_items']:
+                seen_ids.add(entry['_id'])
+                updated = datetime.strptime(
+                    entry['_updated'], self.DATE_FORMAT
+                )
+                if last_updated is None or updated > last_updated:
+                    last_updated = updated
+
+                if entry.get('_deleted', False):
+                    inst = self.instances.pop(entry['_id'], None)
+                    if inst is not None:
+                        removed.append(inst)
+                    continue
+                inst = entities.Instance(**entry)
+                if entry['_id'] not in self.instances:
+                    added.append(inst)
+                self.instances[entry['_id']] = inst
+
+            if not self.client._has_next_page(resp):
+                break
+            page += 1
+
+        # Instances that changed while paging may have moved to a page that
+        # was already read. Re-read the same period next time in that case.
+        if '_meta' in resp and len(seen_ids) != resp['_meta']['total']:
+            return added, removed
+
+        if full_sync:
+            # Instances missing from a full listing have been deleted
+            for inst_id in set(self.instances) - seen_ids:
+                removed.append(self.instances.pop(inst_id))
+        self._last_updated = last_updated
+        self._last_sync_time = now
+
+        return added, removed
+
+
+class AsyncRegistryClient(object):
+    """Registry client with non-blocking calls.
+
+    Every call is dispatched to a bounded pool of worker threads and returns
+    at once with a `multiprocessing.pool.AsyncResult`. Its `get` method
+    returns the result of the respective `RegistryClient` method or raises
+    the same `RegistryClient.APIException`. The calls share the pooled HTTP
+    session of a single `RegistryClient`.
+
+    :type client: RegistryClient
+    """
+
+    def __init__(self, cfg, max_concurrency=10):
+        """Creates an asynchronous registry client.
+
+        :param CfgRegistryClient cfg: The registry client configuration. Its
+            `pool_maxsize` should not be lower than `max_concurrency` or
+            connections will not be reused.
+        :param int max_concurrency: The maximum number of concurrent calls.
+            Further calls are queued.
+        """
+        self.client = RegistryClient(cfg)
+        self._pool = ThreadPool(max_concurrency)
+
+    def close(self):
+        """Waits for the queued calls and releases the client resources."""
+        self._pool.close()
+        self._pool.join()
+        self.client.close()
+
+    def ping(self):
+        return self._apply(self.client.ping)
+
+    def get_my_ip(self):
+        return self._apply(self.client.get_my_ip)
+
+    def submit_session(self, session):
+        return self._apply(self.client.submit_session, session)
+
+    def delete_session(self, session):
+        return self._apply(self.client.delete_session, session)
+
+    def get_sessions_list(self):
+        return self._apply(self.client.get_sessions_list)
+
+    def get_session(self, session_id):
+        return self._apply(self.client.get_session, session_id)
+
+    def submit_instance(self, inst):
+        return self._apply(self.client.submit_instance, inst)
+
+    def submit_instances(self, insts, batch_size=100):
+        return self._apply(self.client.submit_instances, insts, batch_size)
+
+    def delete_instance(self, inst):
+        return self._apply(self.client.delete_instance, inst)
+
+    def heartbeat(self, inst):
+        return self._apply(self.client.heartbeat, inst)
+
+    def get_instances_list(self, session=None, fields=None, tags=None,
+                           cidr=None, updated_since=None):
+        return self._apply(
+            self.client.get_instances_list, session, fields, tags, cidr,
+            updated_since
+        )
+
+    def get_instance(self, inst_id):
+        return self._apply(self.client.get_instance, inst_id)
+
+    def _apply(self, func, *args):
+        """
+        Schedules a call on the worker pool.
+
+        :param callable func: The `RegistryClient` method.
+        :rtype: multiprocessing.pool.AsyncResult
+        """
+        return self._pool.apply_async(func, args)
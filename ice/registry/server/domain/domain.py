@@ -4,6 +4,8 @@ class Domain(object):
     DEFAULT_ITEM_TITLE = None
     DEFAULT_RESOURCE_METHODS = ['GET', 'POST', 'DELETE']
     DEFAULT_ITEM_METHODS = ['GET', 'DELETE', 'PUT', 'PATCH']
+    DEFAULT_BULK_ENABLED = True
+    DEFAULT_SOFT_DELETE = False
 
     def __init__(self):
         """Create the domain object"""
@@ -11,6 +13,8 @@ class Domain(object):
         self.item_title = self.__class__.DEFAULT_ITEM_TITLE
         self.resource_methods = self.__class__.DEFAULT_RESOURCE_METHODS
         self.item_methods = self.__class__.DEFAULT_ITEM_METHODS
+        self.bulk_enabled = self.__class__.DEFAULT_BULK_ENABLED
+        self.soft_delete = self.__class__.DEFAULT_SOFT_DELETE
 
     def get_endpoint(self):
         """Get the endpoint of the domain.
@@ -35,13 +39,34 @@ class Domain(object):
         config['item_methods'] = self.item_methods
         config['resource_methods'] = self.resource_methods
 
+        # Bulk inserts
+        config['bulk_enabled'] = self.bulk_enabled
+
+        # Soft deletes, deleted items are kept as tombstones
+        config['soft_delete'] = self.soft_delete
+
         # Add schema
         schema = self.get_schema()
         if schema is not None:
             config['schema'] = schema
 
+        # Add MongoDB indexes
+        indexes = self.get_indexes()
+        if indexes is not None:
+            config['mongo_indexes'] = indexes
+
         return config
 
+    def get_indexes(self):
+        """Expendable MongoDB index generator for the domain.
+
+        :rtype: dict
+        :return: An EVE compliant `mongo_indexes` definition, mapping index
+            names to lists of (field, direction) tuples or to tuples of such
+            a list and a dictionary of index options.
+        """
+        return None
+
     # def get_schema(self):
     #     """Expendable schema generator for the domain.
 
@@ -6,6 +6,47 @@ class InstancesDomain(Domain):
     DEFAULT_ENDPOINT = 'instances'
     DEFAULT_ITEM_TITLE = 'instance'
     DEFAULT_ITEM_METHODS = ['GET', 'DELETE']
+    DEFAULT_SOFT_DELETE = True
+
+    def __init__(self, ttl=None, indexed_tags=None,
+                 tombstone_retention=86400):
+        """Create the instances domain.
+
+        :param int ttl: If set, instances that have not sent a heartbeat for
+            this many seconds are deleted by the periodic sweep of the
+            registry server. Optional, default: None.
+        :param list indexed_tags: The keys of the tags that instances are
+            commonly selected by (e.g.: `role`). Optional, default: None.
+        :param int tombstone_retention: Deleted instances are kept as
+            tombstones for this many seconds, so that mirrors can sync their
+            deletion, and are then purged by the periodic sweep of the
+            registry server. If None, tombstones are never purged. Optional,
+            default: 86400.
+        """
+        super(InstancesDomain, self).__init__()
+        self.ttl = ttl
+        self.indexed_tags = indexed_tags or []
+        self.tombstone_retention = tombstone_retention
+
+    def get_indexes(self):
+        indexes = {
+            # Listing and syncing the instances of a session
+            'session_id_updated': [('session_id', 1), ('_updated', 1)],
+            'session_id_id': [('session_id', 1), ('_id', 1)],
+            # Looking up instances by address
+            'public_ip_addr': [('public_ip_addr', 1)],
+            # Selecting instances by network
+            'ip_addrs': [('ip_addrs', 1)],
+            # Selecting recently updated instances across sessions and
+            # purging old tombstones
+            'updated': [('_updated', 1)]
+        }
+        for key in self.indexed_tags:
+            indexes['tags_%s' % key] = [('tags.%s' % key, 1)]
+        if self.ttl is not None:
+            # Sweeping expired instances
+            indexes['last_seen'] = [('last_seen', 1)]
+        return indexes
 
     def get_schema(self):
         return {
@@ -70,5 +111,20 @@ class InstancesDomain(Domain):
             'tags': {
                 'required': False,
                 'type': 'dict'
+            },
+
+            # Public and network addresses as numbers, set by the registry
+            'ip_addrs': {
+                'readonly': True,
+                'type': 'list',
+                'schema': {
+                    'type': 'integer'
+                }
+            },
+
+            # Heartbeats, set by the registry
+            'last_seen': {
+                'readonly': True,
+                'type': 'datetime'
             }
         }
@@ -7,6 +7,11 @@ class SessionsDomain(Domain):
     DEFAULT_ITEM_TITLE = 'session'
     DEFAULT_ITEM_METHODS = ['GET', 'DELETE']
 
+    def get_indexes(self):
+        return {
+            'client_ip_addr': [('client_ip_addr', 1)]
+        }
+
     def get_schema(self):
         return {
             'client_ip_addr': {
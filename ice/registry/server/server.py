@@ -1,9 +1,22 @@
-from flask import request
+import threading
+import time
+from datetime import datetime, timedelta
+from bson import objectid
+from pymongo import UpdateOne
+from flask import abort, request
 from eve import Eve
+from eve.render import render_json
+from ice import entities
 from . import validation
+from . import watch
 
 
 class RegistryServer(Eve):
+    MAX_WATCH_TIMEOUT = 60
+    # Maximum number of seconds between sweeps of expired instances and
+    # old tombstones
+    MAX_EXPIRY_INTERVAL = 60
+
     def __init__(self, cfg, domains, logger, *args, **kwargs):
         """Create a registry server instance.
 
@@ -20,6 +33,7 @@ class RegistryServer(Eve):
             'API_VERSION': 'v2',    # Version of the API
             'HATEOAS': False,       # Disable HATEOAS
             'IF_MATCH': False,      # Disable If-Match headers
+            'PAGINATION_LIMIT': 1000,   # Maximum page size
 
             # Setup logging
             'LOGGER_NAME': logger.name,
@@ -32,8 +46,13 @@ class RegistryServer(Eve):
             'MONGO_DBNAME': cfg.mongo_config['db_name']
         }
         settings['DOMAIN'] = {}
+        self.instances_ttl = None
+        self.tombstone_retention = None
         for dom in domains:
             settings['DOMAIN'][dom.get_endpoint()] = dom.get_config()
+            if dom.get_endpoint() == 'instances':
+                self.instances_ttl = dom.ttl
+                self.tombstone_retention = dom.tombstone_retention
         super(RegistryServer, self).__init__(
             settings=settings, validator=validation.MyValidator,
             *args, **kwargs
@@ -43,13 +62,52 @@ class RegistryServer(Eve):
         self.add_url_rule(
             '/v2/my_ip', 'handle_get_my_ip', self.handle_get_my_ip
         )
+        if 'instances' in settings['DOMAIN']:
+            self.add_url_rule(
+                '/v2/sessions/<session_id>/instances',
+                'handle_delete_session_instances',
+                self.handle_delete_session_instances,
+                methods=['DELETE']
+            )
+            self.add_url_rule(
+                '/v2/sessions/<session_id>/instances/watch',
+                'handle_watch_session_instances',
+                self.handle_watch_session_instances
+            )
+            self.add_url_rule(
+                '/v2/instances/<inst_id>/heartbeat',
+                'handle_instance_heartbeat',
+                self.handle_instance_heartbeat,
+                methods=['PATCH']
+            )
+
+        # Instance membership events
+        self.watcher = watch.InstancesWatcher()
+        self.on_insert_instances += self.handle_insert_instances
+        self.on_inserted_instances += self.handle_inserted_instances
+        self.on_deleted_item_instances += self.handle_deleted_instance
+
+        # Conditional requests
+        self.after_request(self.handle_conditional_get)
 
     def run(self, *args, **kwargs):
         """Run the server."""
+        if 'instances' in self.config['DOMAIN']:
+            count = self.backfill_ip_addrs()
+            if count > 0:
+                self.logger.info(
+                    'Stored the addresses of %d instance(s) as numbers.'
+                    % count
+                )
+        if self._get_sweep_interval() is not None:
+            sweeper = threading.Thread(target=self._sweep_instances)
+            sweeper.daemon = True
+            sweeper.start()
         super(RegistryServer, self).run(
             host=self.cfg.host,
             port=self.cfg.port,
             debug=self.cfg.debug,
+            threaded=True,  # watch requests block until events arrive
             *args, **kwargs
         )
 
@@ -60,3 +118,227 @@ class RegistryServer(Eve):
             return ips[0]
 
         return request.environ['REMOTE_ADDR']
+
+    def handle_conditional_get(self, response):
+        """Adds an ETag to responses that lack one and answers with 304 when
+        the client already holds the same representation.
+
+        Eve only emits ETags for items, so this covers the collection
+        listings. `If-Modified-Since` is deliberately not honoured as the
+        `Last-Modified` of a listing does not reflect deleted items.
+        """
+        if request.method != 'GET' or response.status_code != 200:
+            return response
+        if response.direct_passthrough or 'ETag' in response.headers:
+            return response
+
+        response.add_etag()
+        etag, _ = response.get_etag()
+        if request.if_none_match.contains(etag):
+            not_modified = self.response_class(status=304)
+            not_modified.set_etag(etag)
+            return not_modified
+
+        return response
+
+    def handle_delete_session_instances(self, session_id):
+        try:
+            session_id = objectid.ObjectId(session_id)
+        except objectid.InvalidId:
+            return '', 204  # no instance can belong to an invalid session
+
+        self._delete_instances({'session_id': session_id})
+        return '', 204
+
+    def backfill_ip_addrs(self, batch_size=1000):
+        """Sets the `ip_addrs` of the instances registered before they were
+        stored, so that `cidr` filters match them too.
+
+        :param int batch_size: The number of instances to update per
+            request to MongoDB.
+        :rtype: int
+        :return: The number of updated instances.
+        """
+        coll = self.data.driver.db['instances']
+        docs = coll.find(
+            {'ip_addrs': {'$exists': False}},
+            {'public_ip_addr': 1, 'networks': 1}
+        )
+        count = 0
+        updates = []
+        for doc in docs:
+            updates.append(UpdateOne(
+                {'_id': doc['_id']},
+                {'$set': {'ip_addrs': self._get_ip_addrs(doc)}}
+            ))
+            if len(updates) == batch_size:
+                coll.bulk_write(updates, ordered=False)
+                count += len(updates)
+                updates = []
+        if len(updates) > 0:
+            coll.bulk_write(updates, ordered=False)
+            count += len(updates)
+        return count
+
+    def expire_instances(self):
+        """Deletes the instances that have not sent a heartbeat for longer
+        than the TTL of the instances domain. Like other deletions, they
+        leave tombstones and `leave` events, so that mirrors and watches of
+        their sessions drop them.
+
+        :rtype: int
+        :return: The number of expired instances.
+        """
+        if self.instances_ttl is None:
+            return 0
+        deadline = datetime.utcnow().replace(microsecond=0) - \
+            timedelta(seconds=self.instances_ttl)
+        return len(self._delete_instances({'last_seen': {'$lt': deadline}}))
+
+    def purge_tombstones(self):
+        """Removes the tombstones of instances that were deleted longer ago
+        than the tombstone retention of the instances domain.
+
+        :rtype: int
+        :return: The number of purged tombstones.
+        """
+        if self.tombstone_retention is None or \
+                not self.config['DOMAIN']['instances']['soft_delete']:
+            return 0
+        deadline = datetime.utcnow().replace(microsecond=0) - \
+            timedelta(seconds=self.tombstone_retention)
+        res = self.data.driver.db['instances'].delete_many({
+            self.config['DELETED']: True,
+            self.config['LAST_UPDATED']: {'$lt': deadline}
+        })
+        return res.deleted_count
+
+    def handle_watch_session_instances(self, session_id):
+        try:
+            session_id = objectid.ObjectId(session_id)
+        except objectid.InvalidId:
+            abort(404)
+
+        since = request.args.get('since', None, type=int)
+        timeout = min(
+            request.args.get('timeout', 30, type=float),
+            self.MAX_WATCH_TIMEOUT
+        )
+        if since is None:  # start watching
+            events, seq = [], self.watcher.get_seq()
+        elif not self.watcher.is_valid_seq(since):
+            abort(410)  # the client has to re-list the instances
+        else:
+            events, seq = self.watcher.wait_events(session_id, since, timeout)
+
+        resp = {
+            '_seq': seq,
+            '_events': [
+                {'_seq': ev_seq, 'type': ev_type, 'instance': doc}
+                for ev_seq, ev_type, doc in events
+            ]
+        }
+        return self.response_class(
+            render_json(resp), mimetype='application/json'
+        )
+
+    def handle_instance_heartbeat(self, inst_id):
+        try:
+            inst_id = objectid.ObjectId(inst_id)
+        except objectid.InvalidId:
+            abort(404)
+
+        # `_updated` is left intact, heartbeats are not changes of the pool
+        lookup = {'_id': inst_id}
+        if self.config['DOMAIN']['instances']['soft_delete']:
+            lookup[self.config['DELETED']] = {'$ne': True}
+        res = self.data.driver.db['instances'].update_one(lookup, {
+            '$set': {'last_seen': datetime.utcnow().replace(microsecond=0)}
+        })
+        if res.matched_count == 0:
+            abort(404)
+        return '', 204
+
+    def handle_insert_instances(self, docs):
+        now = datetime.utcnow().replace(microsecond=0)
+        for doc in docs:
+            doc['last_seen'] = now
+            doc['ip_addrs'] = self._get_ip_addrs(doc)
+
+    def handle_inserted_instances(self, docs):
+        self.watcher.add_events('join', docs)
+
+    def handle_deleted_instance(self, doc):
+        self.watcher.add_events('leave', [doc])
+
+    def _delete_instances(self, lookup):
+        """Deletes instances and records their `leave` events.
+
+        :param dict lookup: The MongoDB query of the instances.
+        :rtype: list
+        :return: The documents of the deleted instances.
+        """
+        soft_delete = self.config['DOMAIN']['instances']['soft_delete']
+        if soft_delete:
+            lookup[self.config['DELETED']] = {'$ne': True}
+        insts = list(self.data.driver.db['instances'].find(lookup))
+        if soft_delete:
+            # Keep tombstones, like Eve does for single items
+            self.data.driver.db['instances'].update_many(lookup, {
+                '$set': {
+                    self.config['DELETED']: True,
+                    self.config['LAST_UPDATED']:
+                        datetime.utcnow().replace(microsecond=0)
+                }
+            })
+        else:
+            self.data.remove('instances', lookup)
+        self.watcher.add_events('leave', insts)
+        return insts
+
+    def _get_sweep_interval(self):
+        """Gets the number of seconds between sweeps of the instances.
+
+        :rtype: int
+        :return: The interval or None if there is nothing to sweep.
+        """
+        periods = [
+            period for period in (self.instances_ttl, self.tombstone_retention)
+            if period is not None
+        ]
+        if not periods:
+            return None
+        return min(periods + [self.MAX_EXPIRY_INTERVAL])
+
+    def _sweep_instances(self):
+        interval = self._get_sweep_interval()
+        while True:
+            time.sleep(interval)
+            try:
+                count = self.expire_instances()
+            except Exception as err:
+                self.logger.error('Cannot expire instances: %s' % err)
+            else:
+                if count > 0:
+                    self.logger.info('%d instance(s) have expired.' % count)
+            try:
+                count = self.purge_tombstones()
+            except Exception as err:
+                self.logger.error('Cannot purge tombstones: %s' % err)
+            else:
+                if count > 0:
+                    self.logger.info('Purged %d tombstone(s).' % count)
+
+    def _get_ip_addrs(self, doc):
+        """Gets the public and network IPv4 addresses of an instance document
+        as numbers, so that networks can be selected with range queries.
+
+        :param dict doc: The instance document.
+        :rtype: list
+        """
+        addrs = [doc.get('public_ip_addr')] + [
+            net['addr'] for net in doc.get('networks', [])
+        ]
+        addr_nums = set(entities.parse_ipv4_addr(addr) for addr in addrs)
+        addr_nums.discard(None)
+        return sorted(addr_nums)
@@ -0,0 +1,86 @@
+"""Instance membership events for long-polling clients."""
+import collections
+import threading
+import time
+
+
+class InstancesWatcher(object):
+    """Keeps the latest join/leave events of instances in memory.
+
+    Events are numbered with increasing sequence numbers. Clients ask for
+    the events after the last sequence number they have seen and wait until
+    one arrives or the timeout expires.
+    """
+
+    def __init__(self, max_events=10000):
+        """Creates an instances watcher.
+
+        :param int max_events: The number of events to keep. Clients lagging
+            further behind have to re-list the instances.
+        """
+        self._events = collections.deque(maxlen=max_events)
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def get_seq(self):
+        """Gets the sequence number of the latest event.
+
+        :rtype: int
+        """
+        with self._cond:
+            return self._seq
+
+    def is_valid_seq(self, since):
+        """Checks if the events after a sequence number are still known.
+
+        :param int since: The sequence number.
+        :rtype: bool
+        """
+        with self._cond:
+            if since > self._seq:
+                return False  # e.g.: the registry server has restarted
+            if len(self._events) > 0 and since < self._events[0][0] - 1:
+                return False  # events have been dropped
+            return True
+
+    def add_events(self, event_type, insts):
+        """Records an event for each of the given instances.
+
+        :param str event_type: `join` or `leave`.
+        :param list insts: The instance documents.
+        """
+        with self._cond:
+            for inst in insts:
+                self._seq += 1
+                self._events.append((self._seq, event_type, inst))
+            self._cond.notify_all()
+
+    def wait_events(self, session_id, since, timeout):
+        """Waits for the events of a session after a sequence number.
+
+        :param bson.objectid.ObjectId session_id: The session id.
+        :param int since: The sequence number of the last seen event.
+        :param float timeout: The maximum number of seconds to wait.
+        :rtype: tuple
+        :return: A tuple with the list of events, as (seq, type, document)
+            tuples, in the first element and the sequence number to resume
+            from in the second.
+        """
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                events = []
+                for event in reversed(self._events):
+                    if event[0] <= since:
+                        break
+                    if event[2].get('session_id') == session_id:
+                        events.append(event)
+                events.reverse()
+
+                remaining = deadline - time.time()
+                if len(events) > 0 or remaining <= 0:
+                    return events, self._seq
+                # The events of other sessions are skipped by resuming from
+                # the latest sequence number.
+                since = self._seq
+                self._cond.wait(remaining)
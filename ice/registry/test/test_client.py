@@ -1,4 +1,8 @@
+import json
+import threading
+from datetime import datetime
 import unittest2
+import mock
 from ice import entities
 from ice.registry import client
 
@@ -48,3 +52,652 @@ chmod +x ./ice-agent
             ' --tag tag_b=val_b'
         expected_user_data += '\n'
         self.assertEquals(user_data, expected_user_data)
+
+
+class TestSession(unittest2.TestCase):
+    def test_session_is_reused(self):
+        c = client.RegistryClient(client.CfgRegistryClient('localhost', 8080))
+
+        self.assertIs(c._get_session(), c._get_session())
+
+    def test_session_pool_settings(self):
+        c = client.RegistryClient(
+            client.CfgRegistryClient(
+                'localhost', 8080, pool_connections=3, pool_maxsize=7,
+                pool_block=True
+            )
+        )
+
+        adapter = c._get_session().get_adapter('http://localhost:8080')
+        self.assertEqual(adapter._pool_connections, 3)
+        self.assertEqual(adapter._pool_maxsize, 7)
+        self.assertEqual(adapter._pool_block, True)
+
+    def test_session_without_keep_alive(self):
+        c = client.RegistryClient(
+            client.CfgRegistryClient('localhost', 8080, keep_alive=False)
+        )
+
+        self.assertEqual(c._get_session().headers['Connection'], 'close')
+
+    def test_close(self):
+        c = client.RegistryClient(client.CfgRegistryClient('localhost', 8080))
+        session = c._get_session()
+
+        c.close()
+
+        self.assertIsNot(c._get_session(), session)
+
+    def test_call_uses_session(self):
+        c = client.RegistryClient(client.CfgRegistryClient('localhost', 8080))
+        c._session = mock.MagicMock()
+        c._session.request.return_value.status_code = 200
+        c._session.request.return_value.text = '{"_id": "1234"}'
+        c._session.request.return_value.json.return_value = {'_id': '1234'}
+
+        self.assertEqual(c._call('sessions/1234'), {'_id': '1234'})
+        c._session.request.assert_called_once_with(
+            'GET', 'http://localhost:8080/v2/sessions/1234'
+        )
+
+    def test_call_with_unknown_method(self):
+        c = client.RegistryClient(client.CfgRegistryClient('localhost', 8080))
+        c._session = mock.MagicMock()
+
+        self.assertIsNone(c._call('sessions', 'BANANA'))
+        self.assertEqual(c._session.request.call_count, 0)
+
+
+class TestSubmitInstances(unittest2.TestCase):
+    def setUp(self):
+        self.c = client.RegistryClient(
+            client.CfgRegistryClient('localhost', 8080)
+        )
+        self.insts = [
+            entities.Instance(
+                session_id='1234abcd',
+                public_ip_addr='127.0.0.%d' % ind
+            ) for ind in range(5)
+        ]
+
+    def _validation_error(self, issues):
+        resp = mock.MagicMock()
+        resp.json.return_value = {
+            '_status': 'ERR',
+            '_items': [
+                {'_status': 'ERR', '_issues': iss} if iss else
+                {'_status': 'OK'} for iss in issues
+            ]
+        }
+        return client.RegistryClient.APIException(
+            http_code=422, response=resp
+        )
+
+    def test_batches(self):
+        self.c._call = mock.MagicMock(side_effect=[
+            {'_items': [{'_id': 'id-0'}, {'_id': 'id-1'}]},
+            {'_items': [{'_id': 'id-2'}, {'_id': 'id-3'}]},
+            {'_id': 'id-4'}
+        ])
+
+        ids, errors = self.c.submit_instances(self.insts, batch_size=2)
+
+        self.assertEqual(ids, ['id-0', 'id-1', 'id-2', 'id-3', 'id-4'])
+        self.assertEqual(errors, {})
+        self.assertEqual(self.c._call.call_count, 3)
+        self.assertEqual(
+            [inst.id for inst in self.insts],
+            ['id-0', 'id-1', 'id-2', 'id-3', 'id-4']
+        )
+        self.c._call.assert_any_call(
+            'instances', 'POST',
+            data=[self.insts[2].to_dict(), self.insts[3].to_dict()]
+        )
+
+    def test_validation_errors(self):
+        self.c._call = mock.MagicMock(side_effect=[
+            self._validation_error([
+                None, {'public_ip_addr': 'must be of Ip type'}, None
+            ]),
+            {'_items': [{'_id': 'id-0'}, {'_id': 'id-2'}]},
+            {'_items': [{'_id': 'id-3'}, {'_id': 'id-4'}]}
+        ])
+
+        ids, errors = self.c.submit_instances(self.insts, batch_size=3)
+
+        self.assertEqual(ids, ['id-0', None, 'id-2', 'id-3', 'id-4'])
+        self.assertEqual(errors, {1: {'public_ip_addr': 'must be of Ip type'}})
+        self.c._call.assert_any_call(
+            'instances', 'POST',
+            data=[self.insts[0].to_dict(), self.insts[2].to_dict()]
+        )
+
+    def test_other_errors_are_raised(self):
+        self.c._call = mock.MagicMock(
+            side_effect=client.RegistryClient.APIException(http_code=500)
+        )
+
+        with self.assertRaises(client.RegistryClient.APIException):
+            self.c.submit_instances(self.insts)
+
+
+class TestDeleteSessionInstances(unittest2.TestCase):
+    def setUp(self):
+        self.c = client.RegistryClient(
+            client.CfgRegistryClient('localhost', 8080)
+        )
+        self.sess = entities.Session(
+            _id='1234abcd',
+            client_ip_addr='80.10.100.200'
+        )
+        self.insts = [
+            entities.Instance(
+                _id='inst-%d' % ind,
+                session_id='1234abcd',
+                public_ip_addr='127.0.0.%d' % ind
+            ) for ind in range(5)
+        ]
+
+    def test_server_side_deletion(self):
+        self.c._call = mock.MagicMock(return_value='')
+        self.c.get_instances_list = mock.MagicMock()
+
+        self.assertEqual(self.c.delete_session_instances(self.sess), [])
+        self.c._call.assert_called_once_with(
+            'sessions/1234abcd/instances', 'DELETE'
+        )
+        self.assertEqual(self.c.get_instances_list.call_count, 0)
+
+    def test_fallback_reports_failures(self):
+        self.c._call = mock.MagicMock(
+            side_effect=client.RegistryClient.APIException(http_code=404)
+        )
+        self.c.get_instances_list = mock.MagicMock(return_value=self.insts)
+        self.c.delete_instance = mock.MagicMock(
+            side_effect=lambda inst: inst.id not in ['inst-1', 'inst-3']
+        )
+
+        failed = self.c.delete_session_instances(self.sess, pool_size=2)
+
+        self.assertEqual(failed, [self.insts[1], self.insts[3]])
+        self.assertEqual(self.c.delete_instance.call_count, 5)
+
+    def test_delete_session_keeps_session_on_failure(self):
+        self.c.delete_session_instances = mock.MagicMock(
+            return_value=[self.insts[0]]
+        )
+        self.c._call = mock.MagicMock()
+
+        self.assertFalse(self.c.delete_session(self.sess))
+        self.assertEqual(self.c._call.call_count, 0)
+
+
+class TestIterInstances(unittest2.TestCase):
+    def setUp(self):
+        self.c = client.RegistryClient(
+            client.CfgRegistryClient('localhost', 8080)
+        )
+        self.sess = entities.Session(
+            _id='1234abcd',
+            client_ip_addr='80.10.100.200'
+        )
+        self.pages = [
+            {
+                '_items': [
+                    {
+                        '_id': 'inst-%d' % ind,
+                        'session_id': '1234abcd',
+                        'public_ip_addr': '127.0.0.%d' % ind
+                    } for ind in range(start, min(start + 2, 5))
+                ],
+                '_meta': {'page': page, 'max_results': 2, 'total': 5}
+            } for page, start in [(1, 0), (2, 2), (3, 4)]
+        ]
+
+    def _get_page(self, url_suffix, method, params, cached):
+        return self.pages[params['page'] - 1]
+
+    def test_follows_pages(self):
+        self.c._call = mock.MagicMock(side_effect=self._get_page)
+
+        insts = list(self.c.iter_instances(self.sess, page_size=2))
+
+        self.assertEqual(
+            [inst.id for inst in insts],
+            ['inst-0', 'inst-1', 'inst-2', 'inst-3', 'inst-4']
+        )
+        self.assertEqual(self.c._call.call_count, 3)
+        self.c._call.assert_any_call('instances', 'GET', params={
+            'where': '{"session_id": "1234abcd"}',
+            'sort': '_id',
+            'page': 3,
+            'max_results': 2
+        }, cached=True)
+
+    def test_is_lazy(self):
+        self.c._call = mock.MagicMock(side_effect=self._get_page)
+
+        gen = self.c.iter_instances(self.sess, page_size=2)
+        next(gen)
+        next(gen)
+
+        self.assertEqual(self.c._call.call_count, 1)
+
+    def test_prefetch(self):
+        self.c._call = mock.MagicMock(side_effect=self._get_page)
+
+        insts = list(
+            self.c.iter_instances(self.sess, page_size=2, prefetch=True)
+        )
+
+        self.assertEqual(len(insts), 5)
+        self.assertEqual(self.c._call.call_count, 3)
+
+    def test_follows_links(self):
+        self.pages[0]['_links'] = {'next': {'href': 'instances?page=2'}}
+        self.pages[1]['_links'] = {}
+        self.c._call = mock.MagicMock(side_effect=self._get_page)
+
+        insts = list(self.c.iter_instances(self.sess, page_size=2))
+
+        self.assertEqual(len(insts), 4)
+
+    def test_fields(self):
+        self.pages = [{
+            '_items': [{'_id': 'inst-0', 'public_reverse_dns': 'host0'}],
+            '_meta': {'page': 1, 'max_results': 2, 'total': 1}
+        }]
+        self.c._call = mock.MagicMock(side_effect=self._get_page)
+
+        insts = self.c.get_instances_list(
+            self.sess, fields=['public_reverse_dns']
+        )
+
+        self.assertEqual(insts[0].public_reverse_dns, 'host0')
+        self.assertIsNone(insts[0].public_ip_addr)
+        _, kwargs = self.c._call.call_args
+        self.assertEqual(
+            json.loads(kwargs['params']['projection']),
+            {'public_reverse_dns': 1}
+        )
+
+    def test_get_instances_list_reads_all_pages(self):
+        self.c._call = mock.MagicMock(side_effect=self._get_page)
+
+        self.assertEqual(len(self.c.get_instances_list(self.sess)), 5)
+
+    def test_filters(self):
+        self.c._call = mock.MagicMock(side_effect=self._get_page)
+
+        self.c.get_instances_list(
+            self.sess, tags={'role': 'worker'}, cidr='10.0.1.0/24',
+            updated_since=datetime(2016, 10, 18, 10, 0, 0)
+        )
+
+        _, kwargs = self.c._call.call_args
+        self.assertEqual(json.loads(kwargs['params']['where']), {
+            'session_id': '1234abcd',
+            'tags.role': 'worker',
+            'ip_addrs': {
+                '$elemMatch': {'$gte': 167772416, '$lte': 167772671}
+            },
+            '_updated': {'$gt': 'Tue, 18 Oct 2016 10:00:00 GMT'}
+        })
+
+    def test_filters_without_session(self):
+        self.c._call = mock.MagicMock(side_effect=self._get_page)
+
+        self.c.get_instances_list(cidr='127.0.0.1')
+
+        _, kwargs = self.c._call.call_args
+        self.assertEqual(json.loads(kwargs['params']['where']), {
+            'ip_addrs': {
+                '$elemMatch': {'$gte': 2130706433, '$lte': 2130706433}
+            }
+        })
+
+    def test_no_filters(self):
+        self.c._call = mock.MagicMock(side_effect=self._get_page)
+
+        self.c.get_instances_list()
+
+        _, kwargs = self.c._call.call_args
+        self.assertNotIn('where', kwargs['params'])
+
+    def test_invalid_cidr(self):
+        with self.assertRaises(ValueError):
+            self.c.get_instances_list(cidr='10.0.1.0/40')
+
+
+class TestListingCache(unittest2.TestCase):
+    def setUp(self):
+        self.c = client.RegistryClient(
+            client.CfgRegistryClient('localhost', 8080)
+        )
+        self.c._session = mock.MagicMock()
+        self.page = {
+            '_items': [
+                {'session_id': '1234abcd', 'public_ip_addr': '127.0.0.1'}
+            ],
+            '_meta': {'page': 1, 'max_results': 100, 'total': 1}
+        }
+
+    def _make_response(self, status_code, etag='"etag-1"'):
+        resp = mock.MagicMock()
+        resp.status_code = status_code
+        resp.headers = {'ETag': etag}
+        resp.text = ''
+        if status_code == 200:
+            resp.text = 'not empty'
+            resp.json.return_value = self.page
+        return resp
+
+    def test_it_revalidates(self):
+        self.c._session.request.side_effect = [
+            self._make_response(200), self._make_response(304)
+        ]
+
+        self.assertEqual(len(self.c.get_instances_list()), 1)
+        self.assertEqual(len(self.c.get_instances_list()), 1)
+
+        _, kwargs = self.c._session.request.call_args
+        self.assertEqual(kwargs['headers'], {'If-None-Match': '"etag-1"'})
+
+    def test_it_serves_fresh_entries(self):
+        self.c.cfg.cache_ttl = 60
+        self.c._session.request.side_effect = [self._make_response(200)]
+
+        self.c.get_instances_list()
+        self.c.get_instances_list()
+
+        self.assertEqual(self.c._session.request.call_count, 1)
+
+    def test_submit_instance_invalidates(self):
+        self.c.cfg.cache_ttl = 60
+        self.c._session.request.side_effect = [self._make_response(200)]
+        self.c.get_instances_list()
+        self.c._call = mock.MagicMock(return_value={'_id': 'inst-1'})
+
+        self.c.submit_instance(entities.Instance(**self.page['_items'][0]))
+
+        self.assertEqual(self.c._cache, {})
+
+    def test_delete_instance_invalidates(self):
+        self.c.cfg.cache_ttl = 60
+        self.c._session.request.side_effect = [self._make_response(200)]
+        self.c.get_instances_list()
+        self.c._call = mock.MagicMock(return_value='')
+
+        self.c.delete_instance(entities.Instance(**self.page['_items'][0]))
+
+        self.assertEqual(self.c._cache, {})
+
+    def test_it_drops_least_recently_used(self):
+        self.c.cfg.cache_ttl = 60
+        self.c.cfg.cache_size = 2
+        self.c._session.request.side_effect = [
+            self._make_response(200) for _ in range(4)
+        ]
+
+        self.c.get_instances_list(tags={'role': 'a'})
+        self.c.get_instances_list(tags={'role': 'b'})
+        self.c.get_instances_list(tags={'role': 'a'})
+        self.c.get_instances_list(tags={'role': 'c'})
+        self.assertEqual(self.c._session.request.call_count, 3)
+        self.assertEqual(len(self.c._cache), 2)
+
+        self.c.get_instances_list(tags={'role': 'a'})
+        self.assertEqual(self.c._session.request.call_count, 3)
+        self.c.get_instances_list(tags={'role': 'b'})
+        self.assertEqual(self.c._session.request.call_count, 4)
+
+    def test_disabled(self):
+        self.c.cfg.cache_listings = False
+        self.c._session.request.side_effect = [
+            self._make_response(200), self._make_response(200)
+        ]
+
+        self.c.get_instances_list()
+        self.c.get_instances_list()
+
+        _, kwargs = self.c._session.request.call_args
+        self.assertNotIn('headers', kwargs)
+
+
+class TestInstancesMirror(unittest2.TestCase):
+    def setUp(self):
+        self.c = client.RegistryClient(
+            client.CfgRegistryClient('localhost', 8080)
+        )
+        self.sess = entities.Session(
+            _id='1234abcd',
+            client_ip_addr='80.10.100.200'
+        )
+        self.mirror = client.InstancesMirror(self.c, self.sess)
+
+    def _make_entry(self, ind, updated, deleted=False):
+        entry = {
+            '_id': 'inst-%d' % ind,
+            '_updated': updated,
+            'session_id': '1234abcd',
+            'public_ip_addr': '127.0.0.%d' % ind
+        }
+        if deleted:
+            entry['_deleted'] = True
+        return entry
+
+    def _make_page(self, entries):
+        return {
+            '_items': entries,
+            '_meta': {'page': 1, 'max_results': 100, 'total': len(entries)}
+        }
+
+    def test_first_sync_lists_all(self):
+        self.c._call = mock.MagicMock(return_value=self._make_page([
+            self._make_entry(1, 'Tue, 18 Oct 2016 10:00:00 GMT'),
+            self._make_entry(2, 'Tue, 18 Oct 2016 10:00:05 GMT')
+        ]))
+
+        added, removed = self.mirror.sync()
+
+        self.assertItemsEqual(
+            [inst.id for inst in added], ['inst-1', 'inst-2']
+        )
+        self.assertEqual(removed, [])
+        self.assertItemsEqual(
+            self.mirror.instances.keys(), ['inst-1', 'inst-2']
+        )
+        _, kwargs = self.c._call.call_args
+        self.assertNotIn('show_deleted', kwargs['params'])
+        self.assertEqual(
+            json.loads(kwargs['params']['where']), {'session_id': '1234abcd'}
+        )
+
+    def test_next_sync_fetches_changes(self):
+        self.c._call = mock.MagicMock(side_effect=[
+            self._make_page([
+                self._make_entry(1, 'Tue, 18 Oct 2016 10:00:00 GMT'),
+                self._make_entry(2, 'Tue, 18 Oct 2016 10:00:05 GMT')
+            ]),
+            self._make_page([
+                self._make_entry(2, 'Tue, 18 Oct 2016 10:00:05 GMT'),
+                self._make_entry(1, 'Tue, 18 Oct 2016 10:01:00 GMT', True),
+                self._make_entry(3, 'Tue, 18 Oct 2016 10:01:00 GMT')
+            ])
+        ])
+        self.mirror.sync()
+
+        added, removed = self.mirror.sync()
+
+        self.assertEqual([inst.id for inst in added], ['inst-3'])
+        self.assertEqual([inst.id for inst in removed], ['inst-1'])
+        self.assertItemsEqual(
+            self.mirror.instances.keys(), ['inst-2', 'inst-3']
+        )
+        _, kwargs = self.c._call.call_args
+        self.assertIn('show_deleted', kwargs['params'])
+        self.assertEqual(json.loads(kwargs['params']['where']), {
+            'session_id': '1234abcd',
+            '_updated': {'$gte': 'Tue, 18 Oct 2016 10:00:00 GMT'}
+        })
+        self.assertFalse(kwargs['cached'])
+
+    def test_changes_while_paging_are_read_again(self):
+        page = self._make_page([
+            self._make_entry(1, 'Tue, 18 Oct 2016 10:00:00 GMT')
+        ])
+        page['_meta']['total'] = 2
+        self.c._call = mock.MagicMock(return_value=page)
+
+        self.mirror.sync()
+
+        self.assertIsNone(self.mirror._last_updated)
+
+    def test_stale_mirror_lists_all(self):
+        self.c._call = mock.MagicMock(side_effect=[
+            self._make_page([
+                self._make_entry(1, 'Tue, 18 Oct 2016 10:00:00 GMT'),
+                self._make_entry(2, 'Tue, 18 Oct 2016 10:00:05 GMT')
+            ]),
+            self._make_page([
+                self._make_entry(2, 'Tue, 18 Oct 2016 10:00:05 GMT')
+            ])
+        ])
+        self.mirror.sync()
+        # The tombstone of `inst-1` may have been purged since
+        self.mirror._last_sync_time -= self.mirror.tombstone_retention
+
+        added, removed = self.mirror.sync()
+
+        self.assertEqual(added, [])
+        self.assertEqual([inst.id for inst in removed], ['inst-1'])
+        self.assertEqual(self.mirror.instances.keys(), ['inst-2'])
+        _, kwargs = self.c._call.call_args
+        self.assertNotIn('show_deleted', kwargs['params'])
+        self.assertEqual(
+            json.loads(kwargs['params']['where']), {'session_id': '1234abcd'}
+        )
+
+
+class TestWatchInstances(unittest2.TestCase):
+    def test_it_yields_events(self):
+        c = client.RegistryClient(client.CfgRegistryClient('localhost', 8080))
+        sess = entities.Session(_id='1234abcd', client_ip_addr='80.10.100.200')
+        inst_dict = {'session_id': '1234abcd', 'public_ip_addr': '127.0.0.1'}
+        c._call = mock.MagicMock(side_effect=[
+            {'_seq': 4, '_events': []},
+            {'_seq': 6, '_events': []},
+            {'_seq': 8, '_events': [
+                {'_seq': 7, 'type': 'join', 'instance': inst_dict},
+                {'_seq': 8, 'type': 'leave', 'instance': inst_dict}
+            ]}
+        ])
+
+        gen = c.watch_instances(sess, timeout=10)
+
+        event_type, inst = next(gen)
+        self.assertEqual(event_type, 'join')
+        self.assertEqual(inst.public_ip_addr, '127.0.0.1')
+        self.assertEqual(next(gen)[0], 'leave')
+        c._call.assert_any_call('sessions/1234abcd/instances/watch', 'GET')
+        c._call.assert_any_call(
+            'sessions/1234abcd/instances/watch', 'GET',
+            params={'since': 6, 'timeout': 10}
+        )
+
+
+class TestAsyncRegistryClient(unittest2.TestCase):
+    def setUp(self):
+        self.c = client.AsyncRegistryClient(
+            client.CfgRegistryClient('localhost', 8080), max_concurrency=2
+        )
+
+    def tearDown(self):
+        self.c.close()
+
+    def test_it_returns_results(self):
+        self.c.client.get_instance = mock.MagicMock(return_value='inst')
+
+        res = self.c.get_instance('1234')
+
+        self.assertEqual(res.get(), 'inst')
+        self.c.client.get_instance.assert_called_once_with('1234')
+
+    def test_concurrent_listings(self):
+        c = client.AsyncRegistryClient(
+            client.CfgRegistryClient('localhost', 8080, cache_size=4),
+            max_concurrency=16
+        )
+        page = {
+            '_items': [
+                {'session_id': '1234abcd', 'public_ip_addr': '127.0.0.1'}
+            ],
+            '_meta': {'page': 1, 'max_results': 100, 'total': 1}
+        }
+
+        def request(*args, **kwargs):
+            resp = mock.MagicMock()
+            resp.status_code = 200
+            resp.headers = {'ETag': '"etag-1"'}
+            resp.text = 'not empty'
+            resp.json.return_value = page
+            return resp
+        c.client._session = mock.MagicMock()
+        c.client._session.request.side_effect = request
+
+        try:
+            pending = [
+                c.get_instances_list(tags={'role': str(ind % 8)})
+                for ind in range(2000)
+            ]
+            results = [res.get() for res in pending]
+        finally:
+            c.close()
+
+        self.assertTrue(all(len(insts) == 1 for insts in results))
+        self.assertLessEqual(len(c.client._cache), 4)
+
+    def test_it_raises_api_exceptions(self):
+        self.c.client.submit_session = mock.MagicMock(
+            side_effect=client.RegistryClient.APIException(http_code=500)
+        )
+
+        res = self.c.submit_session(None)
+
+        with self.assertRaises(client.RegistryClient.APIException):
+            res.get()
+
+    def test_calls_run_concurrently(self):
+        barrier = threading.Event()
+        self.c.client.ping = mock.MagicMock(side_effect=barrier.wait)
+        self.c.client.get_my_ip = mock.MagicMock(side_effect=barrier.set)
+
+        first = self.c.ping()
+        self.c.get_my_ip().get(5)
+
+        first.get(5)
+
+
+class TestHeartbeat(unittest2.TestCase):
+    def setUp(self):
+        self.c = client.RegistryClient(
+            client.CfgRegistryClient('localhost', 8080)
+        )
+        self.inst = entities.Instance(
+            _id='inst-1', session_id='1234abcd', public_ip_addr='127.0.0.1'
+        )
+
+    def test_heartbeat(self):
+        self.c._call = mock.MagicMock(return_value='')
+
+        self.assertTrue(self.c.heartbeat(self.inst))
+        self.c._call.assert_called_once_with(
+            'instances/inst-1/heartbeat', 'PATCH'
+        )
+
+    def test_heartbeat_of_expired_instance(self):
+        self.c._call = mock.MagicMock(
+            side_effect=client.RegistryClient.APIException(http_code=404)
+        )
+
+        self.assertFalse(self.c.heartbeat(self.inst))
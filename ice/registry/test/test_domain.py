@@ -0,0 +1,52 @@
+import unittest2
+from ice.registry.server.domain.instances import InstancesDomain
+from ice.registry.server.domain.sessions import SessionsDomain
+
+
+class TestGetConfig(unittest2.TestCase):
+    def test_instances_indexes(self):
+        config = InstancesDomain().get_config()
+
+        self.assertEqual(
+            config['mongo_indexes']['session_id_updated'],
+            [('session_id', 1), ('_updated', 1)]
+        )
+
+    def test_instances_ttl_index(self):
+        config = InstancesDomain(ttl=300).get_config()
+
+        self.assertEqual(
+            config['mongo_indexes']['last_seen'], [('last_seen', 1)]
+        )
+
+    def test_instances_without_ttl(self):
+        config = InstancesDomain().get_config()
+
+        self.assertNotIn('last_seen', config['mongo_indexes'])
+
+    def test_instances_tombstone_retention(self):
+        self.assertEqual(InstancesDomain().tombstone_retention, 86400)
+        self.assertIsNone(
+            InstancesDomain(tombstone_retention=None).tombstone_retention
+        )
+
+    def test_instances_tag_indexes(self):
+        config = InstancesDomain(indexed_tags=['role']).get_config()
+
+        self.assertEqual(
+            config['mongo_indexes']['tags_role'], [('tags.role', 1)]
+        )
+        self.assertEqual(
+            config['mongo_indexes']['ip_addrs'], [('ip_addrs', 1)]
+        )
+
+    def test_sessions_indexes(self):
+        config = SessionsDomain().get_config()
+
+        self.assertIn('mongo_indexes', config)
+
+    def test_no_indexes(self):
+        dom = SessionsDomain()
+        dom.get_indexes = lambda: None
+
+        self.assertNotIn('mongo_indexes', dom.get_config())
@@ -3,7 +3,8 @@ import unittest2
 import random
 import threading
 from ice import entities
-from ice.registry.client import RegistryClient, CfgRegistryClient
+from ice.registry.client import RegistryClient, CfgRegistryClient, \
+    InstancesMirror, AsyncRegistryClient
 from ice.registry.server import RegistryServer
 from ice.registry.server.domain.instances import InstancesDomain
 from ice.registry.server.domain.sessions import SessionsDomain
@@ -55,6 +56,24 @@ class TestMyIP(ServerTestCase):
         self.assertEqual(self.client.get_my_ip(), '127.0.0.1')
 
 
+class TestAsyncRegistryClient(ServerTestCase):
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.async_client = AsyncRegistryClient(
+            CfgRegistryClient('localhost', self.port), max_concurrency=4
+        )
+
+    def tearDown(self):
+        self.async_client.close()
+
+    def test_my_ip(self):
+        results = [self.async_client.get_my_ip() for _ in range(10)]
+        self.assertEqual([res.get(5) for res in results], ['127.0.0.1'] * 10)
+
+    def test_get_session_when_it_does_not_exist(self):
+        self.assertIsNone(self.async_client.get_session('foo-bar').get(5))
+
+
 class TestSessionLifecycle(ServerTestCase):
     def setUp(self):
         ServerTestCase.setUp(self)
@@ -143,6 +162,138 @@ class TestInstanceLifecycle(ServerTestCase):
         recv_inst = self.client.get_instance(inst_id)
         self.assertIsNone(recv_inst)
 
+    def test_heartbeat(self):
+        inst_id = self.client.submit_instance(self.inst)
+        self.assertIsNotNone(self.client.get_instance(inst_id).last_seen)
+
+        self.assertTrue(self.client.heartbeat(self.inst))
+
+    def test_heartbeat_after_deletion(self):
+        self.client.submit_instance(self.inst)
+        self.client.delete_instance(self.inst)
+
+        self.assertFalse(self.client.heartbeat(self.inst))
+
+    def test_delete_session_instances(self):
+        self.client.submit_instance(self.inst)
+
+        failed = self.client.delete_session_instances(self.sess)
+
+        self.assertEqual(failed, [])
+        self.assertEqual(self.client.get_instances_list(self.sess), [])
+        self.assertIsNotNone(self.client.get_session(self.sess.id))
+
+
+class TestSubmitInstances(ServerTestCase):
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.sess = entities.Session(
+            client_ip_addr='127.128.129.130'
+        )
+        self.client.submit_session(self.sess)
+
+        self.insts = [
+            entities.Instance(
+                session_id=self.sess.id,
+                public_ip_addr='127.0.0.%d' % ind,
+                public_reverse_dns='localhost'
+            ) for ind in range(5)
+        ]
+
+    def test_submit_instances(self):
+        ids, errors = self.client.submit_instances(self.insts, batch_size=2)
+
+        self.assertEqual(errors, {})
+        self.assertEqual(len(self.client.get_instances_list(self.sess)), 5)
+        for inst_id, inst in zip(ids, self.insts):
+            recv_inst = self.client.get_instance(inst_id)
+            self.assertEquals(inst.to_dict(), recv_inst.to_dict())
+
+    def test_iter_instances(self):
+        ids, _ = self.client.submit_instances(self.insts)
+
+        recv_insts = self.client.iter_instances(self.sess, page_size=2)
+
+        self.assertItemsEqual([inst.id for inst in recv_insts], ids)
+
+    def test_get_instances_list_with_fields(self):
+        self.client.submit_instances(self.insts)
+
+        recv_insts = self.client.get_instances_list(
+            self.sess, fields=['public_ip_addr']
+        )
+
+        self.assertItemsEqual(
+            [inst.public_ip_addr for inst in recv_insts],
+            [inst.public_ip_addr for inst in self.insts]
+        )
+        for inst in recv_insts:
+            self.assertIsNone(inst.session_id)
+            self.assertIsNone(inst.public_reverse_dns)
+
+    def test_get_instances_list_with_filters(self):
+        self.insts[1].tags['role'] = 'worker'
+        self.insts[3].tags['role'] = 'worker'
+        self.insts[3].add_network('10.0.1.2/24')
+        self.client.submit_instances(self.insts)
+
+        workers = self.client.get_instances_list(
+            self.sess, tags={'role': 'worker'}
+        )
+        in_network = self.client.get_instances_list(
+            self.sess, cidr='10.0.1.0/24'
+        )
+
+        self.assertItemsEqual(
+            [inst.public_ip_addr for inst in workers],
+            ['127.0.0.1', '127.0.0.3']
+        )
+        self.assertEqual(
+            [inst.public_ip_addr for inst in in_network], ['127.0.0.3']
+        )
+
+    def test_instances_mirror(self):
+        mirror = InstancesMirror(self.client, self.sess)
+        self.client.submit_instances(self.insts[:3])
+
+        added, removed = mirror.sync()
+        self.assertEqual(len(added), 3)
+        self.assertEqual(removed, [])
+
+        self.client.delete_instance(self.insts[0])
+        self.client.submit_instances(self.insts[3:])
+
+        added, removed = mirror.sync()
+        self.assertItemsEqual(
+            [inst.id for inst in added], [self.insts[3].id, self.insts[4].id]
+        )
+        self.assertEqual([inst.id for inst in removed], [self.insts[0].id])
+
+    def test_watch_instances(self):
+        timer = threading.Timer(
+            0.5, self.client.submit_instances, [self.insts[:2]]
+        )
+        timer.start()
+
+        gen = self.client.watch_instances(self.sess, timeout=5)
+        events = [next(gen), next(gen)]
+
+        self.assertEqual([ev_type for ev_type, _ in events], ['join', 'join'])
+        self.assertItemsEqual(
+            [inst.id for _, inst in events],
+            [self.insts[0].id, self.insts[1].id]
+        )
+        timer.join()
+
+    def test_submit_instances_with_invalid_instance(self):
+        self.insts[1].public_ip_addr = '127.x.0.1'
+
+        ids, errors = self.client.submit_instances(self.insts)
+
+        self.assertIsNone(ids[1])
+        self.assertItemsEqual(errors.keys(), [1])
+        self.assertEqual(len(self.client.get_instances_list(self.sess)), 4)
+
 
 class TestSubmitInstance(ServerTestCase):
     def setUp(self):
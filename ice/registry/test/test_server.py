@@ -0,0 +1,282 @@
+import json
+import mock
+import unittest2
+from bson import objectid
+from ice.registry.server import RegistryServer
+from ice.registry.server.domain.instances import InstancesDomain
+from ice.registry.server.domain.sessions import SessionsDomain
+from ice.registry.server.config import CfgRegistryServer
+from ice.test.logger import get_dummy_logger
+
+
+class ServerTestCase(unittest2.TestCase):
+    def setUp(self):
+        cfg = CfgRegistryServer(
+            host='localhost',
+            port=8080,
+            mongo_host='localhost',
+            mongo_port=27017,
+            mongo_db='ice'
+        )
+
+        # Indexes are created in MongoDB at start-up
+        with mock.patch('eve.flaskapp.create_index'):
+            self.server = RegistryServer(
+                cfg,
+                [InstancesDomain(), SessionsDomain()],
+                get_dummy_logger('ice-registry-server')
+            )
+        self.server.data = mock.MagicMock(
+            json_encoder_class=self.server.data.json_encoder_class
+        )
+        self.test_client = self.server.test_client()
+
+
+class TestDeleteSessionInstances(ServerTestCase):
+    def test_it_marks_instances_deleted(self):
+        sess_id = '57f3a2d5e4b0a1b2c3d4e5f6'
+        coll = self.server.data.driver.db['instances']
+
+        resp = self.test_client.delete('/v2/sessions/%s/instances' % sess_id)
+
+        self.assertEqual(resp.status_code, 204)
+        self.assertEqual(coll.update_many.call_count, 1)
+        lookup, update = coll.update_many.call_args[0]
+        self.assertEqual(lookup, {
+            'session_id': objectid.ObjectId(sess_id),
+            '_deleted': {'$ne': True}
+        })
+        self.assertEqual(update['$set']['_deleted'], True)
+        self.assertIn('_updated', update['$set'])
+        self.assertEqual(self.server.data.remove.call_count, 0)
+
+    def test_invalid_session_id(self):
+        resp = self.test_client.delete('/v2/sessions/foo-bar/instances')
+
+        self.assertEqual(resp.status_code, 204)
+        self.assertEqual(self.server.data.remove.call_count, 0)
+        coll = self.server.data.driver.db['instances']
+        self.assertEqual(coll.update_many.call_count, 0)
+
+
+class TestWatchSessionInstances(ServerTestCase):
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.sess_id = objectid.ObjectId('57f3a2d5e4b0a1b2c3d4e5f6')
+        self.url = '/v2/sessions/%s/instances/watch' % self.sess_id
+
+    def test_start(self):
+        self.server.handle_inserted_instances([{'session_id': self.sess_id}])
+
+        resp = self.test_client.get(self.url)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.data), {'_seq': 1, '_events': []})
+
+    def test_events(self):
+        self.server.handle_inserted_instances([
+            {'session_id': self.sess_id, 'public_ip_addr': '127.0.0.1'}
+        ])
+        self.server.handle_deleted_instance(
+            {'session_id': self.sess_id, 'public_ip_addr': '127.0.0.1'}
+        )
+
+        resp = self.test_client.get(self.url + '?since=0&timeout=0')
+
+        self.assertEqual(resp.status_code, 200)
+        resp_data = json.loads(resp.data)
+        self.assertEqual(resp_data['_seq'], 2)
+        self.assertEqual(
+            [(ev['_seq'], ev['type']) for ev in resp_data['_events']],
+            [(1, 'join'), (2, 'leave')]
+        )
+        self.assertEqual(
+            resp_data['_events'][0]['instance']['public_ip_addr'],
+            '127.0.0.1'
+        )
+
+    def test_lost_events(self):
+        resp = self.test_client.get(self.url + '?since=10&timeout=0')
+
+        self.assertEqual(resp.status_code, 410)
+
+    def test_session_deletion_events(self):
+        coll = self.server.data.driver.db['instances']
+        coll.find.return_value = [
+            {'session_id': self.sess_id, 'public_ip_addr': '127.0.0.1'}
+        ]
+        self.test_client.delete('/v2/sessions/%s/instances' % self.sess_id)
+
+        events, _ = self.server.watcher.wait_events(self.sess_id, 0, 0)
+
+        self.assertEqual([ev[1] for ev in events], ['leave'])
+
+
+class TestInstanceHeartbeat(ServerTestCase):
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.inst_id = objectid.ObjectId('57f3a2d5e4b0a1b2c3d4e5f6')
+        self.url = '/v2/instances/%s/heartbeat' % self.inst_id
+        self.coll = self.server.data.driver.db['instances']
+
+    def test_it_updates_last_seen(self):
+        self.coll.update_one.return_value.matched_count = 1
+
+        resp = self.test_client.patch(self.url)
+
+        self.assertEqual(resp.status_code, 204)
+        lookup, update = self.coll.update_one.call_args[0]
+        self.assertEqual(
+            lookup, {'_id': self.inst_id, '_deleted': {'$ne': True}}
+        )
+        self.assertEqual(update['$set'].keys(), ['last_seen'])
+
+    def test_instance_does_not_exist(self):
+        self.coll.update_one.return_value.matched_count = 0
+
+        resp = self.test_client.patch(self.url)
+
+        self.assertEqual(resp.status_code, 404)
+
+    def test_inserted_instances_are_seen(self):
+        docs = [{'public_ip_addr': '127.0.0.1'}]
+
+        self.server.handle_insert_instances(docs)
+
+        self.assertIn('last_seen', docs[0])
+
+
+class TestExpireInstances(ServerTestCase):
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.sess_id = objectid.ObjectId('57f3a2d5e4b0a1b2c3d4e5f6')
+        self.coll = self.server.data.driver.db['instances']
+        self.server.instances_ttl = 300
+
+    def test_it_marks_instances_deleted(self):
+        self.coll.find.return_value = [
+            {'session_id': self.sess_id, 'public_ip_addr': '127.0.0.1'}
+        ]
+
+        self.assertEqual(self.server.expire_instances(), 1)
+
+        lookup, update = self.coll.update_many.call_args[0]
+        self.assertItemsEqual(lookup.keys(), ['last_seen', '_deleted'])
+        self.assertIn('$lt', lookup['last_seen'])
+        self.assertEqual(update['$set']['_deleted'], True)
+        self.assertIn('_updated', update['$set'])
+        events, _ = self.server.watcher.wait_events(self.sess_id, 0, 0)
+        self.assertEqual([ev[1] for ev in events], ['leave'])
+
+    def test_without_ttl(self):
+        self.server.instances_ttl = None
+
+        self.assertEqual(self.server.expire_instances(), 0)
+        self.assertEqual(self.coll.find.call_count, 0)
+
+
+class TestPurgeTombstones(ServerTestCase):
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.coll = self.server.data.driver.db['instances']
+        self.server.tombstone_retention = 3600
+
+    def test_it_removes_old_tombstones(self):
+        self.coll.delete_many.return_value.deleted_count = 2
+
+        self.assertEqual(self.server.purge_tombstones(), 2)
+
+        lookup, = self.coll.delete_many.call_args[0]
+        self.assertItemsEqual(lookup.keys(), ['_deleted', '_updated'])
+        self.assertEqual(lookup['_deleted'], True)
+        self.assertIn('$lt', lookup['_updated'])
+
+    def test_without_retention(self):
+        self.server.tombstone_retention = None
+
+        self.assertEqual(self.server.purge_tombstones(), 0)
+        self.assertEqual(self.coll.delete_many.call_count, 0)
+
+    def test_sweep_interval(self):
+        self.server.instances_ttl = None
+        self.assertEqual(self.server._get_sweep_interval(), 60)
+
+        self.server.instances_ttl = 10
+        self.assertEqual(self.server._get_sweep_interval(), 10)
+
+        self.server.tombstone_retention = None
+        self.server.instances_ttl = None
+        self.assertIsNone(self.server._get_sweep_interval())
+
+
+class TestInsertInstances(ServerTestCase):
+    def test_it_stores_addresses_as_numbers(self):
+        doc = {
+            'public_ip_addr': '127.0.0.1',
+            'networks': [
+                {'addr': '10.0.1.2/24'},
+                {'addr': '127.0.0.1/8'}
+            ]
+        }
+
+        self.server.handle_insert_instances([doc])
+
+        self.assertEqual(doc['ip_addrs'], [167772418, 2130706433])
+        self.assertIn('last_seen', doc)
+
+
+class TestBackfillIpAddrs(ServerTestCase):
+    def test_it_updates_instances_without_addresses(self):
+        coll = self.server.data.driver.db['instances']
+        coll.find.return_value = [
+            {'_id': 'inst-%d' % i, 'public_ip_addr': '127.0.0.%d' % i}
+            for i in range(1, 4)
+        ]
+
+        self.assertEqual(self.server.backfill_ip_addrs(batch_size=2), 3)
+
+        self.assertEqual(
+            coll.find.call_args[0][0], {'ip_addrs': {'$exists': False}}
+        )
+        self.assertEqual(
+            [len(call[0][0]) for call in coll.bulk_write.call_args_list],
+            [2, 1]
+        )
+        update = coll.bulk_write.call_args_list[1][0][0][0]
+        self.assertEqual(update._filter, {'_id': 'inst-3'})
+        self.assertEqual(update._doc, {'$set': {'ip_addrs': [2130706435]}})
+
+    def test_nothing_to_update(self):
+        coll = self.server.data.driver.db['instances']
+        coll.find.return_value = []
+
+        self.assertEqual(self.server.backfill_ip_addrs(), 0)
+        self.assertEqual(coll.bulk_write.call_count, 0)
+
+
+class TestConditionalGet(ServerTestCase):
+    def _get_my_ip(self, etag=None):
+        headers = {'X-Forwarded-For': '10.0.0.1'}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        return self.test_client.get('/v2/my_ip', headers=headers)
+
+    def test_it_adds_etag(self):
+        resp = self._get_my_ip()
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIsNotNone(resp.headers.get('ETag'))
+
+    def test_it_responds_not_modified(self):
+        etag = self._get_my_ip().headers['ETag']
+
+        resp = self._get_my_ip(etag)
+
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b'')
+        self.assertEqual(resp.headers['ETag'], etag)
+
+    def test_it_responds_when_modified(self):
+        resp = self._get_my_ip('"banana"')
+
+        self.assertEqual(resp.status_code, 200)
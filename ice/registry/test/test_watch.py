@@ -0,0 +1,60 @@
+import threading
+import time
+import unittest2
+from ice.registry.server import watch
+
+
+class TestInstancesWatcher(unittest2.TestCase):
+    def setUp(self):
+        self.watcher = watch.InstancesWatcher(max_events=3)
+
+    def test_get_seq(self):
+        self.assertEqual(self.watcher.get_seq(), 0)
+        self.watcher.add_events('join', [{'session_id': 'a'}] * 2)
+        self.assertEqual(self.watcher.get_seq(), 2)
+
+    def test_is_valid_seq(self):
+        self.watcher.add_events('join', [{'session_id': 'a'}] * 5)
+
+        self.assertTrue(self.watcher.is_valid_seq(5))
+        self.assertTrue(self.watcher.is_valid_seq(2))
+        self.assertFalse(self.watcher.is_valid_seq(1))
+        self.assertFalse(self.watcher.is_valid_seq(6))
+
+    def test_wait_events_returns_session_events(self):
+        self.watcher.add_events('join', [{'session_id': 'a', 'n': 1}])
+        self.watcher.add_events('join', [{'session_id': 'b', 'n': 2}])
+        self.watcher.add_events('leave', [{'session_id': 'a', 'n': 1}])
+
+        events, seq = self.watcher.wait_events('a', 0, 0)
+
+        self.assertEqual(events, [
+            (1, 'join', {'session_id': 'a', 'n': 1}),
+            (3, 'leave', {'session_id': 'a', 'n': 1})
+        ])
+        self.assertEqual(seq, 3)
+
+    def test_wait_events_times_out(self):
+        self.watcher.add_events('join', [{'session_id': 'b'}])
+
+        events, seq = self.watcher.wait_events('a', 0, 0.05)
+
+        self.assertEqual(events, [])
+        self.assertEqual(seq, 1)
+
+    def test_wait_events_wakes_up(self):
+        def add_event():
+            time.sleep(0.05)
+            self.watcher.add_events('join', [{'session_id': 'b'}])
+            time.sleep(0.05)
+            self.watcher.add_events('join', [{'session_id': 'a'}])
+        thread = threading.Thread(target=add_event)
+        thread.start()
+
+        start_time = time.time()
+        events, seq = self.watcher.wait_events('a', 0, 10)
+
+        self.assertLess(time.time() - start_time, 5)
+        self.assertEqual(events, [(2, 'join', {'session_id': 'a'})])
+        self.assertEqual(seq, 2)
+        thread.join()
@@ -0,0 +1,255 @@
+"""Concurrent remote commands over shared SSH connections."""
+import socket
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+import paramiko
+from fabric import network as fabric_network
+
+
+class CommandResult(object):
+    """The outcome of a command on a host.
+
+    :type instance: ice.entities.Instance
+    :type host_string: str
+    :type command: str
+    :type stdout: str
+    :type stderr: str
+    :type exit_status: int
+    :type error: Exception
+    :type start_time: float
+    :type end_time: float
+    """
+
+    def __init__(self, instance, host_string, command, stdout=None,
+                 stderr=None, exit_status=None, error=None, start_time=None,
+                 end_time=None):
+        self.instance = instance
+        self.host_string = host_string
+        self.command = command
+        self.stdout = stdout
+        self.stderr = stderr
+        self.exit_status = exit_status
+        self.error = error
+        self.start_time = start_time
+        self.end_time = end_time
+
+    @property
+    def succeeded(self):
+        return self.error is None and self.exit_status == 0
+
+    def duration(self):
+        """
+        :rtype: float
+        :return: The number of seconds the command ran for or `None` if it
+            did not run.
+        """
+        if self.start_time is None or self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    def __repr__(self):
+        return 'CommandResult(%s, %r, %s)' % (
+            self.host_string, self.command, self.exit_status
+        )
+
+
+class RemoteCommands(object):
+    """Runs shell commands on many hosts from threads of the current
+    process, with a bounded number of commands in flight.
+
+    Each host gets a single SSH connection, opened on its first command and
+    shared by the commands that follow, each on a channel of its own.
+
+    :type key_filename: str
+    :type max_concurrency: int
+    :type max_channels: int
+    :type timeout: float
+    """
+
+    def __init__(self, targets, key_filename, max_concurrency=100,
+                 timeout=None, max_channels=8):
+        """
+        :param list targets: Tuples with an `ice.entities.Instance` instance
+            in the first element and its host string in the second.
+        :param str key_filename: The private SSH key file.
+        :param int max_concurrency: The maximum number of commands to run
+            concurrently.
+        :param float timeout: The maximum number of seconds to wait for a
+            connection or for the output of a command. Optional, default: no
+            limit.
+        :param int max_channels: The maximum number of commands to run
+            concurrently on a host. It is to stay below the `MaxSessions` of
+            its SSH server, 10 by default for OpenSSH. Optional, default: 8.
+        """
+        self.key_filename = key_filename
+        self.max_concurrency = max_concurrency
+        self.max_channels = max_channels
+        self.timeout = timeout
+
+        self._targets = list(targets)
+        self._host_strings = dict(
+            (id(inst), host_string) for inst, host_string in self._targets
+        )
+        self._pool = None
+        self._lock = threading.Lock()
+        self._clients = {}  # host string -> paramiko.SSHClient
+        self._client_locks = {}  # host string -> threading.Lock
+        self._channel_slots = {}  # host string -> threading.Semaphore
+
+    def get_instances(self):
+        """
+        :rtype: list
+        :return: The instances commands can run on.
+        """
+        return [inst for inst, _ in self._targets]
+
+    def submit(self, instance, command):
+        """Queues a command to run on a host.
+
+        :param ice.entities.Instance instance: The instance.
+        :param str command: The shell command.
+        :rtype: multiprocessing.pool.ApplyResult
+        :return: The pending result; its `get` method waits for the command
+            to complete and returns its `CommandResult`.
+        """
+        return self._get_pool().apply_async(
+            self._run, (instance, self._get_host_string(instance), command)
+        )
+
+    def run(self, command, instances=None):
+        """Runs a command on several hosts and waits for it to complete on
+        all of them.
+
+        :param str command: The shell command.
+        :param list instances: The instances. Optional, default: all.
+        :rtype: list
+        :return: The `CommandResult` objects, in the order of the instances.
+        """
+        return [
+            pending.get() for pending in [
+                self.submit(inst, command)
+                for inst in self._get_instances(instances)
+            ]
+        ]
+
+    def iter_run(self, command, instances=None):
+        """Runs a command on several hosts, reporting each host as it
+        completes.
+
+        :param str command: The shell command.
+        :param list instances: The instances. Optional, default: all.
+        :rtype: iterator
+        :return: Iterator of `CommandResult` objects, in the order the hosts
+            complete.
+        """
+        return self._get_pool().imap_unordered(
+            self._run_target, [
+                (inst, self._get_host_string(inst), command)
+                for inst in self._get_instances(instances)
+            ]
+        )
+
+    def close(self):
+        """Waits for the queued commands and closes the SSH connections."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        for client in self._clients.values():
+            self._close(client)
+        self._clients = {}
+
+    def _get_instances(self, instances):
+        if instances is None:
+            return self.get_instances()
+        return instances
+
+    def _get_host_string(self, instance):
+        try:
+            return self._host_strings[id(instance)]
+        except KeyError:
+            raise ValueError('Unknown instance: %r' % instance)
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ThreadPool(self.max_concurrency)
+        return self._pool
+
+    def _run_target(self, target):
+        return self._run(*target)
+
+    def _run(self, instance, host_string, command):
+        start_time = time.time()
+        client = None
+        try:
+            with self._get_channel_slot(host_string):
+                client = self._get_client(host_string)
+                stdin, stdout, stderr = client.exec_command(
+                    command, timeout=self.timeout
+                )
+                stdin.close()
+                stdout_data = stdout.read()
+                stderr_data = stderr.read()
+                exit_status = stdout.channel.recv_exit_status()
+        except (paramiko.SSHException, socket.error, EOFError) as err:
+            # Other commands may still be running on the connection, e.g.:
+            # if this one timed out or its channel was refused
+            if client is not None and not self._is_active(client):
+                self._drop_client(host_string, client)
+            return CommandResult(
+                instance, host_string, command, error=err,
+                start_time=start_time, end_time=time.time()
+            )
+        return CommandResult(
+            instance, host_string, command, stdout=stdout_data,
+            stderr=stderr_data, exit_status=exit_status, start_time=start_time,
+            end_time=time.time()
+        )
+
+    def _get_client(self, host_string):
+        """Gets the connection to a host, connecting on first use. Commands
+        to other hosts are not held up while connecting."""
+        with self._get_client_lock(host_string):
+            client = self._clients.get(host_string)
+            if client is None:
+                user, host, port = fabric_network.normalize(host_string)
+                client = paramiko.SSHClient()
+                client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                client.connect(
+                    host, port=int(port), username=user,
+                    key_filename=self.key_filename, timeout=self.timeout
+                )
+                self._clients[host_string] = client
+            return client
+
+    def _drop_client(self, host_string, client):
+        with self._get_client_lock(host_string):
+            # Another command may have reconnected already
+            if self._clients.get(host_string) is client:
+                del self._clients[host_string]
+        self._close(client)
+
+    def _get_client_lock(self, host_string):
+        with self._lock:
+            return self._client_locks.setdefault(
+                host_string, threading.Lock()
+            )
+
+    def _get_channel_slot(self, host_string):
+        with self._lock:
+            return self._channel_slots.setdefault(
+                host_string, threading.Semaphore(self.max_channels)
+            )
+
+    def _is_active(self, client):
+        transport = client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def _close(self, client):
+        if client is None:
+            return
+        try:
+            client.close()
+        except Exception:
+            pass
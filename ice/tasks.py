@@ -1,5 +1,12 @@
 """Fabric - iCE tasks."""
+import random
+import socket
 from fabric import api
+from fabric.exceptions import NetworkError
+from . import execution
+
+# Errors of failed or dropped connections, which may not recur
+TRANSIENT_ERRORS = (NetworkError, socket.error, EOFError)
 
 
 class Callable(object):
@@ -19,13 +26,103 @@ class ParallelRunner(Runner):
     pass
 
 
+class AsyncRunner(Runner):
+    """A runner that issues many short remote commands from threads of a
+    single process. Besides the instances, it receives an
+    `ice.remote.RemoteCommands` object, with up to `pool_size` commands in
+    flight.
+    """
+    pass
+
+
 class Task(Callable):
-    def __init__(self, func):
+    def __init__(self, func, retry_policy=None):
         super(Task, self).__init__(func)
         self.func = api.task(func)
+        self.retry_policy = retry_policy
 
 
 class ParallelTask(Task):
-    def __init__(self, func):
-        super(ParallelTask, self).__init__(func)
+    def __init__(self, func, retry_policy=None):
+        super(ParallelTask, self).__init__(func, retry_policy)
         self.func = api.parallel(func)
+
+
+class RetryPolicy(object):
+    """How a task is retried on a host it fails on, e.g.: because of a
+    transient SSH error.
+
+    The delay before each retry doubles, starting from `backoff` and up to
+    `max_backoff`, and is shortened by a random fraction of up to `jitter`,
+    so that hosts failing together do not retry together. Retries count
+    towards the time limit of the host, if any.
+
+    :type attempts: int
+    :type backoff: float
+    :type max_backoff: float
+    :type jitter: float
+    :type retry_on: tuple
+    """
+
+    def __init__(self, attempts=3, backoff=1.0, max_backoff=60.0,
+                 jitter=0.5, retry_on=TRANSIENT_ERRORS):
+        """
+        :param int attempts: The maximum number of times to run the task on
+            a host, including the first one.
+        :param float backoff: The number of seconds to wait before the first
+            retry.
+        :param float max_backoff: The maximum number of seconds to wait
+            before a retry.
+        :param float jitter: The maximum fraction of the delay to cut
+            randomly, from 0 to 1.
+        :param tuple retry_on: The error classes to retry on. Failed
+            connections raise `fabric.exceptions.NetworkError`. Fabric
+            aborts, e.g.: failed commands, raise `ice.execution.HostError`
+            and are only retried if it is listed. Optional, default:
+            `TRANSIENT_ERRORS`, so that bugs of the task are not retried.
+        """
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_on = tuple(retry_on)
+
+    def should_retry(self, err, attempt):
+        """
+        :param Exception err: The error the task failed with.
+        :param int attempt: The number of the attempt that failed, from 1.
+        :rtype: bool
+        """
+        return attempt < self.attempts and isinstance(err, self.retry_on)
+
+    def get_delay(self, attempt):
+        """
+        :param int attempt: The number of the attempt that failed, from 1.
+        :rtype: float
+        :return: The number of seconds to wait before retrying.
+        """
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return delay * (1 - self.jitter * random.random())
+
+
+def retry(attempts=3, backoff=1.0, max_backoff=60.0, jitter=0.5,
+          retry_on=TRANSIENT_ERRORS):
+    """Sets the retry policy of a task. See `RetryPolicy`, e.g.:
+
+        @ice.retry(attempts=5, retry_on=ice.tasks.TRANSIENT_ERRORS +
+                   (execution.HostError,))
+        @ice.ParallelTask
+        def a_task(instances):
+            ...
+
+    :rtype: callable
+    :return: The decorator.
+    """
+    def decorate(task):
+        if not isinstance(task, Task):
+            raise TypeError('Only tasks can be retried')
+        task.retry_policy = RetryPolicy(
+            attempts, backoff, max_backoff, jitter, retry_on
+        )
+        return task
+    return decorate
@@ -0,0 +1,91 @@
+import unittest2
+from ice import aggregation
+
+
+class ReducerTestCase(unittest2.TestCase):
+    def _reduce(self, reducer, results):
+        for ind, result in enumerate(results):
+            reducer.add('host%d' % ind, result)
+        return reducer.get_result()
+
+
+class TestCount(ReducerTestCase):
+    def test_count(self):
+        self.assertEqual(self._reduce(aggregation.Count(), ['a', None]), 2)
+
+    def test_no_results(self):
+        self.assertEqual(aggregation.Count().get_result(), 0)
+
+
+class TestSum(ReducerTestCase):
+    def test_sum(self):
+        self.assertEqual(self._reduce(aggregation.Sum(), [1, 2.5, 3]), 6.5)
+
+    def test_key(self):
+        self.assertEqual(
+            self._reduce(aggregation.Sum(key=len), ['ab', 'cde']), 5
+        )
+
+
+class TestMean(ReducerTestCase):
+    def test_mean(self):
+        self.assertEqual(self._reduce(aggregation.Mean(), [1, 2, 4]), 7 / 3.0)
+
+    def test_no_results(self):
+        self.assertIsNone(aggregation.Mean().get_result())
+
+
+class TestHistogram(ReducerTestCase):
+    def test_values(self):
+        self.assertEqual(
+            self._reduce(aggregation.Histogram(), ['ok', 'failed', 'ok']),
+            {'ok': 2, 'failed': 1}
+        )
+
+    def test_bins(self):
+        self.assertEqual(
+            self._reduce(aggregation.Histogram(bin_width=10),
+                         [1, 9.5, 10, 25, -1]),
+            {0: 2, 10: 1, 20: 1, -10: 1}
+        )
+
+    def test_result_is_a_copy(self):
+        reducer = aggregation.Histogram()
+        reducer.get_result()['a'] = 1
+        self.assertEqual(reducer.get_result(), {})
+
+
+class TestTopK(ReducerTestCase):
+    def test_top_k(self):
+        self.assertEqual(
+            self._reduce(aggregation.TopK(2), [3, 9, 1, 7]),
+            [('host1', 9), ('host3', 7)]
+        )
+
+    def test_fewer_results(self):
+        self.assertEqual(
+            self._reduce(aggregation.TopK(5), [3]), [('host0', 3)]
+        )
+
+    def test_ties(self):
+        self.assertEqual(
+            self._reduce(aggregation.TopK(2), [5, 5, 5]),
+            [('host0', 5), ('host1', 5)]
+        )
+
+    def test_key(self):
+        self.assertEqual(
+            self._reduce(aggregation.TopK(1, key=lambda res: res['load']),
+                         [{'load': 0.5}, {'load': 2.0}]),
+            [('host1', 2.0)]
+        )
+
+
+class TestReduce(ReducerTestCase):
+    def test_reduce(self):
+        self.assertEqual(
+            self._reduce(aggregation.Reduce(max, 0), [3, 9, 1]), 9
+        )
+
+    def test_no_results(self):
+        self.assertEqual(aggregation.Reduce(max, 0).get_result(), 0)
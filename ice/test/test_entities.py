@@ -1,10 +1,17 @@
+import pickle
 import unittest2
 from ice import entities
 
 
+class Fruit(entities.Entity):
+    __slots__ = ('name', 'age', '_test')
+
+    FIELDS = ('name', 'age')
+
+
 class TestEntity(unittest2.TestCase):
     def test_to_json(self):
-        e = entities.Entity()
+        e = Fruit()
         e.id = 'test-123'
         e.name = 'banana'
         e.age = 12
@@ -18,12 +25,19 @@ class TestEntity(unittest2.TestCase):
         )
 
     def test_to_json_with_underscore(self):
-        e = entities.Entity()
+        e = Fruit()
         e._test = 123
         e.name = 'banana'
+        e.age = None
 
         self.assertEqual(e.to_dict(), {'name': 'banana'})
 
+    def test_slots(self):
+        e = Fruit()
+
+        with self.assertRaises(AttributeError):
+            e.colour = 'yellow'
+
 
 class TestSession(unittest2.TestCase):
     def test_missing_property(self):
@@ -52,6 +66,17 @@ class TestInstance(unittest2.TestCase):
                 session_id='banana'
             )
 
+    def test_pickle(self):
+        inst = entities.Instance(
+            _id='inst-1', session_id='banana', public_ip_addr='127.0.0.1',
+            ssh_port=2222, tags={'role': 'worker'}
+        )
+
+        for protocol in range(3):
+            copy = pickle.loads(pickle.dumps(inst, protocol))
+            self.assertEqual(copy.id, 'inst-1')
+            self.assertEqual(copy.to_dict(), inst.to_dict())
+
     def test_add_network(self):
         entityA = entities.Instance(
             session_id='banana',
@@ -82,3 +107,177 @@ class TestInstance(unittest2.TestCase):
         )
 
         self.assertEqual(entityA.networks, entityB.networks)
+
+    def test_to_json_skips_last_seen(self):
+        inst = entities.Instance(
+            session_id='banana',
+            public_ip_addr='127.0.0.1',
+            last_seen='Tue, 18 Oct 2016 10:00:00 GMT'
+        )
+
+        self.assertNotIn('last_seen', inst.to_dict())
+
+    def test_from_dicts(self):
+        items = [
+            {
+                '_id': 'inst-%d' % ind,
+                'session_id': 'banana',
+                'public_ip_addr': '127.0.0.%d' % ind,
+                'networks': [{'addr': '10.0.0.%d/24' % ind, 'iface': 'eth0'}],
+                'tags': {'role': 'worker'}
+            } for ind in range(3)
+        ]
+
+        insts = entities.Instance.from_dicts(items)
+
+        self.assertEqual(
+            [inst.to_dict() for inst in insts],
+            [entities.Instance(**item).to_dict() for item in items]
+        )
+        self.assertEqual(insts[2].id, 'inst-2')
+        self.assertIsNot(insts[0].tags, items[0]['tags'])
+        self.assertIsNot(insts[0].networks[0], items[0]['networks'][0])
+
+    def test_unknown_network_keys_are_dropped(self):
+        inst = entities.Instance(
+            session_id='banana',
+            public_ip_addr='127.0.0.1',
+            networks=[{'addr': '10.0.0.1/24', 'mtu': 1500}]
+        )
+
+        self.assertEqual(inst.networks, [{'addr': '10.0.0.1/24'}])
+
+    def test_from_partial(self):
+        inst = entities.Instance.from_partial(
+            _id='inst-1',
+            public_reverse_dns='host1'
+        )
+
+        self.assertEqual(inst.id, 'inst-1')
+        self.assertIsNone(inst.session_id)
+        self.assertIsNone(inst.public_ip_addr)
+        self.assertIsNone(inst.ssh_port)
+        self.assertIsNone(inst.networks)
+        self.assertEqual(inst.to_dict(), {'public_reverse_dns': 'host1'})
+
+
+class TestParseIPv4(unittest2.TestCase):
+    def test_addr(self):
+        self.assertEqual(entities.parse_ipv4_addr('10.0.1.2'), 167772418)
+        self.assertEqual(entities.parse_ipv4_addr('10.0.1.2/24'), 167772418)
+        self.assertIsNone(entities.parse_ipv4_addr('fe80::1'))
+        self.assertIsNone(entities.parse_ipv4_addr(None))
+
+    def test_network(self):
+        self.assertEqual(
+            entities.parse_ipv4_network('10.0.1.2/24'),
+            (167772416, 167772671)
+        )
+        self.assertEqual(
+            entities.parse_ipv4_network('10.0.1.2'), (167772418, 167772418)
+        )
+        self.assertEqual(
+            entities.parse_ipv4_network('0.0.0.0/0'), (0, 4294967295)
+        )
+
+    def test_invalid_network(self):
+        for cidr in ['10.0.1.0/33', '10.0.1.0/-1', 'foo/24']:
+            with self.assertRaises(ValueError):
+                entities.parse_ipv4_network(cidr)
+
+
+class TestInstanceSet(unittest2.TestCase):
+    def setUp(self):
+        self.insts = []
+        for ind, (role, sess, ip) in enumerate([
+            ('master', 'sess-1', '1.2.3.4'),
+            ('worker', 'sess-1', '1.2.3.5'),
+            ('worker', 'sess-2', '5.6.7.8'),
+            (None, 'sess-2', '5.6.7.9')
+        ]):
+            inst = entities.Instance(session_id=sess, public_ip_addr=ip)
+            inst.id = 'inst-%d' % ind
+            if role is not None:
+                inst.tags['role'] = role
+            inst.add_network('10.0.%d.2/24' % ind)
+            self.insts.append(inst)
+        self.inst_set = entities.InstanceSet(self.insts)
+
+    def test_behaves_like_a_list(self):
+        self.assertEqual(len(self.inst_set), 4)
+        self.assertEqual(list(self.inst_set), self.insts)
+        self.assertIs(self.inst_set[1], self.insts[1])
+        self.assertEqual(list(self.inst_set[1:3]), self.insts[1:3])
+        self.assertIn(self.insts[2], self.inst_set)
+
+    def test_partial_instances(self):
+        inst = entities.Instance.from_partial(
+            _id='inst-9', public_reverse_dns='host9'
+        )
+
+        inst_set = entities.InstanceSet(self.insts + [inst])
+
+        self.assertEqual(len(inst_set), 5)
+        self.assertEqual(len(inst_set.filter(tag='role')), 3)
+        self.assertEqual(len(inst_set.filter(cidr='10.0.0.0/16')), 4)
+
+    def test_duplicates_are_dropped(self):
+        inst_set = entities.InstanceSet(self.insts + self.insts[:2])
+        self.assertEqual(list(inst_set), self.insts)
+
+    def test_filter_by_tag(self):
+        self.assertEqual(
+            list(self.inst_set.filter(tag='role=worker')), self.insts[1:3]
+        )
+        self.assertEqual(
+            list(self.inst_set.filter(tag={'role': 'master'})),
+            self.insts[:1]
+        )
+        self.assertEqual(list(self.inst_set.filter(tag='role')),
+                         self.insts[:3])
+        self.assertEqual(list(self.inst_set.filter(tag='zone')), [])
+
+    def test_filter_by_cidr(self):
+        self.assertEqual(
+            list(self.inst_set.filter(cidr='1.2.3.0/24')), self.insts[:2]
+        )
+        self.assertEqual(
+            list(self.inst_set.filter(cidr='10.0.2.0/24')), self.insts[2:3]
+        )
+        self.assertEqual(list(self.inst_set.filter(cidr='10.0.0.0/8')),
+                         self.insts)
+        self.assertEqual(list(self.inst_set.filter(cidr='5.6.7.9')),
+                         self.insts[3:])
+
+    def test_filter_by_invalid_cidr(self):
+        with self.assertRaises(ValueError):
+            self.inst_set.filter(cidr='1.2.3/33')
+
+    def test_filter_combines_criteria(self):
+        self.assertEqual(
+            list(self.inst_set.filter(tag='role=worker', session_id='sess-2')),
+            self.insts[2:3]
+        )
+        self.assertEqual(
+            list(self.inst_set.filter(public_ip_addr='1.2.3.5',
+                                      cidr='1.2.3.0/24')),
+            self.insts[1:2]
+        )
+
+    def test_group_by(self):
+        groups = self.inst_set.group_by('role')
+
+        self.assertEqual(sorted(groups.keys()), ['master', 'worker'])
+        self.assertEqual(list(groups['master']), self.insts[:1])
+        self.assertEqual(list(groups['worker']), self.insts[1:3])
+        self.assertEqual(self.inst_set.group_by('zone'), {})
+
+    def test_set_operations(self):
+        sess_1 = self.inst_set.filter(session_id='sess-1')
+        workers = self.inst_set.filter(tag='role=worker')
+
+        self.assertEqual(list(sess_1 | workers), self.insts[:3])
+        self.assertEqual(list(sess_1 & workers), self.insts[1:2])
+        self.assertEqual(list(sess_1 - workers), self.insts[:1])
+        self.assertEqual(list(sess_1.union(self.insts[3:])),
+                         self.insts[:2] + self.insts[3:])
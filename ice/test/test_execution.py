@@ -0,0 +1,666 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+import types
+import unittest2
+import mock
+from fabric import api as fabric_api
+from fabric import state as fabric_state
+from ice import execution
+from ice import tasks
+from ice.test.logger import get_dummy_logger
+
+
+def get_host(instances, *args):
+    return '%s:%s' % (fabric_api.env.host_string, ','.join(args))
+
+
+def get_env(instances):
+    env = fabric_api.env
+    return env.host, env.user, env.port, env.hosts, env.all_hosts
+
+
+def get_network_exceptions(instances):
+    return fabric_api.env.use_exceptions_for['network']
+
+
+def get_pid(instances):
+    return os.getpid()
+
+
+def fail_on_bad_hosts(instances):
+    if fabric_api.env.host_string.startswith('bad'):
+        raise ValueError('bad host')
+    return 'ok'
+
+
+def abort(instances):
+    fabric_api.abort('cannot connect')
+
+
+def sleep_on_slow_hosts(instances):
+    if fabric_api.env.host_string.startswith('slow'):
+        time.sleep(30)
+    return 'ok'
+
+
+def get_time(instances):
+    start_time = time.time()
+    time.sleep(0.2)
+    return start_time, time.time()
+
+
+def sleep_by_host(instances):
+    time.sleep(float(fabric_api.env.host_string.split('-')[1]))
+    return fabric_api.env.host_string
+
+
+def return_unpicklable(instances):
+    return lambda: None
+
+
+_attempts = {}  # host string -> number of attempts, per worker
+
+
+def fail_twice(instances):
+    host_string = fabric_api.env.host_string
+    _attempts[host_string] = _attempts.get(host_string, 0) + 1
+    if _attempts[host_string] <= 2:
+        raise IOError('flaky host')
+    return _attempts[host_string]
+
+
+class ExecutionTestCase(unittest2.TestCase):
+    def setUp(self):
+        self.module = types.ModuleType('exp_test')
+        for func in [get_host, get_env, get_network_exceptions, get_pid,
+                     fail_on_bad_hosts, abort, sleep_on_slow_hosts, get_time,
+                     sleep_by_host, return_unpicklable, fail_twice]:
+            setattr(self.module, func.__name__, tasks.Task(func))
+        self.engine = execution.ExecutionEngine(
+            get_dummy_logger('execution'), self.module, max_workers=4
+        )
+
+    def tearDown(self):
+        self.engine.close()
+
+    def _make_targets(self, *host_strings):
+        return [('inst-%s' % host, host) for host in host_strings]
+
+    def _run(self, func_name, targets, **kwargs):
+        return self.engine.run(
+            func_name, targets, [[inst for inst, _ in targets]], {}, **kwargs
+        )
+
+
+class TestRun(ExecutionTestCase):
+    def test_results_per_host(self):
+        targets = self._make_targets('host1', 'host2', 'host3')
+
+        res = self.engine.run(
+            'get_host', targets, [[], 'a', 'b'], {}, pool_size=2
+        )
+
+        self.assertEqual(res, {
+            'host1': 'host1:a,b',
+            'host2': 'host2:a,b',
+            'host3': 'host3:a,b'
+        })
+        self.assertEqual(
+            [host_res.instance for host_res in res.host_results],
+            ['inst-host1', 'inst-host2', 'inst-host3']
+        )
+        for host_res in res.host_results:
+            self.assertTrue(host_res.succeeded)
+            self.assertGreaterEqual(host_res.duration(), 0)
+
+    def test_host_env(self):
+        targets = self._make_targets('bob@h1:2222', 'h2')
+
+        res = self._run('get_env', targets)
+
+        host_strings = ['bob@h1:2222', 'h2']
+        self.assertEqual(
+            res['bob@h1:2222'], ('h1', 'bob', '2222', host_strings,
+                                 host_strings)
+        )
+        self.assertEqual(res['h2'][0], 'h2')
+        self.assertEqual(res['h2'][2], '22')
+
+    def test_network_exceptions(self):
+        res = self._run('get_network_exceptions', self._make_targets('h1'))
+
+        self.assertEqual(res, {'h1': True})
+
+    def test_no_hosts(self):
+        self.assertEqual(self._run('get_host', []), {})
+
+    def test_in_process(self):
+        targets = self._make_targets('host1', 'bad1', 'bad2', 'host2')
+
+        pids = self._run('get_pid', targets, in_process=True)
+        res = self._run('fail_on_bad_hosts', targets, max_failures=0,
+                        in_process=True)
+
+        self.assertEqual(set(pids.values()), set([os.getpid()]))
+        self.assertEqual(
+            [host_res.status for host_res in res.host_results],
+            ['succeeded', 'failed', 'skipped', 'skipped']
+        )
+
+    def test_workers_are_bounded_and_kept(self):
+        targets = self._make_targets(*['host%d' % i for i in range(10)])
+
+        res_1 = self._run('get_pid', targets, pool_size=3)
+        res_2 = self._run('get_pid', targets, pool_size=3)
+
+        pids = set(res_1.values())
+        self.assertEqual(len(pids), 3)
+        self.assertNotIn(os.getpid(), pids)
+        self.assertEqual(set(res_2.values()), pids)
+
+    def test_pool_size_is_capped(self):
+        targets = self._make_targets(*['host%d' % i for i in range(10)])
+
+        res = self._run('get_pid', targets, pool_size=100)
+
+        self.assertEqual(len(set(res.values())), 4)
+
+    def test_hosts_stick_to_workers(self):
+        targets = self._make_targets(*['host%d' % i for i in range(8)])
+
+        pids_1 = [self._run('get_pid', [target], pool_size=4).values()[0]
+                  for target in targets]
+        self._run('get_pid', targets, pool_size=4)
+        pids_2 = [self._run('get_pid', [target], pool_size=4).values()[0]
+                  for target in targets]
+
+        self.assertEqual(pids_1, pids_2)
+        self.assertGreater(len(set(pids_1)), 1)
+
+    def test_idle_workers_take_queued_hosts(self):
+        targets = self._make_targets(*['host%d' % i for i in range(20)])
+
+        res = self._run('get_pid', targets, pool_size=4)
+
+        self.assertEqual(len(res.get_succeeded()), 20)
+
+    def test_failures(self):
+        targets = self._make_targets('host1', 'bad1', 'host2')
+
+        res = self._run('fail_on_bad_hosts', targets)
+
+        self.assertEqual(res['host1'], 'ok')
+        self.assertIsInstance(res['bad1'], ValueError)
+        self.assertEqual(
+            [host_res.host_string for host_res in res.get_failed()],
+            ['bad1']
+        )
+        self.assertEqual(
+            res.get_failed()[0].status, execution.HostResult.FAILED
+        )
+
+    def test_fabric_abort(self):
+        res = self._run('abort', self._make_targets('host1'))
+
+        self.assertIsInstance(res['host1'], execution.HostError)
+        self.assertIn('cannot connect', str(res['host1']))
+
+    def test_unpicklable_result(self):
+        res = self._run('return_unpicklable', self._make_targets('host1'))
+
+        self.assertIsInstance(res['host1'], execution.HostError)
+
+    def test_timeout(self):
+        targets = self._make_targets('host1', 'slow1', 'host2', 'host3')
+
+        start_time = time.time()
+        res = self._run(
+            'sleep_on_slow_hosts', targets, pool_size=2, timeout=1
+        )
+
+        self.assertLess(time.time() - start_time, 10)
+        self.assertIsInstance(res['slow1'], execution.HostTimeoutError)
+        self.assertEqual(
+            res.host_results[1].status, execution.HostResult.TIMED_OUT
+        )
+        self.assertEqual(len(res.get_succeeded()), 3)
+
+        # The timed out worker is replaced
+        res = self._run('get_pid', targets, pool_size=2)
+        self.assertEqual(len(res.get_succeeded()), 4)
+
+    def test_drop_results(self):
+        targets = self._make_targets('host1', 'bad1')
+        results = []
+
+        res = self._run(
+            'fail_on_bad_hosts', targets, keep_results=False,
+            callback=lambda host_res: results.append(host_res.result)
+        )
+
+        self.assertItemsEqual(results, ['ok', None])
+        self.assertEqual(res['host1'], None)
+        self.assertIsInstance(res['bad1'], ValueError)
+        self.assertEqual(len(res.get_succeeded()), 1)
+
+    def test_retries(self):
+        self.module.fail_twice.retry_policy = tasks.RetryPolicy(
+            attempts=3, backoff=0.01, retry_on=(IOError,)
+        )
+
+        res = self._run('fail_twice', self._make_targets('host1', 'host2'))
+
+        self.assertEqual(res, {'host1': 3, 'host2': 3})
+        self.assertEqual(
+            [host_res.attempts for host_res in res.host_results], [3, 3]
+        )
+
+    def test_retries_are_exhausted(self):
+        self.module.fail_twice.retry_policy = tasks.RetryPolicy(
+            attempts=2, backoff=0.01, retry_on=(IOError,)
+        )
+
+        res = self._run('fail_twice', self._make_targets('host1'))
+
+        self.assertIsInstance(res['host1'], IOError)
+        self.assertEqual(res.host_results[0].attempts, 2)
+
+    def test_errors_not_retried(self):
+        self.module.fail_twice.retry_policy = tasks.RetryPolicy(
+            attempts=3, backoff=0.01, retry_on=(ValueError,)
+        )
+
+        res = self._run('fail_twice', self._make_targets('host1'))
+
+        self.assertIsInstance(res['host1'], IOError)
+        self.assertEqual(res.host_results[0].attempts, 1)
+
+    def test_batches(self):
+        targets = self._make_targets(*['host%d' % i for i in range(4)])
+
+        res = self._run('get_time', targets, pool_size=4, batch_size=2)
+
+        times = [res['host%d' % i] for i in range(4)]
+        first_batch_end = max(end for _, end in times[:2])
+        second_batch_start = min(start for start, _ in times[2:])
+        self.assertGreaterEqual(second_batch_start, first_batch_end)
+
+    def test_max_failures(self):
+        targets = self._make_targets('bad1', 'bad2', 'host1', 'host2')
+
+        res = self._run(
+            'fail_on_bad_hosts', targets, pool_size=1, max_failures=1
+        )
+
+        self.assertEqual(len(res.get_failed()), 2)
+        self.assertEqual(
+            [host_res.host_string for host_res in res.get_skipped()],
+            ['host1', 'host2']
+        )
+        self.assertIsNone(res['host1'])
+
+    def test_max_failures_across_batches(self):
+        targets = self._make_targets('bad1', 'host1', 'host2', 'host3')
+
+        res = self._run(
+            'fail_on_bad_hosts', targets, pool_size=2, batch_size=2,
+            max_failures=0
+        )
+
+        self.assertEqual(res['host1'], 'ok')
+        self.assertEqual(len(res.get_skipped()), 2)
+
+
+class TestIterRun(ExecutionTestCase):
+    def test_completion_order(self):
+        targets = self._make_targets('host-0.4', 'host-0.0', 'host-0.2')
+
+        host_results = list(self.engine.iter_run(
+            'sleep_by_host', targets, [[]], {}, pool_size=3
+        ))
+
+        self.assertEqual(
+            [host_res.result for host_res in host_results],
+            ['host-0.0', 'host-0.2', 'host-0.4']
+        )
+        self.assertEqual(host_results[0].as_tuple(), (
+            'inst-host-0.0', 'host-0.0', host_results[0].duration(), None
+        ))
+
+    def test_callback(self):
+        targets = self._make_targets('host-0.2', 'host-0.0')
+        host_results = []
+
+        res = self.engine.run(
+            'sleep_by_host', targets, [[]], {}, pool_size=2,
+            callback=host_results.append
+        )
+
+        self.assertEqual(
+            [host_res.host_string for host_res in host_results],
+            ['host-0.0', 'host-0.2']
+        )
+        self.assertEqual(res.host_results, list(reversed(host_results)))
+
+    def test_close_early(self):
+        targets = self._make_targets('host-0.0', 'host-30')
+
+        gen = self.engine.iter_run(
+            'sleep_by_host', targets, [[]], {}, pool_size=2
+        )
+        self.assertEqual(next(gen).host_string, 'host-0.0')
+        gen.close()
+
+        # Workers are not left busy with the closed run
+        res = self._run('get_host', targets, pool_size=2, timeout=5)
+        self.assertEqual(len(res.get_succeeded()), 2)
+
+
+class TestProbe(ExecutionTestCase):
+    def setUp(self):
+        super(TestProbe, self).setUp()
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(8)
+        self.open_port = self.server.getsockname()[1]
+
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        self.closed_port = closed.getsockname()[1]
+        closed.close()
+
+    def tearDown(self):
+        self.server.close()
+        super(TestProbe, self).tearDown()
+
+    def test_probe_hosts(self):
+        self.assertEqual(
+            execution.probe_hosts([
+                ('127.0.0.1', self.open_port),
+                ('127.0.0.1', self.closed_port)
+            ], timeout=1),
+            [True, False]
+        )
+
+    def test_probe_no_hosts(self):
+        self.assertEqual(execution.probe_hosts([]), [])
+
+    def test_get_address(self):
+        self.assertEqual(
+            execution.get_address('ice@host1:2222'), ('host1', 2222)
+        )
+        self.assertEqual(execution.get_address('ice@host1'), ('host1', 22))
+
+    def test_unreachable_hosts_are_pruned(self):
+        targets = self._make_targets(
+            'ice@127.0.0.1:%d' % self.closed_port,
+            'ice@127.0.0.1:%d' % self.open_port
+        )
+
+        res = self._run('get_host', targets, probe_timeout=1)
+
+        self.assertEqual(
+            [host_res.status for host_res in res.host_results],
+            [execution.HostResult.UNREACHABLE, execution.HostResult.SUCCEEDED]
+        )
+        self.assertIsInstance(
+            res[targets[0][1]], execution.HostUnreachableError
+        )
+        self.assertEqual(res.get_unreachable(), [res.host_results[0]])
+        self.assertEqual(res.get_failed(), [])
+        self.assertIsNone(res.host_results[0].duration())
+
+    def test_unreachable_hosts_are_deferred(self):
+        targets = self._make_targets('host1', 'host2')
+
+        with mock.patch.object(
+            execution, 'probe_hosts', side_effect=[[False, True], [True]]
+        ) as probe_mock:
+            host_results = list(self.engine.iter_run(
+                'get_host', targets, [[]], {}, probe_timeout=1,
+                defer_unreachable=True
+            ))
+
+        self.assertEqual(
+            [host_res.host_string for host_res in host_results],
+            ['host2', 'host1']
+        )
+        self.assertTrue(all(host_res.succeeded for host_res in host_results))
+        self.assertEqual(
+            probe_mock.call_args_list[1], mock.call([('host1', 22)], 1)
+        )
+
+    def test_still_unreachable_deferred_hosts(self):
+        targets = self._make_targets('host1', 'host2')
+
+        with mock.patch.object(
+            execution, 'probe_hosts', side_effect=[[False, True], [False]]
+        ):
+            res = self._run(
+                'get_host', targets, probe_timeout=1, defer_unreachable=True
+            )
+
+        self.assertEqual(
+            [host_res.host_string for host_res in res.get_unreachable()],
+            ['host1']
+        )
+        self.assertEqual(len(res.get_succeeded()), 1)
+
+
+class TestShardedRun(ExecutionTestCase):
+    def setUp(self):
+        super(TestShardedRun, self).setUp()
+        self.sharded_engine = execution.ShardedExecutionEngine(
+            get_dummy_logger('execution'), self.module, 2, max_workers=2
+        )
+
+    def tearDown(self):
+        self.sharded_engine.close()
+        super(TestShardedRun, self).tearDown()
+
+    def test_drivers_are_stopped_at_exit(self):
+        script = '\n'.join([
+            'import types',
+            'from ice import execution, tasks',
+            'from ice.test.logger import get_dummy_logger',
+            'module = types.ModuleType("exp_test")',
+            'module.get_pid = tasks.Task(lambda instances: 1)',
+            'engine = execution.ShardedExecutionEngine(',
+            '    get_dummy_logger("execution"), module, 2, max_workers=2',
+            ')',
+            'print(engine.run("get_pid", [("i", "h%d" % i) for i in '
+            'range(5)], [[]], {}))'
+        ])
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        proc = subprocess.Popen(
+            [sys.executable, '-c', script], stdout=open(os.devnull, 'w'),
+            stderr=subprocess.STDOUT, env=env
+        )
+        start_time = time.time()
+        while proc.poll() is None and time.time() - start_time < 20:
+            time.sleep(0.1)
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+
+        self.assertEqual(proc.returncode, 0)
+
+    def test_same_results_as_single_driver(self):
+        targets = self._make_targets(*['host%d' % i for i in range(10)])
+
+        res = self.sharded_engine.run('get_host', targets, [[], 'a'], {})
+
+        self.assertEqual(res, self.engine.run('get_host', targets, [[], 'a'],
+                                              {}))
+        self.assertEqual(
+            [host_res.instance for host_res in res.host_results],
+            [inst for inst, _ in targets]
+        )
+
+    def test_hosts_are_sharded_across_drivers(self):
+        targets = self._make_targets(*['host%d' % i for i in range(20)])
+
+        res_1 = self.sharded_engine.run('get_pid', targets, [[]], {})
+        res_2 = self.sharded_engine.run('get_pid', targets, [[]], {})
+
+        # Two drivers with up to two workers each
+        self.assertEqual(len(set(res_1.values())), 4)
+        self.assertEqual(set(res_1.values()), set(res_2.values()))
+
+    def test_failures(self):
+        targets = self._make_targets('host1', 'bad1', 'host2')
+
+        res = self.sharded_engine.run('fail_on_bad_hosts', targets, [[]], {})
+
+        self.assertEqual(
+            [host_res.host_string for host_res in res.get_failed()],
+            ['bad1']
+        )
+        self.assertIsInstance(res['bad1'], ValueError)
+
+    def test_close_early(self):
+        targets = self._make_targets('host-0.0', 'host-30')
+
+        gen = self.sharded_engine.iter_run(
+            'sleep_by_host', targets, [[]], {}
+        )
+        self.assertEqual(next(gen).host_string, 'host-0.0')
+        gen.close()
+
+        res = self.sharded_engine.run('get_host', targets, [[]], {})
+        self.assertEqual(len(res.get_succeeded()), 2)
+
+    def test_no_hosts(self):
+        self.assertEqual(self.sharded_engine.run('get_host', [], [[]], {}),
+                         {})
+
+
+class TestHashRing(unittest2.TestCase):
+    def test_all_shards_get_keys(self):
+        ring = execution.HashRing(4)
+
+        shards = [ring.get_shard('inst-%d' % i) for i in range(1000)]
+
+        for shard in range(4):
+            self.assertGreater(shards.count(shard), 100)
+
+    def test_few_keys_move(self):
+        ring_1 = execution.HashRing(4)
+        ring_2 = execution.HashRing(5)
+
+        moved = [
+            key for key in ('inst-%d' % i for i in range(1000))
+            if ring_1.get_shard(key) != ring_2.get_shard(key)
+        ]
+
+        self.assertLess(len(moved), 350)
+        for key in moved:
+            self.assertEqual(ring_2.get_shard(key), 4)
+
+    def test_invalid_shard_count(self):
+        with self.assertRaises(ValueError):
+            execution.HashRing(0)
+
+    def test_get_shard_key(self):
+        inst = mock.MagicMock(id='inst1')
+        self.assertEqual(execution.get_shard_key(inst, 'ice@host1'), 'inst1')
+        inst.id = None
+        self.assertEqual(
+            execution.get_shard_key(inst, 'ice@host1'), 'ice@host1'
+        )
+
+
+class TestRunResults(unittest2.TestCase):
+    def test_merge(self):
+        res_1 = execution.RunResults([
+            execution.HostResult('inst3', 'host3', 'succeeded', result=3),
+            execution.HostResult('inst1', 'host1', 'succeeded', result=1)
+        ])
+        res_2 = execution.RunResults([
+            execution.HostResult('inst2', 'host2', 'failed', error='err')
+        ])
+
+        res = execution.RunResults.merge(
+            [res_1, res_2], ['host1', 'host2', 'host3']
+        )
+
+        self.assertEqual(res, {'host1': 1, 'host2': 'err', 'host3': 3})
+        self.assertEqual(
+            [host_res.instance for host_res in res.host_results],
+            ['inst1', 'inst2', 'inst3']
+        )
+        self.assertEqual(len(res.get_failed()), 1)
+
+
+class TestConnectionCache(unittest2.TestCase):
+    def setUp(self):
+        fabric_state.connections.clear()
+        self.cache = execution.ConnectionCache(max_idle=60)
+        self.client = mock.MagicMock()
+        self.client.get_transport.return_value.is_active.return_value = True
+
+    def tearDown(self):
+        fabric_state.connections.clear()
+
+    def _use(self, host_string, key_filename, client):
+        self.cache.activate(host_string, key_filename)
+        fabric_state.connections[host_string] = client
+        self.cache.release(host_string, key_filename)
+
+    def test_first_use(self):
+        self.assertFalse(self.cache.activate('ice@host1', 'id_rsa'))
+        self.assertNotIn('ice@host1', fabric_state.connections)
+
+    def test_reuse(self):
+        self._use('ice@host1', 'id_rsa', self.client)
+        self.assertNotIn('ice@host1', fabric_state.connections)
+
+        self.assertTrue(self.cache.activate('ice@host1', 'id_rsa'))
+        self.assertIs(fabric_state.connections['ice@host1'], self.client)
+
+    def test_keyed_on_key_file(self):
+        self._use('ice@host1', 'id_rsa', self.client)
+
+        self.assertFalse(self.cache.activate('ice@host1', 'other_id_rsa'))
+        self.assertNotIn('ice@host1', fabric_state.connections)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_unhealthy_connection(self):
+        self._use('ice@host1', 'id_rsa', self.client)
+        self.client.get_transport.return_value.send_ignore.side_effect = \
+            EOFError()
+
+        self.assertFalse(self.cache.activate('ice@host1', 'id_rsa'))
+        self.assertEqual(self.client.close.call_count, 1)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_inactive_connection(self):
+        self._use('ice@host1', 'id_rsa', self.client)
+        self.client.get_transport.return_value.is_active.return_value = False
+
+        self.assertFalse(self.cache.activate('ice@host1', 'id_rsa'))
+
+    def test_evict_idle(self):
+        other_client = mock.MagicMock()
+        self._use('ice@host1', 'id_rsa', self.client)
+        self._use('ice@host2', 'id_rsa', other_client)
+
+        with mock.patch('time.time', return_value=time.time() + 61):
+            self._use('ice@host2', 'id_rsa', other_client)
+            self.cache.evict_idle()
+
+        self.assertEqual(self.client.close.call_count, 1)
+        self.assertEqual(other_client.close.call_count, 0)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_close(self):
+        self._use('ice@host1', 'id_rsa', self.client)
+
+        self.cache.close()
+
+        self.assertEqual(self.client.close.call_count, 1)
+        self.assertEqual(len(self.cache), 0)
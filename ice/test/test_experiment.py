@@ -1,10 +1,15 @@
 import os
+import shutil
+import sys
+import time
 import types
 import unittest2
 import mock
 import tempfile
 import fabric.api as fabric_api
+from ice import aggregation
 from ice import entities
+from ice import execution
 from ice import experiment
 from ice import tasks
 from ice.test.logger import get_dummy_logger
@@ -135,6 +140,72 @@ class TestLoad(unittest2.TestCase):
         tmp_file.close()
 
 
+class TestLoadCache(unittest2.TestCase):
+    def setUp(self):
+        self.logger = get_dummy_logger('experiment')
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.tmp_dir, 'exp_cached.py')
+        self._write('a = 1\n')
+        self.exp = experiment.Experiment(self.logger, self.file_path)
+
+    def tearDown(self):
+        sys.modules.pop('exp_cached', None)
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, contents, mtime_offset=0):
+        with open(self.file_path, 'w') as file_obj:
+            file_obj.write(contents)
+        # Compiled files only keep the modification time in seconds
+        mtime = time.time() + mtime_offset
+        os.utime(self.file_path, (mtime, mtime))
+
+    def test_unchanged_file_is_not_reloaded(self):
+        sys_path = list(sys.path)
+
+        with mock.patch('__builtin__.reload') as reload_mock:
+            self.exp.load()
+
+        self.assertEqual(reload_mock.call_count, 0)
+        self.assertEqual(sys.path, sys_path)
+
+    def test_touched_file_is_not_reloaded(self):
+        os.utime(self.file_path, (time.time() + 10, time.time() + 10))
+
+        with mock.patch('__builtin__.reload') as reload_mock:
+            self.exp.load()
+
+        self.assertEqual(reload_mock.call_count, 0)
+
+    def test_changed_file_is_reloaded(self):
+        self._write('a = 2\nb = 3\n', mtime_offset=10)
+
+        self.exp.load()
+
+        self.assertEqual(self.exp.module.a, 2)
+        self.assertEqual(self.exp.module.b, 3)
+
+    def test_force(self):
+        with mock.patch('__builtin__.reload') as reload_mock:
+            self.exp.load(force=True)
+
+        self.assertEqual(reload_mock.call_count, 1)
+
+    def test_removed_file(self):
+        os.remove(self.file_path)
+
+        with self.assertRaises(experiment.Experiment.LoadError):
+            self.exp.load()
+
+    def test_contents_are_cached_until_reload(self):
+        self.assertEqual(self.exp.get_tasks(), [])
+
+        self.exp.module.a_task = tasks.Task(lambda instances: None)
+        self.assertEqual(self.exp.get_tasks(), [])
+
+        self.exp.load(force=True)
+        self.assertEqual(self.exp.get_tasks(), ['* a_task'])
+
+
 class TestGetContents(unittest2.TestCase):
     def setUp(self):
         mod_file_path = os.path.abspath(
@@ -170,8 +241,29 @@ class TestGetContents(unittest2.TestCase):
         )
 
 
+def get_host_string(instances, *args):
+    return (fabric_api.env.host_string, len(instances)) + args
+
+
+def get_pid(instances):
+    return os.getpid()
+
+
+_bad_host_runs = set()  # host strings, per process
+
+
+def fail_once_on_bad_hosts(instances, arg):
+    host_string = fabric_api.env.host_string
+    if host_string.startswith('ice@bad') and \
+            host_string not in _bad_host_runs:
+        _bad_host_runs.add(host_string)
+        raise IOError('bad host')
+    return arg
+
+
 class TestRun(unittest2.TestCase):
     def setUp(self):
+        _bad_host_runs.clear()
         self.logger = get_dummy_logger('experiment')
         self.ssh_cfg = experiment.CfgSSH('ice', '/path/to/id_rsa')
 
@@ -185,6 +277,9 @@ class TestRun(unittest2.TestCase):
             mod_file_path
         )
 
+    def tearDown(self):
+        self.exp.close()
+
     def _make_instance(self, hostname):
         return entities.Instance(
             session_id='test',
@@ -228,6 +323,13 @@ class TestRun(unittest2.TestCase):
             ])
             settings_mock.assert_setting('key_filename', '/path/to/id_rsa')
 
+    def test_partial_instances(self):
+        self.exp.module.task_a_a = tasks.Task(get_host_string)
+        inst = entities.Instance.from_partial(public_reverse_dns='host1')
+
+        with self.assertRaises(ValueError):
+            self.exp.run([inst], self.ssh_cfg, func_name='task_a_a')
+
     def test_runner_no_args(self):
         mock_runner = mock.MagicMock(return_value='runner-return-value')
         self.exp.module.run_a = tasks.Runner(mock_runner)
@@ -269,22 +371,384 @@ class TestRun(unittest2.TestCase):
         )
 
     def test_task(self):
-        old_fab_execute = fabric_api.execute
-        fabric_api.execute = mock.MagicMock(return_value={'test': 12})
+        self.exp.module.task_a_a = tasks.Task(get_host_string)
+
+        inst_1 = self._make_instance('host1')
+        inst_2 = self._make_instance('host2')
+        res = self.exp.run([inst_1, inst_2], self.ssh_cfg,
+                           func_name='task_a_a', args=[12, 'test_1'])
+
+        self.assertEqual(res, {
+            'ice@host1': ('ice@host1', 2, 12, 'test_1'),
+            'ice@host2': ('ice@host2', 2, 12, 'test_1')
+        })
+        self.assertEqual(
+            [host_res.instance for host_res in res.host_results],
+            [inst_1, inst_2]
+        )
+
+    def test_task_runs_in_process(self):
+        state = []
+        self.exp.module.task_a_a = tasks.Task(
+            lambda instances: state.append(os.getpid())
+        )
+
+        self.exp.run(
+            [self._make_instance('host%d' % i) for i in range(4)],
+            self.ssh_cfg, func_name='task_a_a'
+        )
+
+        self.assertEqual(state, [os.getpid()] * 4)
+
+    def test_parallel_task_pool_size(self):
+        self.exp.module.task_a_a = tasks.ParallelTask(get_pid)
+
+        res = self.exp.run(
+            [self._make_instance('host%d' % i) for i in range(4)],
+            self.ssh_cfg, func_name='task_a_a', pool_size=2
+        )
+
+        self.assertEqual(len(set(res.values())), 2)
+
+    def test_parallel_task_pool_size_grows_workers(self):
+        self.exp.module.task_a_a = tasks.ParallelTask(get_pid)
+
+        self.exp.run(
+            [self._make_instance('host%d' % i) for i in range(12)],
+            self.ssh_cfg, func_name='task_a_a', pool_size=12
+        )
+
+        self.assertEqual(self.exp.engine.max_workers, 12)
+        self.assertEqual(len(self.exp.engine._workers), 12)
+
+    def test_reload_restarts_workers(self):
+        self.exp.module.task_a_a = tasks.ParallelTask(get_pid)
+        inst = self._make_instance('host1')
+        pid_1 = self.exp.run([inst], self.ssh_cfg, func_name='task_a_a')
+
+        self.exp.load(force=True)
+        self.exp.module.task_a_a = tasks.ParallelTask(get_pid)
+        pid_2 = self.exp.run([inst], self.ssh_cfg, func_name='task_a_a')
+
+        self.assertNotEqual(pid_1, pid_2)
+
+    def test_task_callback(self):
+        self.exp.module.task_a_a = tasks.Task(get_host_string)
+        inst = self._make_instance('host1')
+        calls = []
+
+        self.exp.run([inst], self.ssh_cfg, func_name='task_a_a',
+                     callback=lambda *args: calls.append(args))
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(calls[0][0], inst)
+        self.assertEqual(calls[0][1], ('ice@host1', 1))
+        self.assertIsNone(calls[0][3])
+
+    def test_iter_run(self):
+        self.exp.module.task_a_a = tasks.ParallelTask(get_host_string)
+        inst_1 = self._make_instance('host1')
+        inst_2 = self._make_instance('host2')
+
+        res = list(self.exp.iter_run([inst_1, inst_2], self.ssh_cfg,
+                                     func_name='task_a_a', args=12))
+
+        self.assertItemsEqual(
+            [(inst, result) for inst, result, _, _ in res], [
+                (inst_1, ('ice@host1', 2, 12)),
+                (inst_2, ('ice@host2', 2, 12))
+            ]
+        )
+        for _, _, duration, error in res:
+            self.assertGreaterEqual(duration, 0)
+            self.assertIsNone(error)
+
+    def test_iter_run_with_runner(self):
+        self.exp.module.run_a = tasks.Runner(mock.MagicMock())
+
+        self.assertEqual(
+            list(self.exp.iter_run([], self.ssh_cfg, func_name='run_a')), []
+        )
+        self.assertEqual(self.exp.module.run_a.func.call_count, 0)
+
+    def test_iter_run_not_existing_function(self):
+        self.assertEqual(
+            list(self.exp.iter_run([], self.ssh_cfg, func_name='foo')), []
+        )
+
+    def test_task_timings(self):
+        self.exp.module.task_a_a = tasks.ParallelTask(get_host_string)
+
+        self.exp.run([self._make_instance('host1'),
+                      self._make_instance('host2')],
+                     self.ssh_cfg, func_name='task_a_a')
+
+        timing = self.exp.get_last_timing()
+        self.assertEqual(timing.func_name, 'task_a_a')
+        self.assertItemsEqual(timing.hosts.keys(), ['ice@host1', 'ice@host2'])
+        self.assertGreaterEqual(
+            timing.overall.duration(), timing.get_percentile(100)
+        )
+
+    def test_iter_run_timings(self):
+        self.exp.module.task_a_a = tasks.Task(get_host_string)
+
+        list(self.exp.iter_run([self._make_instance('host1')], self.ssh_cfg,
+                               func_name='task_a_a'))
+
+        timing = self.exp.get_last_timing()
+        self.assertEqual(timing.hosts.keys(), ['ice@host1'])
+        self.assertIsNotNone(timing.overall.end_time)
+
+    def test_runner_timings(self):
+        self.exp.module.run_a = tasks.Runner(mock.MagicMock())
+
+        self.exp.run([self._make_instance('host1')], self.ssh_cfg,
+                     func_name='run_a')
+        self.exp.run([self._make_instance('host1')], self.ssh_cfg,
+                     func_name='run_a')
 
+        self.assertEqual(len(self.exp.timings), 2)
+        self.assertEqual(self.exp.get_last_timing().hosts, {})
+        self.assertGreaterEqual(
+            self.exp.get_last_timing().overall.duration(), 0
+        )
+
+    def test_timings_are_bounded(self):
+        exp = experiment.Experiment(
+            self.logger, self.exp.mod_file_path, max_timings=2
+        )
+        exp.module.run_a = tasks.Runner(mock.MagicMock())
+
+        for _ in range(3):
+            exp.run([self._make_instance('host1')], self.ssh_cfg,
+                    func_name='run_a')
+
+        self.assertEqual(len(exp.timings), 2)
+        self.assertIs(exp.get_last_timing(), exp.timings[-1])
+
+    def test_no_timings(self):
+        self.assertIsNone(self.exp.get_last_timing())
+
+    def test_probe(self):
         inst_1 = self._make_instance('host1')
         inst_2 = self._make_instance('host2')
+        inst_2.ssh_port = 2222
+
+        with mock.patch.object(
+            experiment.execution, 'probe_hosts', return_value=[False, True]
+        ) as probe_mock:
+            reachable, unreachable = self.exp.probe(
+                [inst_1, inst_2], self.ssh_cfg, timeout=1
+            )
+
+        probe_mock.assert_called_once_with(
+            [('host1', 22), ('host2', 2222)], 1
+        )
+        self.assertEqual(reachable, [inst_2])
+        self.assertEqual(unreachable, [inst_1])
+
+    def test_task_probe(self):
+        self.exp.module.task_a_a = tasks.Task(get_host_string)
+        inst_1 = self._make_instance('host1')
+        inst_2 = self._make_instance('host2')
+
+        with mock.patch.object(
+            experiment.execution, 'probe_hosts', return_value=[True, False]
+        ):
+            res = self.exp.run([inst_1, inst_2], self.ssh_cfg,
+                               func_name='task_a_a', probe_timeout=1)
+
+        self.assertEqual(res['ice@host1'], ('ice@host1', 2))
         self.assertEqual(
-            self.exp.run([inst_1, inst_2], self.ssh_cfg, func_name='task_a_a',
-                         args=[12, 'test_1', 'test_2']),
-            {'test': 12}
+            [host_res.instance for host_res in res.get_unreachable()],
+            [inst_2]
         )
-        fabric_api.execute.assert_called_once_with(
-            self.exp.module.task_a_a,
-            [inst_1, inst_2], 12, 'test_1', 'test_2'
+        self.assertEqual(self.exp.get_last_timing().hosts.keys(),
+                         ['ice@host1'])
+
+    def test_runner_probe(self):
+        mock_runner = mock.MagicMock()
+        self.exp.module.run_a = tasks.Runner(mock_runner)
+        inst_1 = self._make_instance('host1')
+        inst_2 = self._make_instance('host2')
+
+        with mock.patch.object(
+            experiment.execution, 'probe_hosts', return_value=[False, True]
+        ):
+            self.exp.run([inst_1, inst_2], self.ssh_cfg, func_name='run_a',
+                         probe_timeout=1)
+
+        mock_runner.assert_called_once_with([inst_2])
+
+    def test_sharded_task(self):
+        self.exp.module.task_a_a = tasks.ParallelTask(get_host_string)
+        insts = [self._make_instance('host%d' % i) for i in range(6)]
+
+        res = self.exp.run(insts, self.ssh_cfg, func_name='task_a_a',
+                           shards=2)
+
+        self.assertEqual(res, dict(
+            ('ice@host%d' % i, ('ice@host%d' % i, 6)) for i in range(6)
+        ))
+        self.assertEqual(
+            [host_res.instance for host_res in res.host_results], insts
         )
+        self.assertEqual(self.exp.sharded_engines.keys(), [2])
+
+        self.exp.close()
+        self.assertEqual(self.exp.sharded_engines, {})
+
+    def test_select_shard(self):
+        insts = [self._make_instance('host%d' % i) for i in range(20)]
 
-        fabric_api.execute = old_fab_execute
+        shards = [self.exp.select_shard(insts, self.ssh_cfg, ind, 3)
+                  for ind in range(3)]
+
+        self.assertItemsEqual(sum(shards, []), insts)
+        for shard in shards:
+            self.assertGreater(len(shard), 0)
+            self.assertEqual(shard, [inst for inst in insts if inst in shard])
+
+    def test_shard_runs(self):
+        self.exp.module.task_a_a = tasks.Task(get_host_string)
+        insts = [self._make_instance('host%d' % i) for i in range(10)]
+
+        results = [
+            self.exp.run(insts, self.ssh_cfg, func_name='task_a_a',
+                         shard=(ind, 2))
+            for ind in range(2)
+        ]
+        res = execution.RunResults.merge(
+            results, ['ice@host%d' % i for i in range(10)]
+        )
+
+        self.assertEqual(
+            res, self.exp.run(insts, self.ssh_cfg, func_name='task_a_a')
+        )
+        self.assertEqual(
+            [host_res.instance for host_res in res.host_results], insts
+        )
+
+    def test_task_reducers(self):
+        self.exp.module.task_a_a = tasks.ParallelTask(get_host_string)
+        insts = [self._make_instance('host%d' % i) for i in range(3)]
+
+        res = self.exp.run(insts, self.ssh_cfg, func_name='task_a_a', args=5,
+                           reducers={
+                               'total': aggregation.Sum(key=lambda r: r[2]),
+                               'hosts': aggregation.Count()
+                           })
+
+        self.assertEqual(res.aggregates, {'total': 15, 'hosts': 3})
+        self.assertEqual(res, dict(('ice@host%d' % i, None)
+                                   for i in range(3)))
+
+    def test_task_reducer_errors(self):
+        self.exp.module.task_a_a = tasks.ParallelTask(get_host_string)
+        insts = [self._make_instance('host%d' % i) for i in range(3)]
+
+        res = self.exp.run(insts, self.ssh_cfg, func_name='task_a_a',
+                           reducers={
+                               'total': aggregation.Sum(
+                                   key=lambda r: None if r[0] == 'ice@host1'
+                                   else 1
+                               ),
+                               'hosts': aggregation.Count()
+                           })
+
+        self.assertEqual(res.aggregates, {'total': 2, 'hosts': 3})
+        self.assertEqual(res.aggregate_errors.keys(), ['total'])
+        self.assertEqual(res.aggregate_errors['total'].keys(), ['ice@host1'])
+        self.assertIsInstance(
+            res.aggregate_errors['total']['ice@host1'], TypeError
+        )
+        self.assertEqual(len(res.get_succeeded()), 3)
+
+    def test_task_reducers_keep_results(self):
+        self.exp.module.task_a_a = tasks.Task(get_host_string)
+        inst = self._make_instance('host1')
+
+        res = self.exp.run([inst], self.ssh_cfg, func_name='task_a_a',
+                           reducers={'hosts': aggregation.Count()},
+                           keep_results=True)
+
+        self.assertEqual(res.aggregates, {'hosts': 1})
+        self.assertEqual(res['ice@host1'], ('ice@host1', 1))
+
+    def test_task_no_reducers(self):
+        self.exp.module.task_a_a = tasks.Task(get_host_string)
+
+        res = self.exp.run([self._make_instance('host1')], self.ssh_cfg,
+                           func_name='task_a_a')
+
+        self.assertEqual(res.aggregates, {})
+        self.assertEqual(res['ice@host1'], ('ice@host1', 1))
+
+    def test_rerun_failed(self):
+        self.exp.module.task_a_a = tasks.Task(fail_once_on_bad_hosts)
+        insts = [self._make_instance(hostname)
+                 for hostname in ['host1', 'bad1', 'host2', 'bad2']]
+        calls = []
+
+        res = self.exp.run(insts, self.ssh_cfg, func_name='task_a_a',
+                           args='x', callback=lambda *args: calls.append(args))
+        self.assertEqual(len(res.get_failed()), 2)
+
+        res = self.exp.rerun_failed()
+
+        self.assertEqual(res, {
+            'ice@host1': 'x', 'ice@bad1': 'x',
+            'ice@host2': 'x', 'ice@bad2': 'x'
+        })
+        self.assertEqual(
+            [host_res.instance for host_res in res.host_results], insts
+        )
+        self.assertItemsEqual(
+            self.exp.get_last_timing().hosts.keys(), ['ice@bad1', 'ice@bad2']
+        )
+        self.assertEqual(len(calls), 6)
+
+        # Nothing is left to run again
+        self.assertEqual(self.exp.rerun_failed(), res)
+        self.assertEqual(self.exp.get_last_timing().hosts, {})
+
+    def test_rerun_failed_with_reducers(self):
+        self.exp.module.task_a_a = tasks.Task(fail_once_on_bad_hosts)
+        insts = [self._make_instance(hostname)
+                 for hostname in ['host1', 'bad1', 'host2']]
+
+        res = self.exp.run(insts, self.ssh_cfg, func_name='task_a_a',
+                           args=2, reducers={'total': aggregation.Sum()})
+        self.assertEqual(res.aggregates, {'total': 4})
+
+        res = self.exp.rerun_failed()
+
+        self.assertEqual(res.aggregates, {'total': 6})
+        self.assertEqual(res, {
+            'ice@host1': None, 'ice@bad1': None, 'ice@host2': None
+        })
+
+    def test_rerun_failed_without_run(self):
+        self.assertFalse(self.exp.rerun_failed())
+
+    def test_async_runner(self):
+        calls = []
+
+        def run_a(instances, commands, *args):
+            calls.append((instances, commands.get_instances(), args))
+            return commands.max_concurrency
+        self.exp.module.run_a = tasks.AsyncRunner(run_a)
+        inst = self._make_instance('host1')
+
+        with mock.patch.object(experiment.remote.RemoteCommands,
+                               'close') as close_mock:
+            res = self.exp.run([inst], self.ssh_cfg, func_name='run_a',
+                               args=[12], pool_size=500)
+
+        self.assertEqual(res, 500)
+        self.assertEqual(calls, [([inst], [inst], (12,))])
+        self.assertEqual(close_mock.call_count, 1)
 
     def test_parallel_runner(self):
         mock_runner = mock.MagicMock(return_value='runner-return-value')
@@ -304,7 +768,7 @@ class SettingsMock(object):
     def _log_settings(self, **kwargs):
         for key, value in kwargs.items():
             self.logged_settings[key] = value
-        return self
+        return mock.MagicMock()  # the context manager
 
     def __enter__(self):
         self.old_fab_settings = fabric_api.settings
@@ -0,0 +1,166 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest2
+from ice import experiment
+from ice import experiment_catalog
+from ice.test.logger import get_dummy_logger
+
+ASSETS_PATH = os.path.abspath(
+    os.path.join(
+        os.path.dirname(__file__), '..', '..', 'testing', 'assets'
+    )
+)
+
+EXP_CONTENTS = '''import ice
+from ice import tasks as ice_tasks
+
+
+@ice.ParallelTask
+def a_task(instances):
+    """Does things"""
+    pass
+
+
+@ice_tasks.Runner
+def a_runner(instances):
+    pass
+
+
+@ice.AsyncRunner
+def an_async_runner(instances, commands):
+    pass
+
+
+def a_func(instances):
+    """Does other things"""
+    pass
+
+
+def undecorated(instances):
+    pass
+
+other_task = ice.Task(a_func)
+not_a_task = dict(a=1)
+'''
+
+
+class TestStaticListing(unittest2.TestCase):
+    def setUp(self):
+        self.logger = get_dummy_logger('experiment_catalog')
+        self.catalog = experiment_catalog.ExperimentCatalog(
+            self.logger, ASSETS_PATH
+        )
+
+    def test_get_names(self):
+        self.assertEqual(
+            self.catalog.get_names(),
+            ['exp_normal', 'exp_simple', 'exp_syntax_error']
+        )
+
+    def test_get_contents(self):
+        self.assertItemsEqual(
+            self.catalog.get_tasks('exp_normal'),
+            [
+                '* task_a_a',
+                '* task_a_b: Hello world',
+                '* task_b_a',
+                '* task_b_b: A helpful message',
+                '* task_b_c'
+            ]
+        )
+        self.assertItemsEqual(
+            self.catalog.get_runners('exp_normal'),
+            [
+                '* run_a',
+                '* run_b: I am a fast runner'
+            ]
+        )
+
+    def test_syntax_error(self):
+        self.assertEqual(
+            self.catalog.get_contents('exp_syntax_error'), ([], [])
+        )
+
+    def test_unknown_experiment(self):
+        self.assertEqual(self.catalog.get_contents('foo'), ([], []))
+        with self.assertRaises(experiment.Experiment.LoadError):
+            self.catalog.get_experiment('foo')
+
+
+class TestLazyLoading(unittest2.TestCase):
+    def setUp(self):
+        self.logger = get_dummy_logger('experiment_catalog')
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.tmp_dir, 'exp_catalog_test.py')
+        self._write(EXP_CONTENTS)
+        self.catalog = experiment_catalog.ExperimentCatalog(
+            self.logger, self.tmp_dir, pool_size=2
+        )
+
+    def tearDown(self):
+        self.catalog.close()
+        sys.modules.pop('exp_catalog_test', None)
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, contents, mtime_offset=0):
+        with open(self.file_path, 'w') as file_obj:
+            file_obj.write(contents)
+        mtime = time.time() + mtime_offset
+        os.utime(self.file_path, (mtime, mtime))
+
+    def test_listing_does_not_import(self):
+        self.assertEqual(
+            self.catalog.get_tasks('exp_catalog_test'),
+            ['* a_task: Does things', '* other_task: Does other things']
+        )
+        self.assertEqual(
+            self.catalog.get_runners('exp_catalog_test'),
+            ['* a_runner', '* an_async_runner']
+        )
+        self.assertNotIn('exp_catalog_test', sys.modules)
+
+    def test_get_experiment_imports(self):
+        exp = self.catalog.get_experiment('exp_catalog_test')
+
+        self.assertIn('exp_catalog_test', sys.modules)
+        self.assertEqual(exp.pool_size, 2)
+        self.assertIs(self.catalog.get_experiment('exp_catalog_test'), exp)
+
+    def test_run(self):
+        ssh_cfg = experiment.CfgSSH('ice', '/path/to/id_rsa')
+
+        self.assertIsNone(
+            self.catalog.run('exp_catalog_test', [], ssh_cfg, 'a_runner')
+        )
+        self.assertFalse(self.catalog.run('foo', [], ssh_cfg, 'a_runner'))
+
+    def test_scan_picks_up_changes(self):
+        self._write(EXP_CONTENTS + '''
+
+@ice.Task
+def new_task(instances):
+    pass
+''', mtime_offset=10)
+        added_path = os.path.join(self.tmp_dir, 'exp_added.py')
+        with open(added_path, 'w') as file_obj:
+            file_obj.write('')
+
+        self.catalog.scan()
+
+        self.assertIn(
+            '* new_task', self.catalog.get_tasks('exp_catalog_test')
+        )
+        self.assertEqual(
+            self.catalog.get_names(), ['exp_added', 'exp_catalog_test']
+        )
+
+    def test_scan_drops_removed_files(self):
+        self.catalog.get_experiment('exp_catalog_test')
+        os.remove(self.file_path)
+
+        self.catalog.scan()
+
+        self.assertEqual(self.catalog.get_names(), [])
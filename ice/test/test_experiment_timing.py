@@ -0,0 +1,58 @@
+import json
+import unittest2
+from ice import experiment_timing
+
+
+class TestRunTiming(unittest2.TestCase):
+    def setUp(self):
+        self.timing = experiment_timing.RunTiming('a_task')
+        self.timing.overall.start(100.0)
+        for ind in range(100):
+            self.timing.add_host('host%d' % ind, 100.0, 101.0 + ind)
+        self.timing.overall.end(200.0)
+
+    def test_percentiles(self):
+        self.assertEqual(self.timing.get_percentile(50), 50.0)
+        self.assertEqual(self.timing.get_percentile(95), 95.0)
+        self.assertEqual(self.timing.get_percentile(99), 99.0)
+        self.assertEqual(self.timing.get_percentile(100), 100.0)
+        self.assertEqual(self.timing.get_percentile(0), 1.0)
+
+    def test_percentile_without_hosts(self):
+        timing = experiment_timing.RunTiming('a_task')
+
+        self.assertIsNone(timing.get_percentile(50))
+
+    def test_slowest(self):
+        self.assertEqual(
+            self.timing.get_slowest(2), [('host99', 100.0), ('host98', 99.0)]
+        )
+
+    def test_summary(self):
+        summary = self.timing.get_summary(slowest_count=1)
+
+        self.assertEqual(summary, {
+            'func_name': 'a_task',
+            'duration': 100.0,
+            'hosts': 100,
+            'p50': 50.0,
+            'p95': 95.0,
+            'p99': 99.0,
+            'slowest': [('host99', 100.0)]
+        })
+
+    def test_summary_while_running(self):
+        timing = experiment_timing.RunTiming('a_task')
+        timing.overall.start(100.0)
+
+        self.assertIsNone(timing.get_summary()['duration'])
+
+    def test_json(self):
+        json_str = self.timing.to_json()
+
+        self.assertEqual(json.loads(json_str)['summary']['p95'], 95.0)
+        timing = experiment_timing.RunTiming.from_json(json_str)
+        self.assertEqual(timing.func_name, 'a_task')
+        self.assertEqual(timing.overall.duration(), 100.0)
+        self.assertEqual(timing.hosts['host3'].duration(), 4.0)
+        self.assertEqual(timing.get_percentile(95), 95.0)
@@ -0,0 +1,204 @@
+import socket
+import threading
+import time
+import unittest2
+import mock
+import paramiko
+from ice import remote
+
+
+class ClientMock(object):
+    """Stands in for `paramiko.SSHClient`, echoing the commands it runs."""
+
+    def __init__(self, test):
+        self.test = test
+        self.host = None
+        self.closed = False
+        self.active = True
+
+    def set_missing_host_key_policy(self, policy):
+        pass
+
+    def connect(self, host, **kwargs):
+        self.host = host
+        self.test.connects.append((host, kwargs))
+        if host.startswith('down'):
+            raise socket.error('Connection refused')
+
+    def exec_command(self, command, timeout=None):
+        with self.test.lock:
+            self.test.running += 1
+            self.test.max_running = max(
+                self.test.max_running, self.test.running
+            )
+        time.sleep(0.01)
+        with self.test.lock:
+            self.test.running -= 1
+        if command == 'drop':
+            self.active = False
+            raise paramiko.SSHException('Channel closed')
+        if command == 'slow':
+            raise socket.timeout()
+
+        stdout = mock.MagicMock()
+        stdout.read.return_value = '%s:%s' % (self.host, command)
+        stdout.channel.recv_exit_status.return_value = \
+            1 if command == 'false' else 0
+        stderr = mock.MagicMock()
+        stderr.read.return_value = ''
+        return mock.MagicMock(), stdout, stderr
+
+    def get_transport(self):
+        transport = mock.MagicMock()
+        transport.is_active.return_value = self.active and not self.closed
+        return transport
+
+    def close(self):
+        self.closed = True
+
+
+class TestRemoteCommands(unittest2.TestCase):
+    def setUp(self):
+        self.connects = []
+        self.clients = []
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+        def make_client():
+            client = ClientMock(self)
+            self.clients.append(client)
+            return client
+
+        self.patcher = mock.patch.object(
+            remote.paramiko, 'SSHClient', side_effect=make_client
+        )
+        self.patcher.start()
+
+        self.targets = [
+            ('inst%d' % i, 'ice@host%d:22%02d' % (i, i)) for i in range(20)
+        ]
+        self.commands = remote.RemoteCommands(
+            self.targets, '/path/to/id_rsa', max_concurrency=4, timeout=5
+        )
+
+    def tearDown(self):
+        self.commands.close()
+        self.patcher.stop()
+
+    def _inst(self, ind):
+        return self.targets[ind][0]
+
+    def test_run(self):
+        results = self.commands.run('hostname')
+
+        self.assertEqual(
+            [res.instance for res in results],
+            [inst for inst, _ in self.targets]
+        )
+        self.assertEqual(results[3].stdout, 'host3:hostname')
+        self.assertEqual(results[3].host_string, 'ice@host3:2203')
+        for res in results:
+            self.assertTrue(res.succeeded)
+            self.assertGreaterEqual(res.duration(), 0)
+        self.assertEqual(self.connects[0][1], {
+            'port': 2200, 'username': 'ice',
+            'key_filename': '/path/to/id_rsa', 'timeout': 5
+        })
+
+    def test_concurrency_is_bounded(self):
+        self.commands.run('hostname')
+
+        self.assertLessEqual(self.max_running, 4)
+        self.assertGreater(self.max_running, 1)
+
+    def test_connections_are_shared(self):
+        self.commands.run('hostname')
+        self.commands.run('uptime')
+
+        self.assertEqual(len(self.connects), 20)
+
+    def test_selected_instances(self):
+        results = self.commands.run('hostname', [self._inst(2), self._inst(1)])
+
+        self.assertEqual(
+            [res.stdout for res in results],
+            ['host2:hostname', 'host1:hostname']
+        )
+
+    def test_unknown_instance(self):
+        with self.assertRaises(ValueError):
+            self.commands.submit('inst-unknown', 'hostname')
+
+    def test_submit(self):
+        pending = [self.commands.submit(self._inst(1), 'cmd%d' % i)
+                   for i in range(3)]
+
+        self.assertEqual(
+            [res.get().stdout for res in pending],
+            ['host1:cmd0', 'host1:cmd1', 'host1:cmd2']
+        )
+
+    def test_iter_run(self):
+        results = list(self.commands.iter_run('hostname'))
+
+        self.assertItemsEqual(
+            [res.instance for res in results],
+            [inst for inst, _ in self.targets]
+        )
+
+    def test_exit_status(self):
+        res = self.commands.run('false', [self._inst(1)])[0]
+
+        self.assertEqual(res.exit_status, 1)
+        self.assertFalse(res.succeeded)
+        self.assertIsNone(res.error)
+
+    def test_connection_error(self):
+        commands = remote.RemoteCommands(
+            [('inst-down', 'ice@down1')], '/path/to/id_rsa'
+        )
+
+        res = commands.run('hostname')[0]
+        commands.close()
+
+        self.assertIsInstance(res.error, socket.error)
+        self.assertFalse(res.succeeded)
+
+    def test_failed_connection_is_dropped(self):
+        res = self.commands.run('drop', [self._inst(1)])[0]
+        self.commands.run('hostname', [self._inst(1)])
+
+        self.assertIsInstance(res.error, paramiko.SSHException)
+        self.assertTrue(self.clients[0].closed)
+        self.assertEqual(len(self.connects), 2)
+
+    def test_timed_out_connection_is_kept(self):
+        res = self.commands.run('slow', [self._inst(1)])[0]
+        self.commands.run('hostname', [self._inst(1)])
+
+        self.assertIsInstance(res.error, socket.timeout)
+        self.assertFalse(self.clients[0].closed)
+        self.assertEqual(len(self.connects), 1)
+
+    def test_channels_are_bounded_per_host(self):
+        commands = remote.RemoteCommands(
+            self.targets, '/path/to/id_rsa', max_concurrency=20,
+            max_channels=3
+        )
+
+        results = [commands.submit(self._inst(1), 'cmd%d' % i)
+                   for i in range(20)]
+        for res in results:
+            res.get()
+        commands.close()
+
+        self.assertLessEqual(self.max_running, 3)
+        self.assertGreater(self.max_running, 1)
+
+    def test_close(self):
+        self.commands.run('hostname')
+
+        self.commands.close()
+
+        self.assertTrue(all(client.closed for client in self.clients))
@@ -1,6 +1,10 @@
+import socket
 import unittest2
+import mock
+from ice import execution
 from ice import tasks
 import fabric.api as fabric_api
+from fabric.exceptions import NetworkError
 
 
 def a_func(*args, **kwargs):
@@ -93,3 +97,55 @@ class TestParallelTask(unittest2.TestCase):
                 'is_decorated': True
             }
         )
+
+
+class TestRetryPolicy(unittest2.TestCase):
+    def test_should_retry(self):
+        policy = tasks.RetryPolicy(attempts=3, retry_on=(IOError,))
+
+        self.assertTrue(policy.should_retry(IOError(), 1))
+        self.assertTrue(policy.should_retry(IOError(), 2))
+        self.assertFalse(policy.should_retry(IOError(), 3))
+        self.assertFalse(policy.should_retry(ValueError(), 1))
+
+    def test_retries_transient_errors(self):
+        policy = tasks.RetryPolicy()
+
+        self.assertTrue(policy.should_retry(NetworkError('timed out'), 1))
+        self.assertTrue(policy.should_retry(socket.timeout(), 1))
+        self.assertTrue(policy.should_retry(EOFError(), 1))
+        self.assertFalse(policy.should_retry(execution.HostError(), 1))
+        self.assertFalse(policy.should_retry(TypeError(), 1))
+        self.assertFalse(policy.should_retry(KeyError(), 1))
+
+    def test_backoff(self):
+        policy = tasks.RetryPolicy(backoff=1, max_backoff=5, jitter=0)
+
+        self.assertEqual(
+            [policy.get_delay(attempt) for attempt in range(1, 6)],
+            [1, 2, 4, 5, 5]
+        )
+
+    def test_jitter(self):
+        policy = tasks.RetryPolicy(backoff=2, jitter=0.5)
+
+        with mock.patch('random.random', return_value=1.0):
+            self.assertEqual(policy.get_delay(2), 2)
+        with mock.patch('random.random', return_value=0.0):
+            self.assertEqual(policy.get_delay(2), 4)
+
+
+class TestRetry(unittest2.TestCase):
+    def test_sets_policy(self):
+        task = tasks.retry(attempts=5, backoff=0.1)(tasks.ParallelTask(a_func))
+
+        self.assertIsInstance(task, tasks.ParallelTask)
+        self.assertEqual(task.retry_policy.attempts, 5)
+        self.assertEqual(task.retry_policy.backoff, 0.1)
+
+    def test_no_policy(self):
+        self.assertIsNone(tasks.Task(a_func).retry_policy)
+
+    def test_runner(self):
+        with self.assertRaises(TypeError):
+            tasks.retry()(tasks.Runner(a_func))
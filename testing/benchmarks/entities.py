@@ -0,0 +1,62 @@
+"""Micro-benchmark of the entity model.
+
+Measures constructing instances one by one and in bulk out of registry
+records, and serialising them back, for 10k and 100k records.
+
+Usage: python testing/benchmarks/entities.py
+"""
+import sys
+import time
+from ice import entities
+
+SIZES = [10000, 100000]
+
+
+def make_items(amt):
+    return [
+        {
+            '_id': '%024x' % ind,
+            '_created': 'Tue, 18 Oct 2016 10:00:00 GMT',
+            '_updated': 'Tue, 18 Oct 2016 10:00:00 GMT',
+            '_etag': '%040x' % ind,
+            'session_id': '57f3a2d5e4b0a1b2c3d4e5f6',
+            'networks': [
+                {'addr': '10.0.%d.%d/16' % (ind >> 8 & 255, ind & 255),
+                 'iface': 'eth0', 'bcast_addr': '10.0.255.255'},
+                {'addr': '127.0.0.1/8', 'iface': 'lo'}
+            ],
+            'public_ip_addr': '80.10.%d.%d' % (ind >> 8 & 255, ind & 255),
+            'public_reverse_dns': 'host-%d.example.com' % ind,
+            'ssh_port': 22,
+            'ssh_username': 'ubuntu',
+            'ssh_authorized_fingerprint': 'ab:cd:ef',
+            'tags': {'role': 'worker', 'zone': 'zone-%d' % (ind % 3)}
+        } for ind in range(amt)
+    ]
+
+
+def measure(func):
+    start_time = time.time()
+    ret_val = func()
+    return time.time() - start_time, ret_val
+
+
+def main():
+    print('{:>8s} {:>14s} {:>14s} {:>14s}'.format(
+        'records', 'init (ms)', 'from_dicts (ms)', 'to_dict (ms)'
+    ))
+    for size in SIZES:
+        items = make_items(size)
+        init, _ = measure(
+            lambda: [entities.Instance(**item) for item in items]
+        )
+        bulk, insts = measure(lambda: entities.Instance.from_dicts(items))
+        to_dict, _ = measure(lambda: [inst.to_dict() for inst in insts])
+        print('{:8d} {:14.1f} {:14.1f} {:14.1f}'.format(
+            size, init * 1000, bulk * 1000, to_dict * 1000
+        ))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
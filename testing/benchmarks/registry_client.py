@@ -0,0 +1,78 @@
+"""Benchmark of the registry client call throughput.
+
+Starts a local registry server and measures calls/sec of the un-pooled
+module-level `requests` dispatch against the pooled `RegistryClient`. The
+`my_ip` endpoint is used, so no MongoDB server is required.
+
+Usage: python testing/benchmarks/registry_client.py [calls]
+"""
+import sys
+import random
+import threading
+import time
+import requests
+from ice.registry.client import RegistryClient, CfgRegistryClient
+from ice.registry.server import RegistryServer, CfgRegistryServer
+from ice.test.logger import get_dummy_logger
+
+
+class ServerThread(threading.Thread):
+    def __init__(self, server):
+        super(ServerThread, self).__init__()
+        self.server = server
+
+    def run(self):
+        self.server.run()
+
+
+def start_server():
+    port = random.randint(50000, 60000)
+    cfg = CfgRegistryServer(
+        host='localhost',
+        port=port,
+        mongo_host='localhost',
+        mongo_port=27017,
+        mongo_db='ice-benchmarks'
+    )
+    # No domains, so that MongoDB is not accessed to create indexes
+    server = RegistryServer(cfg, [], get_dummy_logger('ice-registry-server'))
+
+    thread = ServerThread(server)
+    thread.daemon = True
+    thread.start()
+
+    return port
+
+
+def measure(func, calls):
+    start_time = time.time()
+    for _ in range(calls):
+        func()
+    return calls / (time.time() - start_time)
+
+
+def main(calls):
+    port = start_server()
+    cfg = CfgRegistryClient('localhost', port)
+    client = RegistryClient(cfg)
+    if not client.ping_with_retries(10):
+        sys.stderr.write('Registry server did not start\n')
+        return 1
+
+    url = client._get_url('my_ip')
+    headers = {'User-Agent': 'iCE Client'}
+    unpooled = measure(lambda: requests.get(url, headers=headers), calls)
+    pooled = measure(client.get_my_ip, calls)
+
+    print('calls: {:d}'.format(calls))
+    print('un-pooled (requests.get): {:.1f} calls/sec'.format(unpooled))
+    print('pooled (RegistryClient):  {:.1f} calls/sec'.format(pooled))
+    print('speed-up: {:.2f}x'.format(pooled / unpooled))
+    return 0
+
+
+if __name__ == '__main__':
+    calls = 1000
+    if len(sys.argv) > 1:
+        calls = int(sys.argv[1])
+    sys.exit(main(calls))
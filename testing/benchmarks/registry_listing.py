@@ -0,0 +1,131 @@
+"""Benchmark of the instances listing latency against the collection size.
+
+Fills the instances collection with records of other (historical) sessions
+and measures how long listing the instances of a small session takes, with
+and without the MongoDB indexes of the instances domain.
+
+Requires a MongoDB server, e.g.: `docker run -d -p 27017:27017 mongo`.
+
+Usage: python testing/benchmarks/registry_listing.py [mongo_port]
+"""
+import sys
+import random
+import threading
+import time
+import pymongo
+from bson import objectid
+from ice import entities
+from ice.registry.client import RegistryClient, CfgRegistryClient
+from ice.registry.server import RegistryServer, CfgRegistryServer
+from ice.registry.server.domain.instances import InstancesDomain
+from ice.registry.server.domain.sessions import SessionsDomain
+from ice.test.logger import get_dummy_logger
+
+COLLECTION_SIZES = [1000, 10000, 100000]
+SESSION_SIZE = 50
+LISTINGS = 20
+
+
+class ServerThread(threading.Thread):
+    def __init__(self, server):
+        super(ServerThread, self).__init__()
+        self.server = server
+
+    def run(self):
+        self.server.run()
+
+
+def start_server(mongo_port, mongo_db):
+    port = random.randint(50000, 60000)
+    cfg = CfgRegistryServer(
+        host='localhost',
+        port=port,
+        mongo_host='localhost',
+        mongo_port=mongo_port,
+        mongo_db=mongo_db
+    )
+    server = RegistryServer(
+        cfg,
+        [InstancesDomain(), SessionsDomain()],
+        get_dummy_logger('ice-registry-server')
+    )
+
+    thread = ServerThread(server)
+    thread.daemon = True
+    thread.start()
+
+    return port
+
+
+def fill_collection(coll, amt):
+    docs = []
+    for ind in range(amt):
+        docs.append({
+            'session_id': objectid.ObjectId(),
+            'public_ip_addr': '10.%d.%d.%d' % (
+                (ind >> 16) & 255, (ind >> 8) & 255, ind & 255
+            ),
+            '_deleted': False
+        })
+        if len(docs) == 10000:
+            coll.insert_many(docs)
+            docs = []
+    if len(docs) > 0:
+        coll.insert_many(docs)
+
+
+def measure(client, sess):
+    start_time = time.time()
+    for _ in range(LISTINGS):
+        client.get_instances_list(sess)
+    return (time.time() - start_time) / LISTINGS * 1000
+
+
+def main(mongo_port):
+    mongo_db = 'ice-benchmarks-%d' % random.randint(10, 1000)
+    coll = pymongo.MongoClient('localhost', mongo_port)[mongo_db]['instances']
+
+    client = RegistryClient(
+        CfgRegistryClient(
+            'localhost', start_server(mongo_port, mongo_db),
+            cache_listings=False
+        )
+    )
+    if not client.ping_with_retries(10):
+        sys.stderr.write('Registry server did not start\n')
+        return 1
+
+    sess = entities.Session(client_ip_addr='127.0.0.1')
+    client.submit_session(sess)
+    client.submit_instances([
+        entities.Instance(
+            session_id=sess.id, public_ip_addr='127.0.0.%d' % (ind + 1)
+        ) for ind in range(SESSION_SIZE)
+    ])
+
+    print('{:>12s} {:>14s} {:>14s}'.format(
+        'collection', 'indexed (ms)', 'no index (ms)'
+    ))
+    filled = 0
+    for size in COLLECTION_SIZES:
+        fill_collection(coll, size - filled)
+        filled = size
+
+        indexed = measure(client, sess)
+        for name in InstancesDomain().get_indexes():
+            coll.drop_index(name)
+        not_indexed = measure(client, sess)
+        for name, value in InstancesDomain().get_indexes().items():
+            coll.create_index(value, name=name)
+
+        print('{:12d} {:14.2f} {:14.2f}'.format(size, indexed, not_indexed))
+
+    coll.database.client.drop_database(mongo_db)
+    return 0
+
+
+if __name__ == '__main__':
+    mongo_port = 27017
+    if len(sys.argv) > 1:
+        mongo_port = int(sys.argv[1])
+    sys.exit(main(mongo_port))
@@ -33,6 +33,13 @@ def step_impl(context, exp_path, task_name, session_key):
 
     ssh_cfg = experiment.CfgSSH('root', path.join(ASSETS_PATH, 'id_rsa'))
     res = exp.run(instances, ssh_cfg, task_name)
+    exp.close()
+    for host_res in res.get_failed():
+        raise AssertionError(
+            'Failed to get hostname of `{:s}`: {:s}'.format(
+                host_res.host_string, str(host_res.error)
+            )
+        )
     for key, val in res.items():
         if val.failed:
             raise AssertionError(